@@ -3,24 +3,386 @@
         1. `scrappers.py` - Scraps Minecraft server IPs and ports from various online server listing sources.
         2. `data.py` - Saves the scrapped servers to database. No status is checked yet.
         3. `pinger.py` - Asynchronously ping multiple servers at once from the database and save the results.
+
+    Commands import the modules they need when they run, so short (cron driven) runs such as `ping` or `stats` don't pay
+    for the scrappers (requests, bs4, lxml), mcstatus, dnspython or pyarrow.
 """
 
+import typing as t
+
+import asyncio
+import logging
 import typer
+from datetime import timedelta
+
+from pathlib import Path
 
-from mst.data import ping_from_all_scrappers_and_save
+from mst.settings import (
+    BENCHMARK_RESULTS_PATH, COMPACTION_CHUNK_SIZE, COORDINATOR_HOST, COORDINATOR_PORT, COORDINATOR_UNIT_SIZE, COORDINATOR_LEASE_TIMEOUT, DATABASE_PROFILE, DEDUPE_BLOOM_CAPACITY, EXPORT_PATH, EXPORT_CHUNK_SIZE, EXPORT_FORMAT, EXPORT_COMPRESSION, METRICS_PORT, METRICS_LOG_INTERVAL, PING_CONCURRENCY, PING_TIMEOUT, PING_RATE_LIMIT,
+    PIPELINE_QUEUE_SIZE, PIPELINE_REPORT_INTERVAL, SWEEP_SHARDS
+)
+
+if t.TYPE_CHECKING:
+    from mst.resolver import Resolver
 
 
 CLI = typer.Typer()
+BENCHMARK_CLI = typer.Typer(help="Measure scrapping, pinging and saving against local fake servers and compare the results.")
+CLI.add_typer(BENCHMARK_CLI, name='benchmark')
+
+
+
+def _resolver() -> 'Resolver':
+    from mst.resolver import Resolver # dnspython is only imported with `--resolve-dns`
+
+    return Resolver()
+
+
+
+def _given(**options: t.Any) -> t.Dict[str, t.Any]:
+    """
+        Options given on the command line (`None` - not given, the default of the called function applies).
+    """
+
+    return {name: value for name, value in options.items() if value is not None}
+
+
+
+@CLI.callback()
+def main(
+    context: typer.Context,
+    db_profile: str=typer.Option(DATABASE_PROFILE, help="SQLite tuning profile: `default`, `bulk-ingest` or `concurrent-read`"),
+    metrics_port: t.Optional[int]=typer.Option(METRICS_PORT, help="Serve Prometheus metrics on http://127.0.0.1:<port>/metrics"),
+    metrics_log_interval: t.Optional[float]=typer.Option(METRICS_LOG_INTERVAL, help="Log all metrics as a JSON line every N seconds"),
+    record_storage: t.Optional[str]=typer.Option(None, help="Switch the database to saving new records as `full` or `compact` ones (deduplicated texts, static fields only when they change), the database remembers it"),
+    profile: t.Optional[Path]=typer.Option(None, help="Profile the run into this directory: sampled stacks of the event loop (flame graph input), time spent in every stage and slow callbacks"),
+):
+    if db_profile != DATABASE_PROFILE:
+        from mst.orm import DATABASE, configure_database
+        configure_database(DATABASE, db_profile)
+
+    if record_storage is not None:
+        from mst.orm import DATABASE
+        from mst.storage import set_record_storage
+        set_record_storage(DATABASE, record_storage)
+
+    if metrics_port is not None:
+        from mst.metrics import start_metrics_server
+        start_metrics_server(metrics_port)
+
+    if metrics_log_interval:
+        from mst.metrics import MetricsLogger
+
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        metrics_logger = MetricsLogger(metrics_log_interval)
+        metrics_logger.start()
+        context.call_on_close(metrics_logger.stop)
+
+    if profile is not None:
+        from mst.profiling import Profiler
+
+        profiler = Profiler(profile)
+        profiler.start()
+        context.call_on_close(lambda: print(profiler.stop()))
 
 
 @CLI.command()
-def all():
-    asyncio.run(ping_from_all_scrappers_and_save())
-    
+def all(
+    mode: str=typer.Option('batch', help="`batch` (groups of 25) or `window` (sliding window of `--concurrency` pings)"),
+    async_scrap: bool=typer.Option(False, help="Scrap all server lists concurrently and ping servers as soon as their page is ready"),
+    concurrency: int=typer.Option(PING_CONCURRENCY, help="Max. pings in flight (window mode)"),
+    timeout: float=typer.Option(PING_TIMEOUT, help="Per-host ping deadline in seconds (window mode)"),
+    rate_limit: t.Optional[float]=typer.Option(PING_RATE_LIMIT, help="Max. pings started per second (window mode)"),
+    resolve_dns: bool=typer.Option(False, help="Resolve addresses through a shared DNS cache (with SRV support) before pinging (window mode)"),
+    page_cache: bool=typer.Option(False, help="Skip server list pages that didn't change since the last run (ETag, Last-Modified, content hash)"),
+    incremental: bool=typer.Option(False, help="Stop paging server lists sorted by recency at servers known from previous runs"),
+    resume: bool=typer.Option(False, help="Continue every server list where an interrupted run stopped, without scrapping saved pages again"),
+):
+    from mst.cache import PageCache
+    from mst.data import ping_from_all_scrappers_and_save
+    from mst.metrics import monitored
+    from mst.queries import load_known_servers
+
+    asyncio.run(monitored(ping_from_all_scrappers_and_save(
+        mode=mode, async_scrap=async_scrap, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolver=_resolver() if resolve_dns else None,
+        cache=PageCache() if page_cache else None, known_servers=load_known_servers if incremental else None, resume=resume
+    )))
+
+
+
+@CLI.command()
+def scrape(
+    async_scrap: bool=typer.Option(False, help="Scrap all server lists concurrently"),
+    page_cache: bool=typer.Option(False, help="Skip server list pages that didn't change since the last run (ETag, Last-Modified, content hash)"),
+    incremental: bool=typer.Option(False, help="Stop paging server lists sorted by recency at servers known from previous runs"),
+):
+    """
+        Scrap servers from all server lists and save them without pinging.
+    """
+
+    from mst.cache import PageCache
+    from mst.data import scrap_from_all_scrappers_and_save
+    from mst.metrics import monitored
+    from mst.queries import load_known_servers
+
+    asyncio.run(monitored(scrap_from_all_scrappers_and_save(
+        async_scrap=async_scrap, cache=PageCache() if page_cache else None, known_servers=load_known_servers if incremental else None
+    )))
+
+
+
+@CLI.command()
+def ping(
+    mode: str=typer.Option('batch', help="`batch` (groups of 25) or `window` (sliding window of `--concurrency` pings)"),
+    concurrency: int=typer.Option(PING_CONCURRENCY, help="Max. pings in flight (window mode)"),
+    timeout: float=typer.Option(PING_TIMEOUT, help="Per-host ping deadline in seconds (window mode)"),
+    rate_limit: t.Optional[float]=typer.Option(PING_RATE_LIMIT, help="Max. pings started per second (window mode)"),
+    stale_after: t.Optional[float]=typer.Option(None, help="Only ping servers without a record from the last N hours"),
+    online_only: bool=typer.Option(False, help="Only ping servers that answered a ping at least once"),
+    source: t.Optional[str]=typer.Option(None, help="Only ping servers listed by this source"),
+    resolve_dns: bool=typer.Option(False, help="Resolve addresses through a shared DNS cache (with SRV support) before pinging (window mode)"),
+    scheduled: bool=typer.Option(False, help="Only ping servers that are due according to their re-ping schedule (can't be combined with filters)"),
+    budget: t.Optional[int]=typer.Option(None, help="Max. number of servers to ping (with `--scheduled`)"),
+    resume: bool=typer.Option(False, help="Continue where an interrupted run stopped, without pinging saved servers again (scheduled runs resume by themselves)"),
+):
+    """
+        Ping servers saved in the database and save the results.
+    """
+
+    from mst.data import ping_and_update
+    from mst.metrics import monitored
+
+    asyncio.run(monitored(ping_and_update(
+        mode=mode, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolver=_resolver() if resolve_dns else None,
+        scheduled=scheduled, budget=budget, resume=resume,
+        stale_after=timedelta(hours=stale_after) if stale_after is not None else None, online_only=online_only, source=source
+    )))
+
+
+
+@CLI.command()
+def sweep(
+    shards: t.Optional[int]=typer.Option(SWEEP_SHARDS, help="Number of worker processes (one per CPU core by default)"),
+    concurrency: int=typer.Option(PING_CONCURRENCY, help="Max. pings in flight per worker"),
+    timeout: float=typer.Option(PING_TIMEOUT, help="Per-host ping deadline in seconds"),
+    rate_limit: t.Optional[float]=typer.Option(PING_RATE_LIMIT, help="Max. pings started per second by all workers together"),
+    stale_after: t.Optional[float]=typer.Option(None, help="Only ping servers without a record from the last N hours"),
+    online_only: bool=typer.Option(False, help="Only ping servers that answered a ping at least once"),
+    source: t.Optional[str]=typer.Option(None, help="Only ping servers listed by this source"),
+    resolve_dns: bool=typer.Option(False, help="Resolve addresses through a DNS cache (with SRV support) in every worker before pinging"),
+):
+    """
+        Ping all servers saved in the database with one worker process per shard of the servers table and save the results.
+    """
+
+    from mst.metrics import monitored
+    from mst.sweep import sweep as sweep_database
+
+    pinged = asyncio.run(monitored(sweep_database(
+        shards=shards, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolve_dns=resolve_dns,
+        stale_after=timedelta(hours=stale_after) if stale_after is not None else None, online_only=online_only, source=source
+    )))
+    print(f"Pinged {pinged} servers")
+
+
+
+@CLI.command()
+def coordinate(
+    host: str=typer.Option(COORDINATOR_HOST, help="Address to serve workers on (the protocol has no authentication, keep it on a trusted network)"),
+    port: int=typer.Option(COORDINATOR_PORT, help="Port to serve workers on"),
+    unit_size: int=typer.Option(COORDINATOR_UNIT_SIZE, help="Servers per work unit"),
+    lease_timeout: float=typer.Option(COORDINATOR_LEASE_TIMEOUT, help="Seconds without results after which a unit is given to another worker"),
+    stale_after: t.Optional[float]=typer.Option(None, help="Only ping servers without a record from the last N hours"),
+    online_only: bool=typer.Option(False, help="Only ping servers that answered a ping at least once"),
+    source: t.Optional[str]=typer.Option(None, help="Only ping servers listed by this source"),
+):
+    """
+        Lease work units of the servers table to workers (`work`, on this or other machines) and save their results.
+    """
+
+    from mst.coordinator import coordinate as coordinate_sweep
+    from mst.metrics import monitored
+
+    pinged = asyncio.run(monitored(coordinate_sweep(
+        host=host, port=port, unit_size=unit_size, lease_timeout=lease_timeout,
+        stale_after=timedelta(hours=stale_after) if stale_after is not None else None, online_only=online_only, source=source
+    )))
+    print(f"Pinged {pinged} servers")
+
+
+
+@CLI.command()
+def work(
+    coordinator: str=typer.Option(f'http://{COORDINATOR_HOST}:{COORDINATOR_PORT}', help="URL of the coordinator"),
+    name: t.Optional[str]=typer.Option(None, help="Name of this worker (<hostname>-<PID> by default)"),
+    concurrency: int=typer.Option(PING_CONCURRENCY, help="Max. pings in flight"),
+    timeout: float=typer.Option(PING_TIMEOUT, help="Per-host ping deadline in seconds"),
+    rate_limit: t.Optional[float]=typer.Option(PING_RATE_LIMIT, help="Max. pings started per second"),
+    resolve_dns: bool=typer.Option(False, help="Resolve addresses through a DNS cache (with SRV support) before pinging"),
+):
+    """
+        Ping work units leased from a coordinator (`coordinate`) until its sweep is finished.
+    """
+
+    from mst.coordinator import run_worker
+    from mst.metrics import monitored
+
+    pinged = asyncio.run(monitored(run_worker(
+        coordinator, name=name, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolve_dns=resolve_dns
+    )))
+    print(f"Pinged {pinged} servers")
+
+
+
+@CLI.command()
+def pipeline(
+    ping_workers: int=typer.Option(PING_CONCURRENCY, help="Number of ping workers"),
+    timeout: float=typer.Option(PING_TIMEOUT, help="Per-host ping deadline in seconds"),
+    rate_limit: t.Optional[float]=typer.Option(PING_RATE_LIMIT, help="Max. pings started per second"),
+    queue_size: int=typer.Option(PIPELINE_QUEUE_SIZE, help="Max. items waiting between two stages"),
+    report_interval: float=typer.Option(PIPELINE_REPORT_INTERVAL, help="How often to print stage statistics (in seconds)"),
+    seed_from_database: bool=typer.Option(False, help="Only ping servers that aren't in the database yet"),
+    bloom_capacity: t.Optional[int]=typer.Option(DEDUPE_BLOOM_CAPACITY, help="Deduplicate with a Bloom filter sized for this many servers (instead of an exact set)"),
+    resolve_dns: bool=typer.Option(False, help="Resolve addresses through a shared DNS cache (with SRV support) before pinging"),
+    page_cache: bool=typer.Option(False, help="Skip server list pages that didn't change since the last run (ETag, Last-Modified, content hash)"),
+    incremental: bool=typer.Option(False, help="Stop paging server lists sorted by recency at servers known from previous runs"),
+):
+    """
+        Scrap, dedupe, ping and save servers with all stages running at the same time.
+    """
+
+    from mst.cache import PageCache
+    from mst.data import run_pipeline
+    from mst.dedupe import ServerDeduplicator
+    from mst.metrics import monitored
+
+    asyncio.run(monitored(run_pipeline(
+        ping_workers=ping_workers, ping_timeout=timeout, ping_rate_limit=rate_limit, queue_size=queue_size, report_interval=report_interval,
+        deduplicator=ServerDeduplicator(bloom_capacity=bloom_capacity), seed_from_database=seed_from_database, resolver=_resolver() if resolve_dns else None,
+        page_cache=PageCache() if page_cache else None, incremental=incremental
+    )))
+
+
+
+@CLI.command()
+def stats(
+    since: float=typer.Option(24, help="Count servers and players seen in the last N hours"),
+):
+    """
+        Print row counts of the database, how many servers are due for a ping and what was seen recently.
+    """
+
+    from mst.queries import database_stats
+
+    for name, value in database_stats(since=timedelta(hours=since)).items():
+        print(f"{name}: {value}")
+
+
+
+@CLI.command()
+def compact(
+    chunk_size: int=typer.Option(COMPACTION_CHUNK_SIZE, help="Records converted in one transaction"),
+    vacuum: bool=typer.Option(True, help="Give the freed space back to the file system (rewrites the whole database file)"),
+):
+    """
+        Convert full records of the database into compact ones and save new records as compact ones from now on.
+    """
+
+    from mst.storage import compact_records
+
+    for name, value in compact_records(chunk_size=chunk_size, vacuum=vacuum).items():
+        print(f"{name}: {value}")
+
+
+
+@CLI.command()
+def export(
+    path: Path=typer.Option(EXPORT_PATH, help="Directory of the export (new rows are appended to an existing one)"),
+    table: t.Optional[t.List[str]]=typer.Option(None, help="Tables to export (can be repeated, all by default): rs_player_server_records, server_records, players, servers"),
+    format: str=typer.Option(EXPORT_FORMAT, help="`parquet` or `arrow` (Arrow IPC)"),
+    compression: str=typer.Option(EXPORT_COMPRESSION, help="Compression codec"),
+    chunk_size: int=typer.Option(EXPORT_CHUNK_SIZE, help="Rows read and written at once"),
+):
+    """
+        Export servers, records and players into compressed columnar files partitioned by date (needs pyarrow).
+    """
+
+    from mst.export import export_database
+
+    exported = export_database(path, tables=table or None, format=format, compression=compression, chunk_size=chunk_size)
+
+    for name, rows in exported.items():
+        print(f"{name}: {rows} rows")
+
+
+
+@BENCHMARK_CLI.command('run')
+def benchmark_run(
+    scenario: t.List[str]=typer.Option(['pipeline'], help="Scenarios to run (can be repeated): scrap, ping, status, write, pipeline"),
+    hosts: t.Optional[int]=typer.Option(None, help="Number of fake Minecraft servers"),
+    latency_min: t.Optional[float]=typer.Option(None, help="Min. latency of a fake server in seconds"),
+    latency_max: t.Optional[float]=typer.Option(None, help="Max. latency of a fake server in seconds"),
+    timeout_ratio: t.Optional[float]=typer.Option(None, help="Share of fake servers that never answer"),
+    offline_ratio: t.Optional[float]=typer.Option(None, help="Share of fake servers that close connections right away"),
+    players: t.Optional[int]=typer.Option(None, help="Max. size of the player sample of a fake server"),
+    pages: t.Optional[int]=typer.Option(None, help="Pages of every fake server list"),
+    page_latency: t.Optional[float]=typer.Option(None, help="Response time of the fake server lists in seconds"),
+    ping_concurrency: t.Optional[int]=typer.Option(None, help="Max. pings in flight"),
+    ping_timeout: t.Optional[float]=typer.Option(None, help="Per-host ping deadline in seconds"),
+    ping_client: t.Optional[str]=typer.Option(None, help="Server List Ping client: `native` or `mcstatus`"),
+    seed: t.Optional[int]=typer.Option(None, help="Seed of the random behaviour of the fake servers"),
+    results: Path=typer.Option(BENCHMARK_RESULTS_PATH, help="JSON lines file the results are appended to"),
+    db_profile: str=typer.Option(DATABASE_PROFILE, help="SQLite tuning profile of the benchmark databases"),
+):
+    """
+        Run benchmark scenarios against local fake servers and save the results (options default to `benchmark.BenchmarkOptions`).
+    """
+
+    from mst.benchmark import BenchmarkOptions, run_benchmarks
+
+    run_benchmarks(scenario, BenchmarkOptions(**_given(
+        hosts=hosts, latency_min=latency_min, latency_max=latency_max, timeout_ratio=timeout_ratio, offline_ratio=offline_ratio, players=players,
+        pages=pages, page_latency=page_latency, ping_concurrency=ping_concurrency, ping_timeout=ping_timeout, ping_client=ping_client,
+        db_profile=db_profile, seed=seed
+    )), results_path=results)
+
+
+
+@BENCHMARK_CLI.command('parse')
+def benchmark_parse(
+    pages_path: t.Optional[Path]=typer.Option(None, help="Directory with saved pages (<source>/*.html), generated pages if not given"),
+    pages: t.Optional[int]=typer.Option(None, help="Generated pages of every server list"),
+    page_padding: t.Optional[int]=typer.Option(None, help="Approx. size of extra markup on every generated page (in bytes)"),
+    repeat: int=typer.Option(5, help="Parse every page this many times (the fastest round counts)"),
+    results: Path=typer.Option(BENCHMARK_RESULTS_PATH, help="JSON lines file the result is appended to"),
+):
+    """
+        Compare parsing of server list pages with BeautifulSoup and with compiled XPath on lxml.
+    """
+
+    from mst.benchmark import BenchmarkOptions, benchmark_parsing
+
+    benchmark_parsing(pages_path, BenchmarkOptions(**_given(pages=pages, page_padding=page_padding)), repeat=repeat, results_path=results)
+
+
+
+@BENCHMARK_CLI.command('compare')
+def benchmark_compare(
+    baseline: t.Optional[str]=typer.Argument(None, help="Run to compare against (the second to last one by default)"),
+    candidate: t.Optional[str]=typer.Argument(None, help="Run to compare (the last one by default)"),
+    results: Path=typer.Option(BENCHMARK_RESULTS_PATH, help="JSON lines file with saved results"),
+):
+    """
+        Compare metrics of two saved benchmark runs.
+    """
+
+    from mst.benchmark import compare_runs
+
+    print(compare_runs(baseline, candidate, results_path=results))
+
 
 
 if __name__ == "__main__":
-    import asyncio
     try:
         import uvloop # type: ignore
     except ImportError:
@@ -0,0 +1,736 @@
+"""
+    Benchmarks of the scrapping, pinging and saving code against local stand-ins, so changes can be measured without the internet.
+
+    The stand-ins run in their own process (so they don't compete with the measured code for the GIL):
+        - A fake Minecraft status server - one listener answering Server List Pings for thousands of hosts (`127.1.x.x` addresses,
+        Linux routes the whole `127.0.0.0/8` to the loopback), where every host has its own latency, player sample and can
+        time out or be offline
+        - A fake HTTP server with generated pages of every server list (`ALL_SCRAPPERS`) that list the fake hosts
+
+    Every scenario runs in a fresh process (so its peak RSS is its own) with a temporary database and its results are appended
+    to a JSON lines file (`settings.BENCHMARK_RESULTS_PATH`), where runs can be compared with `compare_runs`.
+"""
+
+import typing as t
+
+import asyncio
+import json
+import multiprocessing
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ipaddress import IPv4Address
+from pathlib import Path
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+from peewee import Database
+
+from mst.data import BufferedDatabaseWriter, DatabaseWriterThread, Pipeline, save_many_into_database
+from mst.orm import ALL_MODELS, DB_ServerRecord, Server, initialize_database
+from mst.pinger import PingedPlayer, PingedPlayerList, PingedServer, PingedServerStatus, ping_all, ping_window
+from mst.scrappers import (
+    ALL_SCRAPPERS, MinecraftListScrapper, MinecraftMPScrapper, MinecraftServerListScrapper, MinecraftServersListScrapper, MinecraftServersScrapper,
+    ServerListScrapper, ServersMinecraftScrapper, async_scrap_from_all_scrappers
+)
+from mst.settings import BENCHMARK_RESULTS_PATH, DATABASE_PROFILE, PING_CLIENT, PING_CONCURRENCY, ROOT_PATH, SCRAP_CONCURRENCY
+
+
+_FIRST_HOST = int(IPv4Address('127.1.0.0'))
+
+
+
+@dataclass
+class BenchmarkOptions:
+    """
+        - `hosts` - Number of fake Minecraft servers (all of them are listed by the fake server lists)
+        - `latency_min`, `latency_max` - Range of the latencies (in seconds) of the fake servers
+        - `timeout_ratio` - Share of the fake servers that never answer (pings time out after `ping_timeout`)
+        - `offline_ratio` - Share of the fake servers that close connections right away
+        - `players` - Max. size of the player sample of a fake server
+        - `pages` - Pages of every fake server list
+        - `page_latency` - How long the fake HTTP server takes to answer (in seconds)
+        - `page_padding` - Approx. size of extra markup on every page (in bytes) - real pages are mostly ads and styling
+        - `ping_client` - Server List Ping client (`native` or `mcstatus`, see `pinger.get_status`)
+        - `seed` - Seed of the random behaviour of the fake servers
+    """
+
+    hosts: int = 2000
+    latency_min: float = 0.0
+    latency_max: float = 0.1
+    timeout_ratio: float = 0.05
+    offline_ratio: float = 0.1
+    players: int = 12
+    pages: int = 10
+    page_latency: float = 0.05
+    page_padding: int = 50000
+    ping_concurrency: int = PING_CONCURRENCY
+    ping_timeout: float = 2.0
+    ping_client: str = PING_CLIENT
+    scrap_concurrency: int = SCRAP_CONCURRENCY
+    db_profile: str = DATABASE_PROFILE
+    seed: int = 0
+
+
+
+def fake_host(index: int) -> str:
+    return str(IPv4Address(_FIRST_HOST + index))
+
+
+
+@dataclass
+class _Behaviour:
+    latency: float
+    players: int
+    times_out: bool
+    offline: bool
+
+
+
+def _behaviour(options: BenchmarkOptions, index: int) -> _Behaviour:
+    rng = random.Random(options.seed * 1000003 + index)
+    roll = rng.random()
+
+    return _Behaviour(
+        latency=rng.uniform(options.latency_min, options.latency_max),
+        players=rng.randint(0, options.players),
+        times_out=roll < options.timeout_ratio,
+        offline=options.timeout_ratio <= roll < options.timeout_ratio + options.offline_ratio
+    )
+
+
+
+# Fake Minecraft status server (https://wiki.vg/Server_List_Ping):
+
+def _varint(number: int) -> bytes:
+    out = bytearray()
+
+    while True:
+        byte = number & 0x7F
+        number >>= 7
+        out.append(byte | (0x80 if number else 0))
+
+        if not number:
+            return bytes(out)
+
+
+
+async def _read_packet(reader: asyncio.StreamReader) -> bytes:
+    length = 0
+
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << (7 * i)
+
+        if not byte & 0x80:
+            break
+
+    return await reader.readexactly(length)
+
+
+
+def _status_packet(options: BenchmarkOptions, index: int, behaviour: _Behaviour) -> bytes:
+    body = json.dumps({
+        'version': {'name': '1.19.2', 'protocol': 760},
+        'players': {
+            'max': 100,
+            'online': behaviour.players,
+            'sample': [{'name': f'p{index}_{player}', 'id': str(uuid.UUID(int=(index << 16) + player))} for player in range(behaviour.players)]
+        },
+        'description': {'text': f"Benchmark server #{index}"}
+    }).encode()
+    payload = _varint(0) + _varint(len(body)) + body
+
+    return _varint(len(payload)) + payload
+
+
+
+async def _handle_status(options: BenchmarkOptions, answered: t.Any, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        # The listener is bound to all interfaces (to get all 127.x addresses), don't talk to anyone else:
+        if not IPv4Address(writer.get_extra_info('peername')[0]).is_loopback:
+            return
+
+        index = int(IPv4Address(writer.get_extra_info('sockname')[0])) - _FIRST_HOST
+        behaviour = _behaviour(options, index)
+        if behaviour.offline:
+            return
+
+        await _read_packet(reader) # Handshake
+        await _read_packet(reader) # Status request
+
+        if behaviour.times_out:
+            await reader.read() # Until the client gives up
+            return
+
+        await asyncio.sleep(behaviour.latency)
+        writer.write(_status_packet(options, index, behaviour))
+        await writer.drain()
+
+        ping = await _read_packet(reader)
+        await asyncio.sleep(behaviour.latency)
+        writer.write(_varint(len(ping)) + ping)
+        await writer.drain()
+
+        with answered.get_lock():
+            answered.value += 1
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+    finally:
+        writer.close()
+
+
+
+# Fake server lists (the markup matches the selectors of every scrapper):
+
+def _filler(size: int) -> str:
+    return '<p class="ad">Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>' * (size // 64)
+
+
+def _pagination(pages: int, last_link: str) -> str:
+    return f'<ul class="pagination"><li><a href="{last_link}1">1</a></li><li><a href="{last_link}{pages + 1}">{pages + 1}</a></li><li><a href="#">&raquo;</a></li></ul>'
+
+
+_PAGE_TEMPLATES: t.Dict[t.Type[ServerListScrapper], t.Tuple[str, t.Callable[[t.List[str], int], str]]] = {
+    MinecraftMPScrapper: ('minecraft-mp.com', lambda addresses, pages: (
+        '<div class="container"><table><tbody>'
+        + ''.join(f'<tr><td>{i}</td><td><strong>{address}</strong></td></tr>' for i, address in enumerate(addresses))
+        + '</tbody></table></div>'
+    )),
+    MinecraftServerListScrapper: ('minecraft-server-list.com', lambda addresses, pages: (
+        '<div class="serverdatadiv1"><table><tbody>'
+        + ''.join(f'<tr><td class="n1">{i}</td><td class="n2" id="{address}">{address}</td></tr>' for i, address in enumerate(addresses))
+        + f'</tbody></table></div><div class="paginate"><ul><li><a href="/sort/PopularAllTime/page/1/">1</a></li>'
+        + f'<li><a href="/sort/PopularAllTime/page/{pages + 1}/">Last</a></li></ul></div>'
+    )),
+    MinecraftServersScrapper: ('minecraftservers.org', lambda addresses, pages: (
+        ''.join(f'<div class="server-ip"><button data-clipboard-text="{address}">Copy</button></div>' for address in addresses)
+    )),
+    ServersMinecraftScrapper: ('servers-minecraft.com', lambda addresses, pages: (
+        ''.join(f'<div class="banner-ip"><button class="copy" data-clipboard-text="{address}">Copy</button></div>' for address in addresses)
+        + f'<ul class="pagination"><li><a href="/page/1">1</a></li><li><a href="/page/{pages + 1}">&raquo;</a></li></ul>'
+    )),
+    MinecraftListScrapper: ('minecraftlist.org', lambda addresses, pages: (
+        ''.join(f'<div class="mcp-banner"><input class="server-address" value="{address}"></div>' for address in addresses)
+        + _pagination(pages, '?page=')
+    )),
+    MinecraftServersListScrapper: ('minecraft-servers-list.org', lambda addresses, pages: (
+        '<div class="container"><table>'
+        + ''.join(f'<tr><td><span class="copy-ip-trigger" data-clipboard-text="{address}">Copy</span></td></tr>' for address in addresses)
+        + '</table><div class="footer"></div></div>'
+        + _pagination(pages, '/rank/')
+    ))
+}
+"""Source name and page generator (addresses on the page, number of pages) of every scrapper."""
+
+
+
+def _render_pages(options: BenchmarkOptions, port: int) -> t.Dict[str, bytes]:
+    """
+        Generates `options.pages` pages of every server list (each list gets every n-th fake host) plus an empty page after the last one.
+    """
+
+    rendered: t.Dict[str, bytes] = {}
+    per_page = -(-options.hosts // (len(_PAGE_TEMPLATES) * options.pages))
+
+    for list_index, (source, template) in enumerate(_PAGE_TEMPLATES.values()):
+        addresses = [f'{fake_host(index)}:{port}' for index in range(list_index, options.hosts, len(_PAGE_TEMPLATES))]
+
+        for page in range(1, options.pages + 2):
+            markup = template(addresses[(page - 1) * per_page:page * per_page], options.pages)
+            rendered[f'/{source}/{page}'] = f'<!DOCTYPE html><html><head><title>{source}</title></head><body>{markup}{_filler(options.page_padding)}</body></html>'.encode()
+
+    return rendered
+
+
+
+def _serve_http(options: BenchmarkOptions, status_port: int, served: t.Any) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            source, _, page = self.path.strip('/').partition('/')
+            body = pages.get(self.path) or (pages[f'/{source}/{options.pages + 1}'] if f'/{source}/1' in pages and page.isdigit() else None)
+
+            time.sleep(options.page_latency)
+
+            if body is None:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+            with served.get_lock():
+                served.value += 1
+
+
+        def log_message(self, *_) -> None:
+            pass
+
+
+    pages = _render_pages(options, status_port)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mst-benchmark-http', daemon=True).start()
+
+    return server
+
+
+
+def _run_stand_ins(options: BenchmarkOptions, ports: t.Any, stop: t.Any, answered: t.Any, served: t.Any) -> None:
+    async def serve() -> None:
+        status_server = await asyncio.start_server(lambda reader, writer: _handle_status(options, answered, reader, writer), '0.0.0.0', 0, backlog=4096)
+        status_port = status_server.sockets[0].getsockname()[1]
+        http_server = _serve_http(options, status_port, served)
+
+        ports.put((status_port, http_server.server_address[1]))
+
+        async with status_server:
+            await asyncio.get_running_loop().run_in_executor(None, stop.wait)
+
+        http_server.shutdown()
+
+
+    asyncio.run(serve())
+
+
+
+class StandIns():
+    """
+        Starts the fake status server and the fake server lists in a separate process (use it as a context manager).
+
+        - `status_port` - Port of the fake status server (on all `fake_host` addresses)
+        - `http_port` - Port of the fake server lists (on `127.0.0.1`)
+        - `answered`, `served` - Shared counters of answered pings and served pages
+    """
+
+    def __init__(self, options: BenchmarkOptions) -> None:
+        context = multiprocessing.get_context('spawn')
+
+        self.options = options
+        self.answered = context.Value('q', 0)
+        self.served = context.Value('q', 0)
+        self.status_port: t.Optional[int] = None
+        self.http_port: t.Optional[int] = None
+
+        self._ports = context.Queue()
+        self._stop = context.Event()
+        self._process = context.Process(
+            target=_run_stand_ins, args=(options, self._ports, self._stop, self.answered, self.served), name='mst-benchmark-stand-ins', daemon=True
+        )
+
+
+    def __enter__(self) -> 'StandIns':
+        self._process.start()
+        self.status_port, self.http_port = self._ports.get(timeout=60)
+
+        return self
+
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._process.join(timeout=10)
+
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+
+def fake_scrappers(http_port: int) -> t.List[t.Type[ServerListScrapper]]:
+    """
+        Subclasses of all `ALL_SCRAPPERS` that scrap the fake server lists on `http_port` instead of the real ones.
+    """
+
+    def fake(scrapper: t.Type[ServerListScrapper], source: str) -> t.Type[ServerListScrapper]:
+        def __init__(self, **kwargs) -> None:
+            ServerListScrapper.__init__(self, url_template=f'http://127.0.0.1:{http_port}/{source}/{{page:d}}', source=source, **kwargs)
+
+        return type(f'Fake{scrapper.__name__}', (scrapper,), {'__init__': __init__})
+
+
+    return [fake(scrapper, _PAGE_TEMPLATES[scrapper][0]) for scrapper in ALL_SCRAPPERS]
+
+
+
+# Scenarios - every one gets its own empty database, `prepare` isn't measured, `run` returns counts of processed items:
+
+def _fake_servers(options: BenchmarkOptions, status_port: int) -> t.List[Server]:
+    return [Server(host=fake_host(index), port=status_port, source='benchmark') for index in range(options.hosts)]
+
+
+async def _run_scrap(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database, _) -> t.Dict[str, int]:
+    servers = 0
+
+    async for page in async_scrap_from_all_scrappers(fake_scrappers(stand_ins['http_port']), concurrency=options.scrap_concurrency, delay=0):
+        servers += len(page)
+
+    return {'servers': servers}
+
+
+def _prepare_ping(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database) -> None:
+    save_many_into_database(_fake_servers(options, stand_ins['status_port']), database=database)
+
+
+async def _run_ping(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database, _) -> t.Dict[str, int]:
+    pings = 0
+
+    async with DatabaseWriterThread(database=database) as writer:
+        async for statuses in ping_all(from_database=database, at_once=500, mode='window', concurrency=options.ping_concurrency, timeout=options.ping_timeout, client=options.ping_client):
+            await writer.put_many(statuses)
+            pings += len(statuses)
+
+    return {'pings': pings}
+
+
+def _prepare_status(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database) -> t.List[Server]:
+    return _fake_servers(options, stand_ins['status_port'])
+
+
+async def _run_status(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database, servers: t.List[Server]) -> t.Dict[str, int]:
+    pings = 0
+
+    # Pings only (nothing is saved), so `cpu_ms_per_ping` is the cost of the ping client:
+    async for statuses in ping_window(servers, concurrency=options.ping_concurrency, timeout=options.ping_timeout, client=options.ping_client):
+        pings += len(statuses)
+
+    return {'pings': pings}
+
+
+def _prepare_write(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database) -> t.List[PingedServer]:
+    servers = []
+
+    for server in _fake_servers(options, stand_ins['status_port']):
+        index = int(IPv4Address(server.host)) - _FIRST_HOST
+        behaviour = _behaviour(options, index)
+        players = [PingedPlayer(uuid=str(uuid.UUID(int=(index << 16) + player)), username=f'p{index}_{player}') for player in range(behaviour.players)]
+
+        servers.append(PingedServer(
+            source=server.source, host=server.host, port=server.port, online=True,
+            status=PingedServerStatus(description=f"Benchmark server #{index}", version='1.19.2', latency=behaviour.latency * 1000, players=PingedPlayerList(max=100, online=len(players), list=players), is_modded=False)
+        ))
+
+    return servers
+
+
+async def _run_write(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database, servers: t.List[PingedServer]) -> t.Dict[str, int]:
+    def write() -> None:
+        with BufferedDatabaseWriter(database=database) as writer:
+            writer.add_many(servers)
+
+    await asyncio.to_thread(write)
+
+    return {'servers': len(servers)}
+
+
+async def _run_pipeline(options: BenchmarkOptions, stand_ins: t.Dict[str, int], database: Database, _) -> t.Dict[str, int]:
+    stats = await Pipeline(
+        scrappers=fake_scrappers(stand_ins['http_port']), database=database, scrap_concurrency=options.scrap_concurrency, scrap_delay=0,
+        ping_workers=options.ping_concurrency, ping_timeout=options.ping_timeout, ping_client=options.ping_client, report_interval=None
+    ).run()
+
+    return {'servers': stats['scrap'].processed, 'pings': stats['ping'].processed}
+
+
+SCENARIOS: t.Dict[str, t.Tuple[t.Optional[t.Callable], t.Callable]] = {
+    'scrap': (None, _run_scrap),
+    'ping': (_prepare_ping, _run_ping),
+    'status': (_prepare_status, _run_status),
+    'write': (_prepare_write, _run_write),
+    'pipeline': (None, _run_pipeline)
+}
+"""Scenario name: (`prepare`, `run`)."""
+
+
+
+def _count_rows(database: Database) -> int:
+    return sum(model.select().bind(database).count() for model in ALL_MODELS)
+
+
+def _peak_rss() -> t.Optional[float]:
+    """Peak resident set size of this process in MiB."""
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_scenario(scenario: str, options: BenchmarkOptions, stand_ins: t.Dict[str, int], results: t.Any) -> None:
+    try:
+        prepare, run = SCENARIOS[scenario]
+
+        with tempfile.TemporaryDirectory(prefix='mst-benchmark-') as directory:
+            database = initialize_database('benchmark.db', directory, profile=options.db_profile)
+            state = prepare(options, stand_ins, database) if prepare else None
+            rows = _count_rows(database)
+
+            started, started_cpu = time.perf_counter(), time.process_time()
+            counts = asyncio.run(run(options, stand_ins, database, state))
+            elapsed, cpu = time.perf_counter() - started, time.process_time() - started_cpu
+
+            counts['rows_written'] = _count_rows(database) - rows
+            latencies = [latency for (latency,) in DB_ServerRecord.select(DB_ServerRecord.latency).where(DB_ServerRecord.latency.is_null(False)).tuples().bind(database)]
+            database.close()
+
+        metrics: t.Dict[str, t.Optional[float]] = {'elapsed': elapsed, 'cpu_seconds': cpu}
+        for name, count in counts.items():
+            metrics[name] = count
+            metrics[f'{name}_per_second'] = count / elapsed
+        if counts.get('pings'):
+            metrics['cpu_ms_per_ping'] = cpu / counts['pings'] * 1000
+
+        if len(latencies) > 1:
+            percentiles = statistics.quantiles(latencies, n=100)
+            metrics.update(latency_p50=percentiles[49], latency_p90=percentiles[89], latency_p99=percentiles[98])
+
+        metrics['peak_rss_mib'] = _peak_rss()
+        results.put(metrics)
+
+    except BaseException:
+        results.put(traceback.format_exc())
+
+
+
+def _git_commit() -> t.Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_PATH, capture_output=True, text=True, check=True).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def run_benchmarks(
+    scenarios: t.Iterable[str]=('pipeline',),
+    options: t.Optional[BenchmarkOptions]=None,
+    results_path: Path=BENCHMARK_RESULTS_PATH
+) -> t.List[t.Dict[str, t.Any]]:
+    """
+        Runs `scenarios` (see `SCENARIOS`) one by one against the same stand-ins, prints their metrics and appends them to `results_path`.
+        Returns the saved results.
+    """
+
+    options = options or BenchmarkOptions()
+    scenarios = list(scenarios)
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark scenarios: {', '.join(unknown)} (expected some of: {', '.join(SCENARIOS)})")
+
+    context = multiprocessing.get_context('spawn')
+    run_id = datetime.now().isoformat(timespec='seconds')
+    saved = []
+
+    with StandIns(options) as stand_ins:
+        for scenario in scenarios:
+            answered, served = stand_ins.answered.value, stand_ins.served.value
+            results = context.Queue()
+            process = context.Process(
+                target=_run_scenario, args=(scenario, options, {'status_port': stand_ins.status_port, 'http_port': stand_ins.http_port}, results),
+                name=f'mst-benchmark-{scenario}'
+            )
+            process.start()
+            metrics = results.get()
+            process.join()
+
+            if isinstance(metrics, str):
+                raise RuntimeError(f"Benchmark scenario {scenario!r} failed:\n{metrics}")
+
+            metrics['pages'] = stand_ins.served.value - served
+            metrics['pages_per_second'] = metrics['pages'] / metrics['elapsed']
+            metrics['answered_pings'] = stand_ins.answered.value - answered
+
+            result = {
+                'run': run_id,
+                'scenario': scenario,
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'options': asdict(options),
+                'metrics': metrics
+            }
+            saved.append(result)
+            print(format_result(result))
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with results_path.open('a') as file:
+        for result in saved:
+            file.write(json.dumps(result) + '\n')
+
+    return saved
+
+
+
+def _saved_pages(pages_path: t.Optional[Path], options: BenchmarkOptions) -> t.Dict[t.Type[ServerListScrapper], t.List[str]]:
+    """
+        Saved pages (`<pages_path>/<source>/*.html`) of every scrapper, or generated ones (see `_render_pages`) without `pages_path`.
+    """
+
+    pages: t.Dict[t.Type[ServerListScrapper], t.List[str]] = {}
+
+    if pages_path is None:
+        rendered = _render_pages(options, 25565)
+
+        for scrapper, (source, _) in _PAGE_TEMPLATES.items():
+            pages[scrapper] = [rendered[f'/{source}/{page}'].decode() for page in range(1, options.pages + 1)]
+
+        return pages
+
+    for scrapper, (source, _) in _PAGE_TEMPLATES.items():
+        saved = [path.read_text(errors='replace') for path in sorted(Path(pages_path, source).glob('*.html'))]
+        if saved:
+            pages[scrapper] = saved
+
+    return pages
+
+
+
+def benchmark_parsing(
+    pages_path: t.Optional[Path]=None,
+    options: t.Optional[BenchmarkOptions]=None,
+    repeat: int=5,
+    results_path: t.Optional[Path]=BENCHMARK_RESULTS_PATH
+) -> t.Dict[str, t.Any]:
+    """
+        Micro-benchmark of page parsing - BeautifulSoup with CSS selectors (`scrap_soup`) against compiled XPath on the lxml tree
+        (`scrap_markup`) over saved pages (see `_saved_pages`). Both paths have to find the same servers. Prints the result and
+        appends it to `results_path` as the `parse` scenario (not saved if `None`).
+    """
+
+    options = options or BenchmarkOptions()
+    metrics: t.Dict[str, t.Optional[float]] = {}
+    totals = {'soup': 0.0, 'lxml': 0.0}
+    pages = servers = 0
+
+    for scrapper, markups in _saved_pages(pages_path, options).items():
+        # Without `__init__`, so nothing is downloaded:
+        instance = scrapper.__new__(scrapper)
+        instance.source, instance.max_pages = _PAGE_TEMPLATES[scrapper][0], None
+
+        paths = {
+            'soup': lambda markup, page_number: instance.scrap_soup(instance.parse(markup), page_number),
+            'lxml': instance.scrap_markup
+        }
+        found = {}
+
+        for name, path in paths.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                found[name] = [path(markup, page_number) for page_number, markup in enumerate(markups, 1)]
+                timings.append(time.perf_counter() - started)
+
+            elapsed = min(timings)
+            totals[name] += elapsed
+            metrics[f'{instance.source}_{name}_ms_per_page'] = elapsed / len(markups) * 1000
+
+        if found['soup'] != found['lxml']:
+            raise RuntimeError(f"{scrapper.__name__}: XPath and CSS selector paths found different servers")
+
+        metrics[f'{instance.source}_speedup'] = metrics[f'{instance.source}_soup_ms_per_page'] / metrics[f'{instance.source}_lxml_ms_per_page']
+        pages += len(markups)
+        servers += sum(len(page) for page in found['lxml'])
+
+    if not pages:
+        raise ValueError(f"No saved pages in {pages_path} (expected <source>/*.html files)")
+
+    metrics.update(
+        pages=pages, servers=servers, soup_pages_per_second=pages / totals['soup'], lxml_pages_per_second=pages / totals['lxml'],
+        speedup=totals['soup'] / totals['lxml']
+    )
+
+    result = {
+        'run': datetime.now().isoformat(timespec='seconds'),
+        'scenario': 'parse',
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {**asdict(options), 'pages_path': str(pages_path) if pages_path else None, 'repeat': repeat},
+        'metrics': metrics
+    }
+    print(format_result(result))
+
+    if results_path is not None:
+        results_path.parent.mkdir(parents=True, exist_ok=True)
+        with results_path.open('a') as file:
+            file.write(json.dumps(result) + '\n')
+
+    return result
+
+
+
+def load_results(results_path: Path=BENCHMARK_RESULTS_PATH) -> t.List[t.Dict[str, t.Any]]:
+    if not results_path.exists():
+        return []
+
+    with results_path.open() as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+
+def format_result(result: t.Dict[str, t.Any]) -> str:
+    width = max([24, *map(len, result['metrics'])])
+    lines = [f"{result['scenario']} @ {result['run']} ({result['commit'] or 'unknown commit'})"]
+    lines += [f"    {name:<{width}} {value:>14.2f}" for name, value in result['metrics'].items() if value is not None]
+
+    return '\n'.join(lines)
+
+
+
+def compare_runs(baseline: t.Optional[str]=None, candidate: t.Optional[str]=None, results_path: Path=BENCHMARK_RESULTS_PATH) -> str:
+    """
+        Compares metrics of all scenarios two runs have in common (by default the last two runs).
+    """
+
+    results = load_results(results_path)
+    runs = list(dict.fromkeys(result['run'] for result in results))
+
+    if candidate is None:
+        candidate = runs[-1] if runs else None
+    if baseline is None:
+        earlier = [run for run in runs if run != candidate]
+        baseline = earlier[-1] if earlier else None
+
+    for run in (baseline, candidate):
+        if run not in runs:
+            raise ValueError(f"Unknown benchmark run: {run!r} (known runs: {', '.join(runs) or 'none'})")
+
+    by_scenario: t.Dict[str, t.Dict[str, t.Dict[str, t.Any]]] = {}
+    for result in results:
+        if result['run'] in (baseline, candidate):
+            by_scenario.setdefault(result['scenario'], {})[result['run']] = result
+
+    lines = [f"{'metric':<28} {baseline:>20} {candidate:>20} {'change':>9}"]
+
+    for scenario, pair in by_scenario.items():
+        if len(pair) < 2:
+            continue
+
+        lines.append(f"{scenario} ({pair[baseline]['commit']} -> {pair[candidate]['commit']}):")
+
+        for name, before in pair[baseline]['metrics'].items():
+            after = pair[candidate]['metrics'].get(name)
+            if before is None or after is None:
+                continue
+
+            change = f"{(after - before) / before * 100:+.1f}%" if before else ''
+            lines.append(f"    {name:<24} {before:>20.2f} {after:>20.2f} {change:>9}")
+
+    return '\n'.join(lines)
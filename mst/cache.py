@@ -0,0 +1,110 @@
+"""
+    Persistent cache of server list pages, so pages that didn't change since the last run are neither parsed nor re-emitted.
+
+    Only validators are kept for every page URL - its `ETag` and `Last-Modified` headers (sent back as `If-None-Match` and
+    `If-Modified-Since`, so servers can answer `304 Not Modified`), a hash of its content (for servers that don't support
+    conditional requests) and how many servers it had (an unchanged empty page still marks the end of a list).
+
+    The cache lives in its own SQLite database (`settings.PAGE_CACHE_PATH`), so scrapping threads never wait for the database writer.
+"""
+
+import typing as t
+
+import hashlib
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from peewee import CharField, DateTimeField, IntegerField, Model, SqliteDatabase
+
+from mst.settings import PAGE_CACHE_PATH
+
+
+
+@dataclass
+class CachedPage:
+    """
+        - `content_hash` - Hash of the page's markup (see `content_hash`)
+        - `servers` - Number of servers on the page when it was scrapped (`None` if it wasn't scrapped yet)
+    """
+
+    etag: t.Optional[str]
+    last_modified: t.Optional[str]
+    content_hash: str
+    servers: t.Optional[int] = None
+
+
+    @property
+    def validators(self) -> t.Dict[str, str]:
+        """Headers of a conditional request for this page."""
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+
+
+def content_hash(markup: str) -> str:
+    return hashlib.blake2b(markup.encode(), digest_size=16).hexdigest()
+
+
+
+class DB_CachedPage(Model):
+    url = CharField(unique=True)
+    etag = CharField(null=True)
+    last_modified = CharField(null=True)
+    content_hash = CharField()
+    servers = IntegerField(null=True)
+    checked_at = DateTimeField(default=datetime.now)
+
+
+    class Meta:
+        db_table = 'cached_pages'
+
+
+
+class PageCache():
+    """
+        Validators of downloaded pages by their URL (see `scrappers.ServerListScrapper.download`). Safe to use from multiple threads.
+    """
+
+    def __init__(self, path: Path=PAGE_CACHE_PATH) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.database = SqliteDatabase(path, pragmas={'journal_mode': 'wal', 'synchronous': 'normal'})
+        self._lock = threading.Lock()
+
+        with self.database.bind_ctx([DB_CachedPage]):
+            self.database.create_tables([DB_CachedPage])
+
+
+    def get(self, url: str) -> t.Optional[CachedPage]:
+        row = (DB_CachedPage
+            .select(DB_CachedPage.etag, DB_CachedPage.last_modified, DB_CachedPage.content_hash, DB_CachedPage.servers)
+            .where(DB_CachedPage.url == url)
+            .tuples()
+            .bind(self.database)
+            .first())
+
+        return CachedPage(*row) if row else None
+
+
+    def put(self, url: str, page: CachedPage) -> None:
+        with self._lock:
+            (DB_CachedPage.insert(
+                url=url,
+                etag=page.etag,
+                last_modified=page.last_modified,
+                content_hash=page.content_hash,
+                servers=page.servers,
+                checked_at=datetime.now()
+            ).on_conflict_replace().execute(self.database))
+
+
+    def close(self) -> None:
+        self.database.close()
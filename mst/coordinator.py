@@ -0,0 +1,467 @@
+"""
+    Coordinated sweeps - pinging the database with worker nodes on several machines.
+
+    The coordinator (the only process with the database) splits the `servers` table into work units of `unit_size` servers
+    and leases them to workers over a small HTTP protocol (JSON bodies, gzip compressed):
+
+        POST /lease     {"worker": <name>}
+                        200 {"unit": <ID>, "lease": <token>, "lease_timeout": <seconds>, "servers": [[ID, host, port, source], ...]}
+                        204 - all units are leased right now, ask again later
+                        410 - the sweep is finished
+        POST /results   {"unit": <ID>, "lease": <token>, "results": [<result>, ...], "done": <bool>}
+                        200 {"accepted": <number>}
+                        409 - the lease expired (the unit was given to another worker)
+        GET /status     counts of waiting, leased and completed units and of pinged servers
+
+    Results are compact rows (see `encode_result`), sent in batches while the unit is being pinged - every batch renews
+    the lease. A lease without results for `lease_timeout` seconds expires and the servers of the unit that weren't
+    reported yet go to the next worker that asks, so results of a server are only ever saved once.
+    The coordinator saves results through the single `data.DatabaseWriterThread`.
+
+    The protocol has no authentication, keep the coordinator on a trusted network.
+"""
+
+import typing as t
+
+import asyncio
+import gzip
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from dataclasses import dataclass
+
+from peewee import Database
+
+from mst.data import DatabaseWriterThread
+from mst.metrics import WORK_UNITS
+from mst.orm import DATABASE
+from mst.pinger import PingClient, PingedPlayer, PingedPlayerList, PingedServer, PingedServerStatus, ping_window
+from mst.queries import ServerRow, yield_servers_from_database
+from mst.settings import (
+    COORDINATOR_HOST, COORDINATOR_PORT, COORDINATOR_UNIT_SIZE, COORDINATOR_LEASE_TIMEOUT, COORDINATOR_POLL_INTERVAL, COORDINATOR_RETRY_TIMEOUT,
+    PING_CLIENT, PING_CONCURRENCY, PING_TIMEOUT, PING_RATE_LIMIT, SWEEP_BATCH_SIZE, SWEEP_BATCH_INTERVAL
+)
+
+if t.TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+
+Result = t.List[t.Any]
+"""`[server ID]` of an offline server, `[server ID, latency, version, description, max. players, online players, is modded, [[UUID, username], ...]]`
+of an online one."""
+
+
+
+def encode_result(server_id: int, server: PingedServer) -> Result:
+    if not server.online or server.status is None:
+        return [server_id]
+
+    status = server.status
+
+    return [
+        server_id, status.latency, status.version, status.description, status.players.max, status.players.online, status.is_modded,
+        [[player.uuid, player.username] for player in status.players.list]
+    ]
+
+
+def decode_result(result: Result, server: ServerRow) -> PingedServer:
+    if len(result) == 1:
+        return PingedServer(source=server.source, host=server.host, port=server.port)
+
+    _, latency, version, description, max_players, online_players, is_modded, players = result
+
+    return PingedServer(source=server.source, host=server.host, port=server.port, online=True, status=PingedServerStatus(
+        description=description,
+        version=version,
+        latency=latency,
+        players=PingedPlayerList(max=max_players, online=online_players, list=[PingedPlayer(uuid=uuid, username=username) for uuid, username in players]),
+        is_modded=is_modded
+    ))
+
+
+
+@dataclass
+class WorkUnit:
+    """
+        - `id` - ID of the unit (in the order the units were made)
+        - `servers` - Servers of the unit that weren't reported yet, by ID
+        - `lease` - Token of the current lease (`None` - waiting for a worker)
+        - `worker` - Name of the worker holding the lease
+        - `expires_at` - When the lease expires (`time.monotonic()`)
+    """
+
+    id: int
+    servers: t.Dict[int, ServerRow]
+    lease: t.Optional[str] = None
+    worker: t.Optional[str] = None
+    expires_at: float = 0.0
+
+
+
+class Coordinator():
+    """
+        Work units and their leases (thread-safe, the HTTP server calls it from its threads).
+        Units are made from `pages` (lists of server rows, such as from `queries.yield_servers_from_database`) as workers ask for them.
+    """
+
+    def __init__(self, pages: t.Iterator[t.List[ServerRow]], lease_timeout: float=COORDINATOR_LEASE_TIMEOUT) -> None:
+        self.lease_timeout = lease_timeout
+        self.pinged = 0
+        self.completed = 0
+
+        self._pages = pages
+        self._exhausted = False
+        self._waiting: t.Deque[WorkUnit] = deque()
+        self._leased: t.Dict[int, WorkUnit] = {}
+        self._last_unit_id = 0
+        self._lock = threading.Lock()
+
+
+    @property
+    def is_finished(self) -> bool:
+        return self._exhausted and not self._waiting and not self._leased
+
+
+    def _next_unit(self) -> t.Optional[WorkUnit]:
+        if self._waiting:
+            return self._waiting.popleft()
+
+        if self._exhausted:
+            return None
+
+        page = next(self._pages, None)
+        if page is None:
+            self._exhausted = True
+            return None
+
+        self._last_unit_id += 1
+
+        return WorkUnit(self._last_unit_id, {server.id: server for server in page})
+
+
+    def lease(self, worker: str) -> t.Optional[WorkUnit]:
+        """
+            Leases the next unit to `worker` - a unit with an expired lease first, then a new one (`None` if there's none right now).
+        """
+
+        with self._lock:
+            self._expire()
+
+            unit = self._next_unit()
+            if unit is None:
+                return None
+
+            unit.lease = secrets.token_hex(8)
+            unit.worker = worker
+            unit.expires_at = time.monotonic() + self.lease_timeout
+            self._leased[unit.id] = unit
+
+        WORK_UNITS.inc(event='leased')
+
+        return unit
+
+
+    def report(self, unit_id: int, lease: str, results: t.Iterable[Result], done: bool=False) -> t.Optional[t.List[PingedServer]]:
+        """
+            Takes results of a leased unit and renews the lease. Returns pinged servers to save - only of servers of the unit
+            that weren't reported yet - or `None` if the lease isn't valid anymore. With `done`, the unit is completed.
+        """
+
+        with self._lock:
+            unit = self._leased.get(unit_id)
+            if unit is None or unit.lease != lease:
+                return None
+
+            servers = [decode_result(result, unit.servers.pop(result[0])) for result in results if result[0] in unit.servers]
+            unit.expires_at = time.monotonic() + self.lease_timeout
+            self.pinged += len(servers)
+
+            if done or not unit.servers:
+                del self._leased[unit_id]
+                self.completed += 1
+                WORK_UNITS.inc(event='completed')
+
+        return servers
+
+
+    def expire(self) -> None:
+        with self._lock:
+            self._expire()
+
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+
+        for unit in [unit for unit in self._leased.values() if unit.expires_at <= now]:
+            del self._leased[unit.id]
+            unit.lease = unit.worker = None
+            self._waiting.appendleft(unit)
+            WORK_UNITS.inc(event='expired')
+
+
+    def status(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            return {
+                'waiting': len(self._waiting),
+                'leased': {unit.id: unit.worker for unit in self._leased.values()},
+                'completed': self.completed,
+                'pinged': self.pinged,
+                'finished': self.is_finished
+            }
+
+
+
+def _dump(payload: t.Any) -> bytes:
+    return gzip.compress(json.dumps(payload, separators=(',', ':')).encode(), compresslevel=5)
+
+
+def _load(body: bytes) -> t.Any:
+    return json.loads(gzip.decompress(body))
+
+
+
+def start_coordinator_server(
+    coordinator: Coordinator,
+    save: t.Callable[[t.List[PingedServer]], None],
+    database: Database=DATABASE,
+    host: str=COORDINATOR_HOST,
+    port: int=COORDINATOR_PORT
+) -> 'ThreadingHTTPServer':
+    """
+        Serves the protocol (see the module's docs) of `coordinator` from a background thread. Reported results are passed
+        to `save` (in the request's thread, so slow saving slows the workers down). Call `shutdown()` on the returned server to stop it.
+    """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self, code: int, payload: t.Any=None) -> None:
+            body = _dump(payload) if payload is not None else b''
+
+            self.send_response(code)
+            if body:
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def do_GET(self) -> None:
+            if self.path != '/status':
+                self.send_error(404)
+                return
+
+            self.respond(200, coordinator.status())
+
+
+        def do_POST(self) -> None:
+            try:
+                request = _load(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+            except (OSError, ValueError):
+                self.send_error(400)
+                return
+
+            if self.path == '/lease':
+                # Units are read from the database in the request's thread, on a connection of its own:
+                with database.connection_context():
+                    unit = coordinator.lease(str(request.get('worker')))
+
+                if unit is not None:
+                    self.respond(200, {'unit': unit.id, 'lease': unit.lease, 'lease_timeout': coordinator.lease_timeout, 'servers': list(unit.servers.values())})
+                else:
+                    self.respond(410 if coordinator.is_finished else 204)
+
+            elif self.path == '/results':
+                servers = coordinator.report(request['unit'], request['lease'], request['results'], request.get('done', False))
+                if servers is None:
+                    self.respond(409)
+                    return
+
+                save(servers)
+                self.respond(200, {'accepted': len(servers)})
+
+            else:
+                self.send_error(404)
+
+
+        def log_message(self, *_) -> None:
+            pass
+
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mst-coordinator-server', daemon=True).start()
+
+    return server
+
+
+
+async def coordinate(
+    database: Database=DATABASE,
+    host: str=COORDINATOR_HOST,
+    port: int=COORDINATOR_PORT,
+    unit_size: int=COORDINATOR_UNIT_SIZE,
+    lease_timeout: float=COORDINATOR_LEASE_TIMEOUT,
+    linger: float=COORDINATOR_POLL_INTERVAL * 3,
+    **filters
+) -> int:
+    """
+        Coordinates a sweep of the database by workers (`run_worker`) and saves their results. Returns the number of pinged servers.
+
+        - `linger` - How long to keep answering once everything is pinged, so idle workers learn that the sweep is finished
+        - `filters` - Passed to `queries.yield_servers_from_database` (`stale_after`, `online_only`, `source`)
+    """
+
+    loop = asyncio.get_running_loop()
+    coordinator = Coordinator(yield_servers_from_database(database=database, at_once=unit_size, **filters), lease_timeout=lease_timeout)
+
+    async with DatabaseWriterThread(database=database) as writer:
+        def save(servers: t.List[PingedServer]) -> None:
+            asyncio.run_coroutine_threadsafe(writer.put_many(servers), loop).result()
+
+
+        server = start_coordinator_server(coordinator, save, database=database, host=host, port=port)
+
+        try:
+            while not coordinator.is_finished:
+                if writer.error:
+                    raise writer.error
+
+                await asyncio.sleep(0.5)
+                coordinator.expire()
+
+            await asyncio.sleep(linger)
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    return coordinator.pinged
+
+
+
+class CoordinatorError(Exception):
+    """
+        The coordinator can't be reached (for longer than the retry timeout) or answered with an unexpected status.
+    """
+
+
+
+def _post(url: str, payload: t.Any) -> t.Tuple[int, t.Any]:
+    request = urllib.request.Request(url, data=_dump(payload), method='POST', headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = response.read()
+            return response.status, _load(body) if body else None
+
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+
+
+async def _request(url: str, payload: t.Any, retry_timeout: float) -> t.Tuple[int, t.Any]:
+    started = time.monotonic()
+
+    while True:
+        try:
+            status, response = await asyncio.to_thread(_post, url, payload)
+
+        except (urllib.error.URLError, ConnectionError, TimeoutError) as error:
+            if time.monotonic() - started >= retry_timeout:
+                raise CoordinatorError(f"Coordinator {url} can't be reached: {error}") from error
+
+            await asyncio.sleep(COORDINATOR_POLL_INTERVAL)
+            continue
+
+        if status >= 500:
+            raise CoordinatorError(f"Coordinator {url} failed with status {status}")
+
+        return status, response
+
+
+
+async def run_worker(
+    url: str,
+    name: t.Optional[str]=None,
+    concurrency: int=PING_CONCURRENCY,
+    timeout: t.Optional[float]=PING_TIMEOUT,
+    rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+    resolve_dns: bool=False,
+    client: PingClient=PING_CLIENT,
+    batch_size: int=SWEEP_BATCH_SIZE,
+    batch_interval: float=SWEEP_BATCH_INTERVAL,
+    poll_interval: float=COORDINATOR_POLL_INTERVAL,
+    retry_timeout: float=COORDINATOR_RETRY_TIMEOUT
+) -> int:
+    """
+        Leases work units from the coordinator at `url` (such as `http://127.0.0.1:8765`) and pings them until the sweep
+        is finished. Returns the number of pinged servers.
+
+        - `name` - Name of the worker (`<hostname>-<PID>` by default)
+    """
+
+    url = url.rstrip('/')
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    resolver = None
+    pinged = 0
+
+    if resolve_dns:
+        from mst.resolver import Resolver # dnspython is only imported when it's used
+        resolver = Resolver()
+
+    while True:
+        status, unit = await _request(f'{url}/lease', {'worker': name}, retry_timeout)
+
+        if status == 410:
+            return pinged
+
+        if status == 204:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        if status != 200:
+            raise CoordinatorError(f"Coordinator {url} answered a lease with status {status}")
+
+        servers = [ServerRow(*server) for server in unit['servers']]
+        ids = {(server.host, server.port): server.id for server in servers}
+        batch: t.List[Result] = []
+        last_sent = time.monotonic()
+
+
+        async def send(done: bool) -> bool:
+            nonlocal batch, last_sent
+
+            status, _ = await _request(f'{url}/results', {'unit': unit['unit'], 'lease': unit['lease'], 'results': batch, 'done': done}, retry_timeout)
+            batch, last_sent = [], time.monotonic()
+
+            return status == 200
+
+
+        pings = ping_window(servers, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolver=resolver, client=client)
+        lost = False
+
+        try:
+            async for statuses in pings:
+                batch.extend(encode_result(ids[(server.host, server.port)], server) for server in statuses)
+                pinged += len(statuses)
+
+                if len(batch) >= batch_size or time.monotonic() - last_sent >= batch_interval:
+                    # The lease expired and the unit went to another worker - its servers are left to it:
+                    if not await send(done=False):
+                        lost = True
+                        break
+
+        finally:
+            await pings.aclose()
+
+        if not lost:
+            await send(done=True)
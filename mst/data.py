@@ -1,97 +1,879 @@
 import typing as t
 
 import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
 try:
     import uvloop # type: ignore
 except ImportError:
     uvloop = None
 
-from peewee import Database
+from dataclasses import dataclass, field
+from peewee import EXCLUDED, Database, Model, Tuple, chunked, fn
 
-from mst.orm import DATABASE, DB_Player, DB_PlayerRecordsRelationship, DB_Server, DB_ServerRecord
-from mst.scrappers import Server, scrap_from_all_scrappers
+from mst.orm import (
+    DATABASE, Server, maintain_database, DB_Player, DB_PlayerPresence, DB_PlayerRecordsRelationship, DB_Server, DB_ServerRecord, DB_ServerSchedule, DB_ServerSource
+)
+from mst.cache import PageCache
+from mst.dedupe import ServerDeduplicator
+from mst.journal import Checkpoint, Progress, clear_journal, load_journal, save_journal
+from mst.metrics import FLUSH_DURATION, FLUSH_SIZE, QUEUE_DEPTH
+from mst.profiling import spanned
+from mst.queries import load_known_servers
+from mst.scheduling import Schedule, next_schedule
+from mst.storage import get_record_storage, save_states
+from mst.utils import RateLimiter, aiterate
+from mst.settings import (
+    DATABASE_FLUSH_SIZE, DATABASE_FLUSH_INTERVAL, DATABASE_QUEUE_SIZE, DATABASE_MAINTENANCE_INTERVAL, PING_CLIENT, PING_CONCURRENCY, PING_TIMEOUT, PING_RATE_LIMIT,
+    SCRAP_CONCURRENCY, SCRAP_DELAY, PIPELINE_QUEUE_SIZE, PIPELINE_REPORT_INTERVAL, PRINT_SAVED_ROWS
+)
 
 import mst.pinger as pinger
 
-_PSS = t.TypeVar('_PSS', pinger.PingedServer, Server)
-
+if t.TYPE_CHECKING:
+    from mst.resolver import Address, Resolver
+    from mst.scrappers import ServerListScrapper
 
+_PSS = t.TypeVar('_PSS', pinger.PingedServer, Server)
 
-def yield_servers_from_database(database: Database=DATABASE, at_once: int=25) -> t.Generator[t.List[DB_Server], None, None]:
-    query = (DB_Server.select().bind(database)) # type: t.Iterator[DB_Server]
-    servers: t.List[DB_Server] = []
-
-    for server in query:
-        if len(servers) < at_once:
-            servers.append(server)
-            continue
+_BULK_CHUNK_SIZE = 100
+"""Rows per statement in bulk queries (keeps us under SQLite's limit of bound variables per query)."""
 
-        yield servers
-        servers.clear()
 
 
+@spanned('save')
+def save_into_database(server: _PSS, database: Database=DATABASE, verbose: bool=PRINT_SAVED_ROWS) -> _PSS:
+    """
+        Saves a server (with its record and players, if it was pinged) row by row. With `verbose`, every saved row is printed.
+    """
 
-def save_into_database(server: _PSS, database: Database=DATABASE) -> _PSS:
-    (DB_Server.replace(
+    (DB_Server.insert(
         host=server.host,
         port=server.port
-    ).execute(database))
+    ).on_conflict_ignore().execute(database))
     saved_server = DB_Server.get((DB_Server.host == server.host) & (DB_Server.port == server.port)) # type: DB_Server
-    print("Saved server:", saved_server, f"({saved_server.ip_address} | {server.source})")
+    if verbose:
+        print("Saved server:", saved_server, f"({saved_server.ip_address} | {server.source})")
+
+    if server.source:
+        _save_sources([(saved_server.id, server.source)], database)
+
+    if isinstance(server, pinger.PingedServer):
+        _save_schedules([(saved_server.id, server)], database)
 
     if getattr(server, 'status', None):
-        (DB_ServerRecord.replace(
-            source=server.source,
-            latency=server.status.latency,
-            version=server.status.version,
-            is_modded=server.status.is_modded,
-            description=server.status.description,
-            max_players=server.status.players.max,
-            online_players_number=server.status.players.online,
-            server=saved_server
-        ).execute(database))
-        saved_server_record = DB_ServerRecord.get(DB_ServerRecord.server == saved_server) # type: DB_ServerRecord
-        print("Saved record:", saved_server_record)
+        saved_server_record_id = (DB_ServerRecord
+            .insert_many([_record_row(server, saved_server.id, *_record_states([(saved_server.id, server)], database))], fields=_RECORD_FIELDS)
+            .execute(database))
+        saved_server_record = DB_ServerRecord.select_full().where(DB_ServerRecord.id == saved_server_record_id).bind(database).get() # type: DB_ServerRecord
+        if verbose:
+            print("Saved record:", saved_server_record)
+
+        seen_players: t.Set[int] = set()
 
         for player in server.status.players.list:
-            (DB_Player.replace(
+            (DB_Player.insert(
                 uuid=player.uuid,
                 username=player.username,
-            ).execute(database))
+            ).on_conflict_ignore().execute(database))
             saved_player = DB_Player.get((DB_Player.uuid == player.uuid) & (DB_Player.username == player.username)) # type: DB_Player
 
-            (DB_PlayerRecordsRelationship.replace(
+            (DB_PlayerRecordsRelationship.insert(
                 player=saved_player,
                 record=saved_server_record
-            ).execute(database))
-            print("Saved player:", saved_player)
+            ).on_conflict_ignore().execute(database))
+            if saved_player.id not in seen_players:
+                _save_presence({(saved_player.id, saved_server.id): 1}, database)
+                seen_players.add(saved_player.id)
+            if verbose:
+                print("Saved player:", saved_player)
 
 
 
 
-async def scrap_from_all_scrappers_and_save(*args, **kwargs):
-    for servers in scrap_from_all_scrappers(*args, **kwargs):
-        for server in servers:
-            if server.host:
-                save_into_database(server=server, database=DATABASE)
+def _get_or_create_ids(model: t.Type[Model], fields: t.Tuple, keys: t.Iterable[t.Tuple], database: Database) -> t.Dict[t.Tuple, int]:
+    """
+        Maps `keys` (values of `fields`, which must have a unique index) to IDs of their rows, inserting the rows that don't exist yet.
+        Works with 2 queries per chunk of keys (+ 1 insert), instead of reading every row back.
+    """
+
+    ids: t.Dict[t.Tuple, int] = {}
+
+
+    def select(chunk: t.List[t.Tuple]) -> None:
+        query = (model.select(model.id, *fields).where(Tuple(*fields).in_(chunk)).tuples().bind(database))
+
+        for _id, *key in query:
+            ids[tuple(key)] = _id
+
+
+    for chunk in chunked(set(keys), _BULK_CHUNK_SIZE):
+        select(chunk)
+
+        missing = [key for key in chunk if key not in ids]
+        if missing:
+            model.insert_many(missing, fields=fields).on_conflict_ignore().execute(database)
+            select(missing)
+
+    return ids
+
+
+
+_RECORD_FIELDS = (
+    DB_ServerRecord.source, DB_ServerRecord.latency, DB_ServerRecord.version, DB_ServerRecord.is_modded, DB_ServerRecord.description,
+    DB_ServerRecord.max_players, DB_ServerRecord.online_players_number, DB_ServerRecord.server, DB_ServerRecord.state
+)
+"""Fields of record rows inserted by `save_many_into_database`, as tuples (no dictionaries or model instances per row)."""
+
+
+
+def _record_states(servers: t.List[t.Tuple[int, pinger.PingedServer]], database: Database) -> t.List[t.Optional[int]]:
+    """
+        States of new records of `(server ID, pinged server)` pairs - `None` for all of them if records are saved as full ones.
+    """
+
+    if get_record_storage(database) != 'compact':
+        return [None] * len(servers)
+
+    now = datetime.now()
+
+    return save_states([
+        (server_id, now, server.status.description, server.status.version, server.status.players.max, server.status.is_modded)
+        for server_id, server in servers
+    ], database)
+
+
+
+def _record_row(server: pinger.PingedServer, server_id: int, state_id: t.Optional[int]) -> tuple:
+    if state_id is not None:
+        # Static fields are in the state (SQLite saves these values in no space at all):
+        return (server.source, server.status.latency, None, False, None, 0, server.status.players.online, server_id, state_id)
+
+    return (
+        server.source,
+        server.status.latency,
+        server.status.version,
+        server.status.is_modded,
+        server.status.description,
+        server.status.players.max,
+        server.status.players.online,
+        server_id,
+        None
+    )
+
+
+
+def _save_sources(sources: t.Iterable[t.Tuple[int, str]], database: Database) -> None:
+    """
+        Records `(server ID, source)` pairs - inserts new ones and updates `last_seen` of the known ones.
+    """
+
+    now = datetime.now()
+
+    for chunk in chunked(sources, _BULK_CHUNK_SIZE):
+        (DB_ServerSource.insert_many(
+            [(server_id, source, now, now) for server_id, source in chunk],
+            fields=(DB_ServerSource.server, DB_ServerSource.source, DB_ServerSource.first_seen, DB_ServerSource.last_seen)
+        ).on_conflict(
+            conflict_target=(DB_ServerSource.server, DB_ServerSource.source),
+            preserve=(DB_ServerSource.last_seen,)
+        ).execute(database))
+
+
+
+def _save_presence(sightings: t.Mapping[t.Tuple[int, int], int], database: Database) -> None:
+    """
+        Adds sightings (`(player ID, server ID)`: count) to `DB_PlayerPresence` - inserts new pairs and updates `last_seen`
+        and `sightings` of the known ones.
+    """
+
+    now = datetime.now()
+    fields = (DB_PlayerPresence.player, DB_PlayerPresence.server, DB_PlayerPresence.first_seen, DB_PlayerPresence.last_seen, DB_PlayerPresence.sightings)
+
+    for chunk in chunked(sightings.items(), _BULK_CHUNK_SIZE):
+        (DB_PlayerPresence.insert_many(
+            [(player_id, server_id, now, now, count) for (player_id, server_id), count in chunk],
+            fields=fields
+        ).on_conflict(
+            conflict_target=(DB_PlayerPresence.player, DB_PlayerPresence.server),
+            preserve=(DB_PlayerPresence.last_seen,),
+            update={DB_PlayerPresence.sightings: DB_PlayerPresence.sightings + EXCLUDED.sightings}
+        ).execute(database))
+
+
+
+def _save_schedules(pinged_servers: t.Iterable[t.Tuple[int, pinger.PingedServer]], database: Database) -> None:
+    """
+        Updates re-ping schedules of `(server ID, pinged server)` pairs (online and offline ones) with `scheduling.next_schedule`.
+    """
+
+    fields = (
+        DB_ServerSchedule.server, DB_ServerSchedule.next_due, DB_ServerSchedule.score, DB_ServerSchedule.uptime, DB_ServerSchedule.volatility,
+        DB_ServerSchedule.consecutive_failures, DB_ServerSchedule.last_players, DB_ServerSchedule.last_ping
+    )
+    now = datetime.now()
+
+    for chunk in chunked(pinged_servers, _BULK_CHUNK_SIZE):
+        schedules: t.Dict[int, Schedule] = {
+            server_id: Schedule(uptime, volatility, failures, last_players)
+            for server_id, uptime, volatility, failures, last_players in (DB_ServerSchedule
+                .select(DB_ServerSchedule.server, DB_ServerSchedule.uptime, DB_ServerSchedule.volatility, DB_ServerSchedule.consecutive_failures, DB_ServerSchedule.last_players)
+                .where(DB_ServerSchedule.server.in_({server_id for server_id, _ in chunk}))
+                .tuples()
+                .bind(database))
+        }
+
+        # The same server can be pinged more than once per chunk, every ping updates the schedule in order:
+        for server_id, server in chunk:
+            players = server.status.players.online if server.status else None
+            schedules[server_id] = next_schedule(schedules.get(server_id), server.online and server.status is not None, players, now)
+
+        (DB_ServerSchedule.insert_many([
+            (server_id, schedule.next_due, schedule.score, schedule.uptime, schedule.volatility, schedule.consecutive_failures, schedule.last_players, now)
+            for server_id, schedule in schedules.items()
+        ], fields=fields).on_conflict(
+            conflict_target=(DB_ServerSchedule.server,),
+            preserve=fields[1:]
+        ).execute(database))
+
+
+
+@spanned('save')
+def save_many_into_database(servers: t.Iterable[_PSS], database: Database=DATABASE) -> int:
+    """
+        Bulk version of `save_into_database` - saves all servers, their records and players in a single transaction
+        with `insert_many` (without printing anything). Returns the number of saved servers.
+    """
+
+    servers = [server for server in servers if server and server.host]
+    if not servers:
+        return 0
+
+    with database.atomic():
+        server_ids = _get_or_create_ids(DB_Server, (DB_Server.host, DB_Server.port), ((server.host, server.port) for server in servers), database)
+        _save_sources({(server_ids[(server.host, server.port)], server.source) for server in servers if server.source}, database)
+        _save_schedules([(server_ids[(server.host, server.port)], server) for server in servers if isinstance(server, pinger.PingedServer)], database)
+
+        # Records are append-only, every ping gets its own one:
+        pinged_servers = [server for server in servers if getattr(server, 'status', None)]
+        pinged_ids = [(server_ids[(server.host, server.port)], server) for server in pinged_servers]
+        state_ids = _record_states(pinged_ids, database)
+        last_record_id = DB_ServerRecord.select(fn.MAX(DB_ServerRecord.id)).bind(database).scalar() or 0
+
+        for chunk in chunked(zip(pinged_ids, state_ids), _BULK_CHUNK_SIZE):
+            (DB_ServerRecord.insert_many([
+                _record_row(server, server_id, state_id) for (server_id, server), state_id in chunk
+            ], fields=_RECORD_FIELDS).execute(database))
+
+        # We're the only writer inside this transaction, so the new records are the ones after `last_record_id`, in the order of insertion:
+        record_ids = list(DB_ServerRecord.select(DB_ServerRecord.id).where(DB_ServerRecord.id > last_record_id).order_by(DB_ServerRecord.id).tuples().bind(database))
+
+        player_ids = _get_or_create_ids(DB_Player, (DB_Player.uuid, DB_Player.username), (
+            (player.uuid, player.username) for server in pinged_servers for player in server.status.players.list
+        ), database)
+
+        # `(player ID, record ID, server ID)`, a player listed twice in a sample is seen once:
+        sightings = list(dict.fromkeys(
+            (player_ids[(player.uuid, player.username)], record_id, server_ids[(server.host, server.port)])
+            for server, (record_id,) in zip(pinged_servers, record_ids) for player in server.status.players.list
+        ))
+        for chunk in chunked([(player_id, record_id) for player_id, record_id, _ in sightings], _BULK_CHUNK_SIZE):
+            (DB_PlayerRecordsRelationship.insert_many(chunk, fields=(DB_PlayerRecordsRelationship.player, DB_PlayerRecordsRelationship.record)).on_conflict_ignore().execute(database))
+
+        _save_presence(Counter((player_id, server_id) for player_id, _, server_id in sightings), database)
 
+    return len(servers)
 
 
-async def ping_and_update(*args, **kwargs):
-    async for servers in pinger.ping_all(*args, **kwargs):
+
+class BufferedDatabaseWriter():
+    """
+        Buffers servers and saves them with `save_many_into_database` once `flush_size` of them are buffered
+        or `flush_interval` seconds have passed since the last flush. Buffered `checkpoint`s (see `journal`) are saved
+        in the same transaction.
+
+        Use it as a context manager (or call `close()`), so the servers left in the buffer are saved too.
+    """
+
+    def __init__(self, database: Database=DATABASE, flush_size: int=DATABASE_FLUSH_SIZE, flush_interval: float=DATABASE_FLUSH_INTERVAL) -> None:
+        self.database = database
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.buffer: t.List[_PSS] = []
+        self.journal: Checkpoint = {}
+        self.last_flush = time.monotonic()
+
+
+    @property
+    def is_pending(self) -> bool:
+        return bool(self.buffer) or bool(self.journal)
+
+
+    @property
+    def is_due(self) -> bool:
+        return len(self.buffer) >= self.flush_size or (self.is_pending and time.monotonic() - self.last_flush >= self.flush_interval)
+
+
+    def add(self, server: _PSS) -> None:
+        self.buffer.append(server)
+
+        if self.is_due:
+            self.flush()
+
+
+    def add_many(self, servers: t.Iterable[_PSS]) -> None:
         for server in servers:
-            save_into_database(server=server, database=DATABASE)
+            self.add(server)
+
+
+    def checkpoint(self, checkpoint: Checkpoint) -> None:
+        """
+            Saves positions of a run with the next flush - call it after adding the servers they cover.
+        """
+
+        self.journal.update(checkpoint)
+
+
+    def flush(self) -> int:
+        servers, self.buffer = self.buffer, []
+        journal, self.journal = self.journal, {}
+        self.last_flush = time.monotonic()
+
+        if not servers and not journal:
+            return 0
+
+        with FLUSH_DURATION.time(), self.database.atomic():
+            saved = save_many_into_database(servers, database=self.database)
+            save_journal(journal, database=self.database)
+
+        FLUSH_SIZE.observe(len(servers))
+
+        return saved
+
+
+    def close(self) -> None:
+        self.flush()
+
+
+    def __enter__(self) -> 'BufferedDatabaseWriter':
+        return self
+
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+
+
+class _Checkpointed(t.NamedTuple):
+    servers: t.List[_PSS]
+    checkpoint: Checkpoint
+
+
+
+class DatabaseWriterThread(threading.Thread):
+    """
+        The single database writer. Pingers push servers with `await writer.put(server)` and this thread (which owns its own
+        database connection) saves them in groups through a `BufferedDatabaseWriter`, so the event loop never waits for SQLite.
+
+        At most `max_queue_size` servers can wait in the queue - when it's full, `put()` waits, which slows the pingers down.
+        `put_many()` queues whole batches (as they come from `pinger.ping_window` or `sweep` workers), which the thread adds to its
+        buffer at once, together with positions of a run (`checkpoint`, see `journal`), which are saved in the same transaction
+        as the batch.
+        Use it as an asynchronous context manager; on exit (also on errors, cancellation or Ctrl+C) the queue is drained
+        and everything is saved before the thread stops.
+
+        Every `maintenance_interval` seconds, the thread also runs `orm.maintain_database` between two flushes.
+    """
+
+    _STOP = object()
+
+
+    def __init__(
+        self,
+        database: Database=DATABASE,
+        max_queue_size: int=DATABASE_QUEUE_SIZE,
+        flush_size: int=DATABASE_FLUSH_SIZE,
+        flush_interval: float=DATABASE_FLUSH_INTERVAL,
+        maintenance_interval: t.Optional[float]=DATABASE_MAINTENANCE_INTERVAL
+    ) -> None:
+        super().__init__(name='mst-database-writer', daemon=True)
+
+        self.database = database
+        self.max_queue_size = max_queue_size
+        self.maintenance_interval = maintenance_interval
+        self.last_maintenance = time.monotonic()
+        self.writer = BufferedDatabaseWriter(database=database, flush_size=flush_size, flush_interval=flush_interval)
+
+        self.queue: queue.Queue = queue.Queue()
+        self.error: t.Optional[BaseException] = None
+
+        self._loop: t.Optional[asyncio.AbstractEventLoop] = None
+        self._slots: t.Optional[asyncio.Semaphore] = None
+        self._queued = 0
+
+
+    @property
+    def queue_size(self) -> int:
+        """Servers waiting in the queue."""
+
+        return self._queued
+
+
+    async def _acquire(self, count: int) -> None:
+        if self.error:
+            raise self.error
+
+        if self._slots is None:
+            self._loop = asyncio.get_running_loop()
+            self._slots = asyncio.Semaphore(self.max_queue_size)
+
+        for _ in range(count):
+            await self._slots.acquire()
+
+        self._queued += count
+
+
+    async def put(self, server: _PSS) -> None:
+        await self._acquire(1)
+        self.queue.put_nowait(server)
+
+
+    async def put_many(self, servers: t.Iterable[_PSS], checkpoint: t.Optional[Checkpoint]=None) -> None:
+        # A batch bigger than the queue would wait for slots forever:
+        batches = list(chunked(servers, self.max_queue_size)) or ([[]] if checkpoint else [])
+
+        for index, batch in enumerate(batches):
+            await self._acquire(len(batch))
+            self.queue.put_nowait(_Checkpointed(batch, checkpoint) if checkpoint and index == len(batches) - 1 else batch)
+
+
+    def _release(self, count: int) -> None:
+        self._queued -= count
+
+        for _ in range(count):
+            self._slots.release()
+
+
+    def _release_slots(self, count: int) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._release, count)
+
+        except RuntimeError:
+            # The event loop is already closed, nobody is waiting anymore
+            pass
+
+
+    def run(self) -> None:
+        self.database.connect(reuse_if_open=True)
+
+        try:
+            while True:
+                try:
+                    timeout = max(0.0, self.writer.flush_interval - (time.monotonic() - self.writer.last_flush)) if self.writer.is_pending else None
+                    item = self.queue.get(timeout=timeout)
+
+                except queue.Empty:
+                    self._flush()
+                    continue
+
+                if item is self._STOP:
+                    break
+
+                servers, checkpoint = item if isinstance(item, _Checkpointed) else (item, None)
+                servers = servers if isinstance(servers, list) else [servers]
+                self._release_slots(len(servers))
+
+                if not self.error:
+                    self.writer.buffer.extend(servers)
+                    if checkpoint:
+                        self.writer.checkpoint(checkpoint)
+                    if self.writer.is_due:
+                        self._flush()
+
+            self._flush()
+
+        finally:
+            self.database.close()
+
+
+    def _flush(self) -> None:
+        if self.error:
+            return
+
+        try:
+            self.writer.flush()
+
+            if self.maintenance_interval and time.monotonic() - self.last_maintenance >= self.maintenance_interval:
+                maintain_database(self.database)
+                self.last_maintenance = time.monotonic()
+
+        except Exception as exception:
+            self.error = exception
+
+
+    async def close(self) -> None:
+        """
+            Waits until all queued servers are saved and stops the thread. Raises the writer's error, if there was one.
+        """
+
+        if self.is_alive():
+            self.queue.put_nowait(self._STOP)
+            await asyncio.get_running_loop().run_in_executor(None, self.join)
+
+        QUEUE_DEPTH.remove(queue='database')
+
+        if self.error:
+            raise self.error
+
+
+    async def __aenter__(self) -> 'DatabaseWriterThread':
+        self.start()
+        QUEUE_DEPTH.track(lambda: self.queue_size, queue='database')
+
+        return self
+
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+
+
+
+async def scrap_from_all_scrappers_and_save(*args, async_scrap: bool=False, **kwargs):
+    """
+        Scraps servers from all scrappers and saves them without pinging (see `pinger.scrap_and_ping_all` for `async_scrap`).
+    """
+
+    # Scrappers (requests, bs4 and lxml) are only imported by commands that scrap:
+    from mst.scrappers import scrap_from_all_scrappers, async_scrap_from_all_scrappers
+
+    with BufferedDatabaseWriter(database=DATABASE) as writer:
+        async for servers in aiterate((async_scrap_from_all_scrappers if async_scrap else scrap_from_all_scrappers)(*args, **kwargs)):
+            writer.add_many(server for server in servers if server.host)
+
+
+
+async def _save_journaled(sweep: str, resume: bool, statuses: t.Callable[[Progress], t.AsyncIterator[t.List[pinger.PingedServer]]]) -> None:
+    """
+        Saves pinged servers while journaling the run's progress as `sweep` (see `journal`). With `resume`, the run continues
+        after the saved positions of an interrupted one, otherwise it starts over. The journal is cleared once the run finishes.
+    """
+
+    progress = Progress(load_journal(sweep, DATABASE) if resume else None)
+    if not resume:
+        clear_journal(sweep, DATABASE)
+
+    async with DatabaseWriterThread(database=DATABASE) as writer:
+        async for servers in statuses(progress):
+            await writer.put_many(servers, checkpoint={(sweep, stream): position for stream, position in progress.changes().items()})
+
+    clear_journal(sweep, DATABASE)
+
+
+
+async def ping_and_update(*args, resume: bool=False, **kwargs):
+    """
+        Pings servers from the database and saves the results (see `pinger.ping_all` for arguments).
+
+        - `resume` - Continue where an interrupted run stopped, without pinging servers it saved again (the journal is kept as `ping`)
+    """
+
+    await _save_journaled('ping', resume, lambda progress: pinger.ping_all(*args, progress=progress, **kwargs))
+
+
+
+async def ping_from_all_scrappers_and_save(*args, resume: bool=False, **kwargs):
+    """
+        Scraps servers from all scrappers, pings them and saves the results (see `pinger.scrap_and_ping_all` for arguments).
+
+        - `resume` - Continue every server list where an interrupted run stopped, without scrapping pages it saved again
+        (the journal is kept as `scrap_and_ping`)
+    """
+
+    await _save_journaled('scrap_and_ping', resume, lambda progress: pinger.scrap_and_ping_all(*args, progress=progress, **kwargs))
+
+
+
+@dataclass
+class StageStats:
+    """
+        - `name` - Name of the stage
+        - `workers` - Number of workers of the stage
+        - `processed` - Items the stage has finished
+        - `skipped` - Items the stage has thrown away (duplicates, servers without host, ...)
+        - `queue` - Queue the stage takes its items from (`None` for the first stage)
+    """
+
+    name: str
+    workers: int
+    processed: int = 0
+    skipped: int = 0
+    queue: t.Optional[asyncio.Queue] = field(default=None, repr=False)
+    started_at: float = field(default_factory=time.monotonic, repr=False)
+
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+
+    @property
+    def throughput(self) -> float:
+        """Processed items per second."""
+
+        return self.processed / max(time.monotonic() - self.started_at, 1e-9)
+
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.processed} done, {self.skipped} skipped, {self.throughput:.1f}/s, {self.queue_depth} queued ({self.workers} workers)"
+
+
+
+class Pipeline():
+    """
+        Staged producer/consumer pipeline, where all stages run at the same time:
+        1. `scrap` - Scraps all server lists concurrently (see `scrappers.async_scrap_from_all_scrappers`)
+        2. `dedupe` - Sends servers that were already scrapped during this run (by `deduplicator`) straight to `persist`,
+        so every unique server is pinged once, but all sources that listed it are recorded
+        3. `resolve` (only with a `resolver`) - Resolves server addresses through the (cached) `resolver.Resolver`, servers that
+        don't resolve go straight to `persist` as offline, without taking a ping worker
+        4. `ping` - `ping_workers` workers pinging servers
+        5. `persist` - Hands the results over to a `DatabaseWriterThread`
+
+        With `seed_from_database`, servers that are already in the database count as seen, so only newly listed servers are pinged
+        (the rest is left for `ping_and_update`). With a `page_cache`, unchanged server list pages are skipped and with `incremental`,
+        server lists sorted by recency stop at servers known from previous runs (see `scrappers.scrap_from_all_scrappers`).
+
+        Stages are connected with queues of `queue_size` items, so a slow stage slows the previous ones down. Each stage has
+        its `StageStats` in `stats` (queue depth and throughput), which are reported every `report_interval` seconds to show the bottleneck.
+    """
+
+    def __init__(
+        self,
+        scrappers: t.Optional[t.List[t.Type['ServerListScrapper']]]=None,
+        database: Database=DATABASE,
+        scrap_concurrency: int=SCRAP_CONCURRENCY,
+        scrap_delay: float=SCRAP_DELAY,
+        ping_workers: int=PING_CONCURRENCY,
+        ping_timeout: t.Optional[float]=PING_TIMEOUT,
+        ping_rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+        queue_size: int=PIPELINE_QUEUE_SIZE,
+        report_interval: t.Optional[float]=PIPELINE_REPORT_INTERVAL,
+        deduplicator: t.Optional[ServerDeduplicator]=None,
+        seed_from_database: bool=False,
+        resolver: t.Optional['Resolver']=None,
+        page_cache: t.Optional[PageCache]=None,
+        incremental: bool=False,
+        ping_client: pinger.PingClient=PING_CLIENT
+    ) -> None:
+        from mst.scrappers import ALL_SCRAPPERS
+
+        self.scrappers = scrappers if scrappers is not None else ALL_SCRAPPERS
+        self.database = database
+        self.scrap_concurrency = scrap_concurrency
+        self.scrap_delay = scrap_delay
+        self.ping_timeout = ping_timeout
+        self.ping_rate_limit = ping_rate_limit
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+
+        self.stats: t.Dict[str, StageStats] = {
+            'scrap': StageStats('scrap', workers=len(self.scrappers) * scrap_concurrency),
+            'dedupe': StageStats('dedupe', workers=1),
+            **({'resolve': StageStats('resolve', workers=resolver.concurrency)} if resolver else {}),
+            'ping': StageStats('ping', workers=ping_workers),
+            'persist': StageStats('persist', workers=1)
+        }
+
+        self.deduplicator = deduplicator or ServerDeduplicator()
+        self.seed_from_database = seed_from_database
+        self.resolver = resolver
+        self.page_cache = page_cache
+        self.incremental = incremental
+        self.ping_client = ping_client
+
+
+    def report(self) -> str:
+        return " | ".join(str(stats) for stats in self.stats.values())
+
+
+    async def _scrap(self, output: asyncio.Queue) -> None:
+        from mst.scrappers import async_scrap_from_all_scrappers
+
+        stats = self.stats['scrap']
+
+        known_servers = (lambda source: load_known_servers(source, self.database)) if self.incremental else None
+
+        async for servers in async_scrap_from_all_scrappers(
+            self.scrappers, concurrency=self.scrap_concurrency, delay=self.scrap_delay, cache=self.page_cache, known_servers=known_servers
+        ):
+            for server in servers:
+                await output.put(server)
+                stats.processed += 1
+
+
+    async def _dedupe(self, input: asyncio.Queue, output: asyncio.Queue, duplicates: asyncio.Queue) -> None:
+        stats = self.stats['dedupe']
+
+        while True:
+            server = await input.get() # type: Server
+
+            try:
+                if not server.host:
+                    stats.skipped += 1
+
+                elif self.deduplicator.add(server):
+                    await output.put((server, None))
+                    stats.processed += 1
+
+                else:
+                    await duplicates.put(server)
+                    stats.skipped += 1
+
+            finally:
+                input.task_done()
+
+
+    async def _resolve(self, input: asyncio.Queue, output: asyncio.Queue, unresolved: asyncio.Queue) -> None:
+        stats = self.stats['resolve']
+
+        while True:
+            server, _ = await input.get() # type: (Server, None)
+
+            try:
+                address = await self.resolver.resolve(server.host, server.port)
+
+                if address is None:
+                    await unresolved.put(pinger.PingedServer(source=server.source, host=server.host, port=server.port))
+                    stats.skipped += 1
+
+                else:
+                    await output.put((server, address))
+                    stats.processed += 1
+
+            finally:
+                input.task_done()
+
+
+    async def _ping(self, input: asyncio.Queue, output: asyncio.Queue, limiter: RateLimiter) -> None:
+        stats = self.stats['ping']
+
+        while True:
+            server, address = await input.get() # type: (Server, t.Optional[Address])
+
+            try:
+                await limiter.wait()
+                await output.put(await pinger.get_status(server, timeout=self.ping_timeout, address=address, client=self.ping_client))
+                stats.processed += 1
+
+            finally:
+                input.task_done()
+
+
+    async def _persist(self, input: asyncio.Queue, writer: DatabaseWriterThread) -> None:
+        stats = self.stats['persist']
+
+        while True:
+            server = await input.get() # type: t.Union[pinger.PingedServer, Server]
+
+            try:
+                await writer.put(server)
+                stats.processed += 1
+
+            finally:
+                input.task_done()
+
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(self.report())
+
+
+    async def run(self) -> t.Dict[str, StageStats]:
+        """
+            Runs the whole pipeline until all server lists are scrapped and all results are saved. Returns the final statistics.
+        """
+
+        queues = {name: asyncio.Queue(maxsize=self.queue_size) for name in self.stats if name != 'scrap'}
+        for name, queue in queues.items():
+            self.stats[name].queue = queue
+            QUEUE_DEPTH.track(queue.qsize, queue=name)
+
+        for stats in self.stats.values():
+            stats.started_at = time.monotonic()
+
+        limiter = RateLimiter(self.ping_rate_limit)
+
+        if self.seed_from_database:
+            await asyncio.to_thread(self.deduplicator.seed_from_database, self.database)
+
+        async with DatabaseWriterThread(database=self.database) as writer:
+            workers = [
+                asyncio.ensure_future(self._dedupe(queues['dedupe'], queues['resolve' if self.resolver else 'ping'], queues['persist'])),
+                *[asyncio.ensure_future(self._resolve(queues['resolve'], queues['ping'], queues['persist'])) for _ in range(self.stats['resolve'].workers if self.resolver else 0)],
+                *[asyncio.ensure_future(self._ping(queues['ping'], queues['persist'], limiter)) for _ in range(self.stats['ping'].workers)],
+                asyncio.ensure_future(self._persist(queues['persist'], writer))
+            ]
+            if self.report_interval:
+                workers.append(asyncio.ensure_future(self._report()))
+
+            try:
+                # Every stage is done once the previous one is done and its queue is empty:
+                await self._supervise(self._scrap(queues['dedupe']), workers)
+                for queue in queues.values():
+                    await self._supervise(queue.join(), workers)
+
+            finally:
+                for worker in workers:
+                    worker.cancel()
+
+                await asyncio.gather(*workers, return_exceptions=True)
+
+                for name in queues:
+                    QUEUE_DEPTH.remove(queue=name)
+
+        return self.stats
+
+
+    @staticmethod
+    async def _supervise(awaitable: t.Awaitable, workers: t.List[asyncio.Future]) -> None:
+        """
+            Waits for `awaitable`, but raises right away if any of the (never-ending) workers fails.
+        """
+
+        waiter = asyncio.ensure_future(awaitable)
+
+        try:
+            await asyncio.wait([waiter, *workers], return_when=asyncio.FIRST_COMPLETED)
+
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+
+        for worker in workers:
+            if worker.done():
+                worker.result()
+
+        waiter.result()
+
+
 
+async def run_pipeline(*args, **kwargs) -> t.Dict[str, StageStats]:
+    """
+        Scraps, pings and saves servers through a `Pipeline` (`args` and `kwargs` are passed to it) and prints the final statistics.
+    """
 
+    pipeline = Pipeline(*args, **kwargs)
+    stats = await pipeline.run()
+    print(pipeline.report())
 
-async def ping_from_all_scrappers_and_save(*args, **kwargs):
-    for scrapped_servers in scrap_from_all_scrappers(*args, **kwargs):
-        statuses = await asyncio.gather(*[
-            pinger.get_status(scrapped_server) for scrapped_server in scrapped_servers if scrapped_server and scrapped_server.host
-        ])
-    
-        for status in statuses:
-            save_into_database(server=status, database=DATABASE)
+    return stats
 
 
 
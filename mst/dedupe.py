@@ -0,0 +1,138 @@
+"""
+    Deduplication of scrapped servers. The same popular servers are listed on more server lists, so every unique
+    endpoint is pinged only once per sweep (see `data.Pipeline`), while every source that listed it is still recorded.
+"""
+
+import typing as t
+
+import math
+from hashlib import blake2b
+
+from peewee import Database
+
+from mst.orm import DATABASE, DB_Server, Server
+from mst.settings import DEDUPE_BLOOM_CAPACITY, DEDUPE_BLOOM_ERROR_RATE
+
+
+Endpoint = t.Tuple[str, int]
+
+
+
+def normalize_endpoint(host: str, port: t.Optional[int]=25565) -> Endpoint:
+    """
+        Normalizes a server address, so the same server listed as `Play.Example.com.` and `play.example.com:25565` has the same key.
+    """
+
+    return (host.strip().lower().rstrip('.'), int(port or 25565))
+
+
+
+class BloomFilter():
+    """
+        Compact probabilistic set - `in` can return `True` for an item that was never added (with probability of about `error_rate`
+        once `capacity` items are added), but never `False` for an item that was.
+    """
+
+    def __init__(self, capacity: int, error_rate: float=DEDUPE_BLOOM_ERROR_RATE) -> None:
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+
+    def _positions(self, item: str) -> t.Iterator[int]:
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+
+class ServerDeduplicator():
+    """
+        Remembers endpoints (normalized `(host, port)`) of seen servers - in an exact set, or in a `BloomFilter`
+        if `bloom_capacity` is set (for very large runs).
+
+        - `unique` - Number of unique servers seen
+        - `duplicates` - Number of servers that were already seen
+    """
+
+    def __init__(self, bloom_capacity: t.Optional[int]=DEDUPE_BLOOM_CAPACITY, bloom_error_rate: float=DEDUPE_BLOOM_ERROR_RATE) -> None:
+        self.seen: t.Union[t.Set[str], BloomFilter] = BloomFilter(bloom_capacity, bloom_error_rate) if bloom_capacity else set()
+
+        self.unique = 0
+        self.duplicates = 0
+
+
+    @staticmethod
+    def _key(host: str, port: t.Optional[int]) -> str:
+        host, port = normalize_endpoint(host, port)
+        return f"{host}:{port}"
+
+
+    def add(self, server: Server) -> bool:
+        """
+            Remembers the server and returns whether it is new (wasn't seen before).
+        """
+
+        if not server or not server.host:
+            return False
+
+        key = self._key(server.host, server.port)
+
+        if key in self.seen:
+            self.duplicates += 1
+            return False
+
+        self.seen.add(key)
+        self.unique += 1
+
+        return True
+
+
+    def split(self, servers: t.Iterable[Server]) -> t.Tuple[t.List[Server], t.List[Server]]:
+        """
+            Splits servers into new ones and duplicates.
+        """
+
+        new: t.List[Server] = []
+        duplicates: t.List[Server] = []
+
+        for server in servers:
+            (new if self.add(server) else duplicates).append(server)
+
+        return new, duplicates
+
+
+    def seed_from_database(self, database: Database=DATABASE, at_once: int=10000) -> int:
+        """
+            Marks all servers that are already in the `servers` table as seen (pages through it by primary key).
+            Returns the number of added servers.
+        """
+
+        seeded = 0
+        last_id = 0
+
+        while True:
+            rows = list(DB_Server.select(DB_Server.id, DB_Server.host, DB_Server.port).where(DB_Server.id > last_id).order_by(DB_Server.id).limit(at_once).tuples().bind(database))
+            if not rows:
+                break
+
+            for _, host, port in rows:
+                key = self._key(host, port)
+                if key not in self.seen:
+                    self.seen.add(key)
+                    seeded += 1
+
+            last_id = rows[-1][0]
+
+        return seeded
@@ -0,0 +1,228 @@
+"""
+    Columnar exports of the server and player history, so analytical queries run against a snapshot instead of the live database.
+
+    `export_database` streams the `servers`, `server_records`, `players` and `rs_player_server_records` tables in chunks
+    (keyset pagination by ID, one short read per chunk, so the writer is never blocked for long) into compressed Parquet
+    or Arrow IPC files:
+
+        <path>/<table>/part-<first ID>.parquet                  (servers, players)
+        <path>/<table>/date=<YYYY-MM-DD>/part-<first ID>.parquet (records and player relationships, by the record's date)
+
+    The last exported ID of every table is kept in `<path>/_state.json`, so the next export only appends new rows
+    (records and relationships are append-only; new servers and players are appended, renamed ones aren't updated).
+    The files can be read as one dataset, such as with `pyarrow.dataset.dataset(<path>/<table>, partitioning='hive')`.
+
+    Needs `pyarrow` (`pip install pyarrow`).
+"""
+
+import typing as t
+
+import json
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+try:
+    import pyarrow as pa # type: ignore
+    import pyarrow.ipc # type: ignore
+    import pyarrow.parquet as pq # type: ignore
+except ImportError:
+    pa = None
+    pq = None
+
+from peewee import ColumnBase, Database, ModelSelect, fn
+
+from mst.orm import DATABASE, BaseModel, DB_Player, DB_PlayerRecordsRelationship, DB_Server, DB_ServerRecord
+from mst.settings import EXPORT_PATH, EXPORT_CHUNK_SIZE, EXPORT_FORMAT, EXPORT_COMPRESSION
+
+
+ExportFormat = t.Literal['parquet', 'arrow']
+
+_EXTENSIONS: t.Dict[str, str] = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+
+
+@dataclass
+class ExportTable:
+    """
+        - `model` - Exported model (paged through by its `id`)
+        - `columns` - Column name: (selected field or expression, name of its `pyarrow` type)
+        - `date` - Name of the (timestamp) column the files are partitioned by (`None` - not partitioned)
+        - `join` - Joins the model with other models `columns` come from
+    """
+
+    model: t.Type[BaseModel]
+    columns: t.Dict[str, t.Tuple[ColumnBase, str]]
+    date: t.Optional[str] = None
+    join: t.Optional[t.Callable[[ModelSelect], ModelSelect]] = None
+
+
+    def query(self, database: Database, after: int, until: int, limit: int) -> t.List[tuple]:
+        query = self.model.select(*(field for field, _ in self.columns.values()))
+        if self.join:
+            query = self.join(query)
+
+        return list(query
+            .where(self.model.id > after, self.model.id <= until)
+            .order_by(self.model.id)
+            .limit(limit)
+            .tuples()
+            .bind(database))
+
+
+    def schema(self) -> 'pa.Schema':
+        return pa.schema([(name, pa.timestamp('us') if type_name == 'timestamp' else getattr(pa, type_name)()) for name, (_, type_name) in self.columns.items()])
+
+
+
+_FULL_RECORD_COLUMNS = DB_ServerRecord.full_columns()
+
+EXPORT_TABLES: t.Dict[str, ExportTable] = {
+    'rs_player_server_records': ExportTable(
+        model=DB_PlayerRecordsRelationship,
+        columns={
+            'id': (DB_PlayerRecordsRelationship.id, 'int64'),
+            'player': (DB_PlayerRecordsRelationship.player, 'int64'),
+            'record': (DB_PlayerRecordsRelationship.record, 'int64'),
+            'timestamp': (DB_ServerRecord.timestamp, 'timestamp')
+        },
+        date='timestamp',
+        join=lambda query: query.join(DB_ServerRecord, on=(DB_PlayerRecordsRelationship.record == DB_ServerRecord.id))
+    ),
+    'server_records': ExportTable(
+        model=DB_ServerRecord,
+        columns={
+            'id': (DB_ServerRecord.id, 'int64'),
+            'server': (DB_ServerRecord.server, 'int64'),
+            'timestamp': (DB_ServerRecord.timestamp, 'timestamp'),
+            'source': (DB_ServerRecord.source, 'string'),
+            'latency': (DB_ServerRecord.latency, 'float64'),
+            'version': (_FULL_RECORD_COLUMNS['version'], 'string'),
+            'is_modded': (_FULL_RECORD_COLUMNS['is_modded'], 'bool_'),
+            'description': (_FULL_RECORD_COLUMNS['description'], 'string'),
+            'max_players': (_FULL_RECORD_COLUMNS['max_players'], 'int64'),
+            'online_players_number': (DB_ServerRecord.online_players_number, 'int64')
+        },
+        date='timestamp',
+        join=DB_ServerRecord.join_states # Compact records are exported with all of their fields
+    ),
+    'players': ExportTable(
+        model=DB_Player,
+        columns={'id': (DB_Player.id, 'int64'), 'uuid': (DB_Player.uuid, 'string'), 'username': (DB_Player.username, 'string')}
+    ),
+    'servers': ExportTable(
+        model=DB_Server,
+        columns={'id': (DB_Server.id, 'int64'), 'host': (DB_Server.host, 'string'), 'port': (DB_Server.port, 'int64')}
+    )
+}
+"""Exported tables. Rows are inserted in the opposite order (a server before its records before their players), so reading
+the upper bounds of all tables in this order makes every exported row's references exported too."""
+
+
+
+def _load_state(path: Path) -> t.Dict[str, int]:
+    state_path = Path(path, '_state.json')
+
+    return json.loads(state_path.read_text()) if state_path.exists() else {}
+
+
+def _save_state(path: Path, state: t.Dict[str, int]) -> None:
+    temporary = Path(path, '_state.json.tmp')
+    temporary.write_text(json.dumps(state))
+    os.replace(temporary, Path(path, '_state.json'))
+
+
+
+def _partitions(table: ExportTable, rows: t.List[tuple]) -> t.Dict[str, t.List[tuple]]:
+    """
+        Splits a chunk of rows into partitions (relative directories) by their date.
+    """
+
+    if table.date is None:
+        return {'': rows}
+
+    index = list(table.columns).index(table.date)
+    partitions: t.Dict[str, t.List[tuple]] = defaultdict(list)
+
+    for row in rows:
+        date: t.Optional[datetime] = row[index]
+        partitions[f'date={date:%Y-%m-%d}' if date else 'date=unknown'].append(row)
+
+    return partitions
+
+
+
+def _write_file(path: Path, table: ExportTable, rows: t.List[tuple], format: ExportFormat, compression: str) -> None:
+    schema = table.schema()
+    arrow_table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)], schema=schema)
+
+    # Written under a temporary name first, so readers never see half a file:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+
+    if format == 'parquet':
+        pq.write_table(arrow_table, temporary, compression=compression)
+
+    else:
+        with pa.OSFile(str(temporary), 'wb') as sink, pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression)) as writer:
+            writer.write_table(arrow_table)
+
+    os.replace(temporary, path)
+
+
+
+def export_database(
+    path: Path=EXPORT_PATH,
+    database: Database=DATABASE,
+    tables: t.Optional[t.Iterable[str]]=None,
+    format: ExportFormat=EXPORT_FORMAT,
+    compression: str=EXPORT_COMPRESSION,
+    chunk_size: int=EXPORT_CHUNK_SIZE
+) -> t.Dict[str, int]:
+    """
+        Exports rows added since the last export into `path` (see the module's docs) and returns the number of exported rows per table.
+
+        Memory use is bounded by `chunk_size` - every chunk is read in its own short query and written into its own file(s).
+        A chunk's files are named after its first ID, so an export interrupted between writing them and saving the state
+        just overwrites them next time (as long as `chunk_size` is the same).
+
+        - `tables` - Names of exported tables (all `EXPORT_TABLES` by default)
+        - `format` - `parquet` or `arrow` (Arrow IPC)
+    """
+
+    if pa is None:
+        raise RuntimeError("Exports need pyarrow (pip install pyarrow)")
+
+    if format not in _EXTENSIONS:
+        raise ValueError(f"Unknown export format: {format!r} (expected one of: {', '.join(_EXTENSIONS)})")
+
+    names = [name for name in EXPORT_TABLES if tables is None or name in set(tables)]
+    unknown = set(tables or ()) - set(EXPORT_TABLES)
+    if unknown:
+        raise ValueError(f"Unknown exported tables: {', '.join(sorted(unknown))} (expected some of: {', '.join(EXPORT_TABLES)})")
+
+    path.mkdir(parents=True, exist_ok=True)
+    state = _load_state(path)
+
+    # Rows added during the export are left for the next one:
+    upper_bounds = {name: EXPORT_TABLES[name].model.select(fn.MAX(EXPORT_TABLES[name].model.id)).bind(database).scalar() or 0 for name in names}
+    exported = {name: 0 for name in names}
+
+    for name in names:
+        table = EXPORT_TABLES[name]
+        last_id = state.get(name, 0)
+
+        while last_id < upper_bounds[name]:
+            rows = table.query(database, last_id, upper_bounds[name], chunk_size)
+            if not rows:
+                break
+
+            for partition, partition_rows in _partitions(table, rows).items():
+                _write_file(Path(path, name, partition, f'part-{rows[0][0]:012d}.{_EXTENSIONS[format]}'), table, partition_rows, format, compression)
+
+            last_id = state[name] = rows[-1][0]
+            exported[name] += len(rows)
+            _save_state(path, state)
+
+    return exported
@@ -0,0 +1,93 @@
+"""
+    Fast extraction of server addresses from server list pages.
+
+    Every scrapper describes where the addresses are on its pages with an `AddressPath` - the same path as a CSS selector
+    (for BeautifulSoup) and as XPath, which is compiled once and evaluated right on the lxml tree, without building
+    a BeautifulSoup tree of the whole page (the dominant cost of scrapping).
+"""
+
+import typing as t
+
+import lxml.html
+from bs4 import BeautifulSoup
+from lxml.etree import ParserError, XPath
+
+
+Address = t.Tuple[t.Optional[str], int]
+"""Host (lowercase) and port (`25565` if the page doesn't show any) of a listed server."""
+
+
+
+def has_class(name: str) -> str:
+    """
+        XPath condition matching elements with the `name` class (as the `.<name>` CSS selector).
+    """
+
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+
+def parse_html(markup: str) -> t.Optional[lxml.html.HtmlElement]:
+    """
+        Parses a page with lxml (`None` if it's empty).
+    """
+
+    try:
+        return lxml.html.document_fromstring(markup)
+
+    except ParserError:
+        return None
+
+    except ValueError: # Unicode strings with an XML encoding declaration
+        return lxml.html.document_fromstring(markup.encode())
+
+
+
+def split_address(address: str) -> Address:
+    host, _, port = address.strip().lower().partition(':')
+
+    return host, int(port) if port.isdigit() else 25565
+
+
+
+class AddressPath():
+    """
+        Where server addresses (`host[:port]`) are on a server list page.
+
+        - `css` - CSS selector of the elements with addresses
+        - `xpath` - The same path as XPath
+        - `attribute` - Attribute of the elements with the address (their text if `None`)
+    """
+
+    def __init__(self, css: str, xpath: str, attribute: t.Optional[str]=None) -> None:
+        self.css = css
+        self.attribute = attribute
+        self.xpath = XPath(xpath + (f'/@{attribute}' if attribute else ''), smart_strings=False)
+
+
+    def from_tree(self, tree: t.Optional[lxml.html.HtmlElement]) -> t.List[Address]:
+        if tree is None:
+            return []
+
+        if self.attribute:
+            return [split_address(address) for address in self.xpath(tree)]
+
+        # Same as `get_text(strip=True)` of BeautifulSoup:
+        return [split_address(''.join(text.strip() for text in element.itertext())) for element in self.xpath(tree)]
+
+
+    def from_markup(self, markup: str) -> t.List[Address]:
+        return self.from_tree(parse_html(markup))
+
+
+    def from_soup(self, soup: BeautifulSoup) -> t.List[Address]:
+        """
+            Slow path over an already parsed BeautifulSoup tree (the two paths return the same addresses).
+        """
+
+        elements = soup.select(self.css)
+
+        if self.attribute:
+            return [split_address(element[self.attribute]) for element in elements if element.has_attr(self.attribute)]
+
+        return [split_address(element.get_text(strip=True)) for element in elements]
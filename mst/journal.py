@@ -0,0 +1,291 @@
+"""
+    Sweep journal - checkpoints of long runs (`data.ping_and_update`, `data.ping_from_all_scrappers_and_save`), so a crashed
+    or killed run can be resumed right where it stopped instead of scrapping and pinging everything again.
+
+    A run is made of streams of units - pages of a server list (by page number) or servers of the servers table (by ID).
+    `Progress` follows which units are finished, while their servers are pinged out of order. For every stream, the position
+    up to which everything is finished and the ranges finished after it are saved into `orm.DB_SweepJournal` by the database
+    writer in the same transaction as the results of those units (see `data.DatabaseWriterThread.put_many`).
+    A resumed run continues after the position and skips the finished ranges, so nothing saved is pinged again.
+"""
+
+import typing as t
+
+import bisect
+from collections import defaultdict, deque
+from datetime import datetime
+
+from peewee import EXCLUDED, Database
+
+from mst.orm import DATABASE, DB_SweepJournal
+from mst.utils import aiterate
+
+
+SERVERS_STREAM = 'servers'
+"""Stream of the servers table (pinged by `pinger.ping_all`), its positions are server IDs."""
+
+Range = t.Tuple[int, int]
+"""First and last position of a unit (page number twice for server list pages)."""
+
+_Key = t.Tuple[t.Optional[str], t.Optional[str], int]
+
+
+
+class StreamPosition(t.NamedTuple):
+    """
+        - `position` - Everything up to this position is finished
+        - `done` - Ranges after `position` that are finished too (sorted)
+    """
+
+    position: int = 0
+    done: t.Tuple[Range, ...] = ()
+
+
+    def is_done(self, position: int) -> bool:
+        index = bisect.bisect_right(self.done, (position, float('inf'))) - 1
+
+        return position <= self.position or (index >= 0 and self.done[index][0] <= position <= self.done[index][1])
+
+
+Checkpoint = t.Dict[t.Tuple[str, str], StreamPosition]
+"""Positions to save, by sweep and stream."""
+
+
+
+class Progress():
+    """
+        Finished positions of all streams of a run.
+
+        Units of a stream are numbered by their `sequence` (page numbers of server lists, so pages downloaded out of order are
+        fine). A unit is finished once all of its servers (with a host) are pinged, and the position of a stream only moves
+        over units that are finished, one after another - the ones finished before that are kept as runs of consecutive units
+        (saved as done ranges), so there are only about as many of them as there are units still being pinged.
+
+        - `positions` - Positions of a resumed run, by stream (see `load_journal`)
+    """
+
+    def __init__(self, positions: t.Optional[t.Dict[str, StreamPosition]]=None) -> None:
+        self.resumed: t.Dict[str, StreamPosition] = dict(positions or {})
+        self.positions: t.Dict[str, int] = {stream: position.position for stream, position in self.resumed.items()}
+
+        self._sequences: t.Dict[str, int] = {} # Last sequence of every stream up to which all units are finished
+        self._units: t.Dict[str, t.Dict[int, t.List[int]]] = defaultdict(dict) # Stream: sequence: [unfinished servers, first, last]
+        self._runs: t.Dict[str, t.Dict[int, t.List[int]]] = defaultdict(dict) # Stream: first sequence: [last sequence, first, last]
+        self._run_ends: t.Dict[str, t.Dict[int, int]] = defaultdict(dict) # Stream: last sequence: first sequence of the run
+        self._pending: t.Dict[_Key, t.Deque[t.Tuple[str, int]]] = defaultdict(deque) # Server: units waiting for it
+        self._changed: t.Set[str] = set()
+
+
+    def start(self, stream: str, sequence: int, servers: t.Iterable[t.Any], first: t.Optional[int]=None, last: t.Optional[int]=None) -> None:
+        """
+            Starts a unit with the servers that will be pinged (its range is `sequence` to `sequence` if not given).
+        """
+
+        keys = [(server.source, server.host, server.port) for server in servers if server and server.host]
+        first = sequence if first is None else first
+        last = sequence if last is None else last
+
+        if not keys:
+            self._finish_unit(stream, sequence, first, last)
+            return
+
+        self._units[stream][sequence] = [len(keys), first, last]
+
+        for key in keys:
+            self._pending[key].append((stream, sequence))
+
+
+    def finish(self, servers: t.Iterable[t.Any]) -> None:
+        """
+            Marks pinged servers (`pinger.PingedServer`) as finished.
+        """
+
+        for server in servers:
+            key = (server.source, server.host, server.port)
+            units = self._pending.get(key)
+            if not units:
+                continue
+
+            stream, sequence = units.popleft()
+            if not units:
+                del self._pending[key]
+
+            unit = self._units[stream][sequence]
+            unit[0] -= 1
+            if unit[0] <= 0:
+                del self._units[stream][sequence]
+                self._finish_unit(stream, sequence, unit[1], unit[2])
+
+
+    def _finish_unit(self, stream: str, sequence: int, first: int, last: int) -> None:
+        runs, run_ends = self._runs[stream], self._run_ends[stream]
+        self._changed.add(stream)
+
+        # Joins the runs of finished units right before and after this one:
+        run_start = run_ends.pop(sequence - 1, None)
+        if run_start is None:
+            run_start = sequence
+            runs[run_start] = [sequence, first, last]
+        else:
+            runs[run_start][0], runs[run_start][2] = sequence, last
+
+        following = runs.pop(sequence + 1, None)
+        if following is not None:
+            del run_ends[following[0]]
+            runs[run_start][0], runs[run_start][2] = following[0], following[2]
+
+        run_ends[runs[run_start][0]] = run_start
+
+        if run_start == self._sequences.get(stream, 0) + 1:
+            last_sequence, _, position = runs.pop(run_start)
+            del run_ends[last_sequence]
+
+            self._sequences[stream] = last_sequence
+            self.positions[stream] = max(self.positions.get(stream, 0), position)
+
+
+    def changes(self) -> t.Dict[str, StreamPosition]:
+        """
+            Positions of streams that moved since the last call.
+        """
+
+        changes = {}
+
+        for stream in self._changed:
+            position = self.positions.get(stream, 0)
+            resumed = self.resumed.get(stream, StreamPosition())
+
+            changes[stream] = StreamPosition(position, _merge_ranges(
+                [done for done in resumed.done if done[0] > position] + [(first, last) for _, first, last in self._runs[stream].values()]
+            ))
+
+        self._changed.clear()
+
+        return changes
+
+
+    def track_rows(self, pages: t.Iterable[t.List[t.Any]], stream: str=SERVERS_STREAM) -> t.Generator[t.List[t.Any], None, None]:
+        """
+            Starts servers from pages of server rows (`queries.ServerRow`, in the order of their IDs) as units as they are taken.
+            Rows finished by the resumed run are left out.
+        """
+
+        resumed = self.resumed.get(stream, StreamPosition())
+        sequence = 0
+
+        for page in pages:
+            if resumed.done:
+                page = [row for row in page if not resumed.is_done(row.id)]
+
+            # Every server is a unit of its own, so one slow server doesn't hold back the ones pinged after it:
+            for row in page:
+                sequence += 1
+                self.start(stream, sequence, (row,), first=row.id, last=row.id)
+
+            if page:
+                yield page
+
+
+    def first_pages(self) -> t.Dict[str, int]:
+        """
+            Pages to continue every resumed server list at.
+        """
+
+        return {stream: position.position + 1 for stream, position in self.resumed.items() if stream != SERVERS_STREAM}
+
+
+    def skipped_pages(self) -> t.Dict[str, t.Set[int]]:
+        """
+            Pages of every resumed server list finished after its position (not scrapped again).
+        """
+
+        return {
+            stream: {page for first, last in position.done for page in range(first, last + 1)}
+            for stream, position in self.resumed.items() if stream != SERVERS_STREAM and position.done
+        }
+
+
+    async def track_pages(self, pages: t.Union[t.Iterable[t.List[t.Any]], t.AsyncIterable[t.List[t.Any]]]) -> t.AsyncGenerator[t.List[t.Any], None]:
+        """
+            Starts scrapped pages (`scrappers.ServerPage`) as units of their server list as they are taken.
+        """
+
+        for stream, position in self.resumed.items():
+            if stream != SERVERS_STREAM:
+                self._sequences[stream] = position.position
+
+        for stream, skipped in self.skipped_pages().items():
+            for page in sorted(skipped):
+                self._finish_unit(stream, page, page, page)
+
+        self._changed.clear()
+
+        async for page in aiterate(pages):
+            self.start(page.source, page.number, page)
+            yield page
+
+
+
+def _merge_ranges(ranges: t.Iterable[Range]) -> t.Tuple[Range, ...]:
+    merged: t.List[Range] = []
+
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+
+    return tuple(merged)
+
+
+def _format_ranges(ranges: t.Iterable[Range]) -> str:
+    return ','.join(f'{first}-{last}' for first, last in ranges)
+
+
+def _parse_ranges(text: str) -> t.Tuple[Range, ...]:
+    return tuple((int(first), int(last)) for first, _, last in (done.partition('-') for done in text.split(',') if done))
+
+
+
+def load_journal(sweep: str, database: Database=DATABASE) -> t.Dict[str, StreamPosition]:
+    """
+        Saved positions of a run, by stream.
+    """
+
+    return {stream: StreamPosition(position, _parse_ranges(done)) for stream, position, done in (DB_SweepJournal
+        .select(DB_SweepJournal.stream, DB_SweepJournal.position, DB_SweepJournal.done)
+        .where(DB_SweepJournal.sweep == sweep)
+        .tuples()
+        .bind(database))}
+
+
+
+def save_journal(checkpoint: Checkpoint, database: Database=DATABASE) -> None:
+    if not checkpoint:
+        return
+
+    now = datetime.now()
+    rows = [(sweep, stream, position.position, _format_ranges(position.done), now) for (sweep, stream), position in checkpoint.items()]
+
+    (DB_SweepJournal
+        .insert_many(rows, fields=[
+            DB_SweepJournal.sweep, DB_SweepJournal.stream, DB_SweepJournal.position, DB_SweepJournal.done, DB_SweepJournal.updated_at
+        ])
+        .on_conflict(
+            conflict_target=(DB_SweepJournal.sweep, DB_SweepJournal.stream),
+            update={
+                DB_SweepJournal.position: EXCLUDED.position,
+                DB_SweepJournal.done: EXCLUDED.done,
+                DB_SweepJournal.updated_at: EXCLUDED.updated_at
+            }
+        )
+        .execute(database))
+
+
+
+def clear_journal(sweep: str, database: Database=DATABASE) -> None:
+    """
+        Forgets a run's positions - once it's finished, or when a new one starts from the beginning.
+    """
+
+    DB_SweepJournal.delete().where(DB_SweepJournal.sweep == sweep).execute(database)
@@ -0,0 +1,362 @@
+"""
+    Metrics of long runs - counters, gauges and histograms of every stage (scrapping, pinging, saving and the event loop).
+
+    Metrics live in a `Registry` (`REGISTRY` by default) and can be:
+        - scraped in the Prometheus text format from a local HTTP endpoint (`start_metrics_server`)
+        - written as periodic structured (JSON) log lines by a `MetricsLogger`
+
+    All metrics are thread-safe (the database writer thread updates them too). Metrics of `sweep` workers stay in their processes.
+"""
+
+import typing as t
+
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from mst.profiling import watch_event_loop
+from mst.settings import METRICS_HOST, EVENT_LOOP_LAG_INTERVAL
+
+if t.TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+
+LOGGER = logging.getLogger('mst.metrics')
+
+_LabelValues = t.Tuple[str, ...]
+
+DEFAULT_BUCKETS: t.Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Histogram buckets (upper bounds, in seconds) for durations."""
+
+
+
+class Registry():
+    def __init__(self) -> None:
+        self.metrics: t.Dict[str, '_Metric'] = {}
+
+
+    def register(self, metric: '_Metric') -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered")
+
+        self.metrics[metric.name] = metric
+
+
+    def render(self) -> str:
+        """
+            All metrics in the Prometheus text exposition format.
+        """
+
+        return ''.join(f"# HELP {metric.name} {metric.help}\n# TYPE {metric.name} {metric.type}\n" + ''.join(
+            f"{name}{_format_labels(labels)} {_format_value(value)}\n" for name, labels, value in metric.samples()
+        ) for metric in self.metrics.values())
+
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        """
+            Current values of all metrics as a flat, JSON serializable dictionary (histograms are summarized by their count and sum).
+        """
+
+        values: t.Dict[str, t.Any] = {}
+
+        for metric in self.metrics.values():
+            for name, labels, value in metric.samples():
+                if not name.endswith('_bucket'):
+                    values[name + _format_labels(labels)] = value
+
+        return values
+
+
+
+REGISTRY = Registry()
+
+
+
+def _format_labels(labels: t.Dict[str, str]) -> str:
+    if not labels:
+        return ''
+
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(float(value))
+
+
+
+class _Metric():
+    type: str
+
+
+    def __init__(self, name: str, help: str, labels: t.Sequence[str]=(), registry: t.Optional[Registry]=REGISTRY) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+
+    def _key(self, labels: t.Dict[str, t.Any]) -> _LabelValues:
+        if labels.keys() != set(self.labels):
+            raise ValueError(f"Metric {self.name!r} expects labels {self.labels}, got {tuple(labels)}")
+
+        return tuple(str(labels[label]) for label in self.labels)
+
+
+    def samples(self) -> t.Iterator[t.Tuple[str, t.Dict[str, str], float]]:
+        raise NotImplementedError()
+
+
+
+class Counter(_Metric):
+    """
+        Monotonically increasing count (of pings, pages, ...).
+    """
+
+    type = 'counter'
+
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: t.Dict[_LabelValues, float] = {}
+
+
+    def inc(self, amount: float=1, **labels) -> None:
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+    def samples(self) -> t.Iterator[t.Tuple[str, t.Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+
+        for key, value in values:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+
+class Gauge(_Metric):
+    """
+        Value that goes up and down. Either `set` directly or `track`ed - read from a function whenever the metrics are collected
+        (such as the size of a queue).
+    """
+
+    type = 'gauge'
+
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: t.Dict[_LabelValues, t.Union[float, t.Callable[[], float]]] = {}
+
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+    def track(self, function: t.Callable[[], float], **labels) -> None:
+        self.set(function, **labels) # type: ignore
+
+
+    def remove(self, **labels) -> None:
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+
+    def value(self, **labels) -> float:
+        value = self._values.get(self._key(labels), 0)
+
+        return value() if callable(value) else value
+
+
+    def samples(self) -> t.Iterator[t.Tuple[str, t.Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+
+        for key, value in values:
+            yield self.name, dict(zip(self.labels, key)), value() if callable(value) else value
+
+
+
+class Histogram(_Metric):
+    """
+        Distribution of observed values (latencies, flush sizes, ...) in cumulative `buckets` (upper bounds).
+    """
+
+    type = 'histogram'
+
+
+    def __init__(self, *args, buckets: t.Sequence[float]=DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._values: t.Dict[_LabelValues, t.List[float]] = {} # Bucket counts (+ the `+Inf` one), sum
+
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+
+            values[index] += 1
+            values[-1] += value
+
+
+    @contextmanager
+    def time(self, **labels) -> t.Iterator[None]:
+        started = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+    def count(self, **labels) -> int:
+        values = self._values.get(self._key(labels))
+
+        return sum(values[:-1]) if values else 0
+
+
+    def samples(self) -> t.Iterator[t.Tuple[str, t.Dict[str, str], float]]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+
+        for key, counts in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': _format_value(bound)}, cumulative
+
+            yield f'{self.name}_count', labels, cumulative
+            yield f'{self.name}_sum', labels, counts[-1]
+
+
+
+PAGES_SCRAPED = Counter('mst_pages_scraped_total', "Server list pages downloaded and parsed", ('source',))
+PAGES_UNCHANGED = Counter('mst_pages_unchanged_total', "Server list pages that didn't change since they were scrapped the last time (not parsed)", ('source',))
+SERVERS_SCRAPED = Counter('mst_servers_scraped_total', "Servers found on server list pages", ('source',))
+PINGS_STARTED = Counter('mst_pings_started_total', "Server List Pings started")
+PINGS_FINISHED = Counter('mst_pings_finished_total', "Server List Pings finished, by result (`online`, `timeout` or `error`)", ('result',))
+PING_DURATION = Histogram('mst_ping_duration_seconds', "Wall time of a Server List Ping (connection, status and ping)")
+FLUSH_SIZE = Histogram('mst_database_flush_size', "Servers saved by one database flush", buckets=(1, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000))
+FLUSH_DURATION = Histogram('mst_database_flush_duration_seconds', "Wall time of one database flush (one transaction)")
+QUEUE_DEPTH = Gauge('mst_queue_depth', "Items waiting in a queue (pipeline stages, database writer)", ('queue',))
+WORK_UNITS = Counter('mst_work_units_total', "Work units of a coordinated sweep, by event (`leased`, `expired` or `completed`)", ('event',))
+EVENT_LOOP_LAG = Histogram('mst_event_loop_lag_seconds', "How late the event loop woke up a sleeping task", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+
+def start_metrics_server(port: int, host: str=METRICS_HOST, registry: Registry=REGISTRY) -> 'ThreadingHTTPServer':
+    """
+        Serves `registry` in the Prometheus text format on `http://<host>:<port>/metrics` from a background thread.
+        Call `shutdown()` on the returned server to stop it.
+    """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = registry.render().encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, *_) -> None:
+            pass
+
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mst-metrics-server', daemon=True).start()
+
+    return server
+
+
+
+class MetricsLogger(threading.Thread):
+    """
+        Logs a snapshot of `registry` as one JSON line (`{"event": "metrics", ...}`) every `interval` seconds to the `mst.metrics` logger.
+    """
+
+    def __init__(self, interval: float, registry: Registry=REGISTRY) -> None:
+        super().__init__(name='mst-metrics-logger', daemon=True)
+
+        self.interval = interval
+        self.registry = registry
+        self._stopped = threading.Event()
+
+
+    def log(self) -> None:
+        LOGGER.info(json.dumps({'event': 'metrics', 'time': time.time(), **self.registry.snapshot()}))
+
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.log()
+
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.log()
+
+
+
+async def monitor_event_loop(interval: float=EVENT_LOOP_LAG_INTERVAL) -> None:
+    """
+        Sleeps for `interval` seconds over and over and records how much later than planned it woke up into `EVENT_LOOP_LAG`
+        (blocking calls and CPU-heavy work on the loop show up as lag). Runs until cancelled.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - started - interval, 0))
+
+
+
+async def monitored(awaitable: t.Awaitable, lag_interval: t.Optional[float]=EVENT_LOOP_LAG_INTERVAL) -> t.Any:
+    """
+        Awaits `awaitable` while `monitor_event_loop` watches the event loop (no monitoring if `lag_interval` is `None`).
+        A running profiler (`profiling.Profiler`) starts watching the event loop too.
+    """
+
+    watch_event_loop()
+    monitor = asyncio.ensure_future(monitor_event_loop(lag_interval)) if lag_interval else None
+
+    try:
+        return await awaitable
+
+    finally:
+        if monitor:
+            monitor.cancel()
@@ -12,16 +12,21 @@
 
 import typing as t
 
-from mst.settings import DATABASE_PATH
+import threading
+
+from mst.settings import DATABASE_PATH, DATABASE_PROFILE
+from mst.utils import slotted
 
 from pathlib import Path
 from datetime import datetime
 from dataclasses import dataclass
 
 from peewee import *
+from peewee import ColumnBase, ModelSelect
 
 
 
+@slotted
 @dataclass
 class Server:
     host: t.Optional[str] = None
@@ -42,11 +47,15 @@ class DB_Server(BaseModel):
 
         ### Backrefs:
         - `records` - All record for this server
+        - `sources` - All sources that listed this server
+        - `states` - Static fields of its compact records over time
     """
 
     host = CharField()
     port = IntegerField(default=25565)
     records: t.Iterable['DB_ServerRecord']
+    sources: t.Iterable['DB_ServerSource']
+    states: t.Iterable['DB_ServerState']
 
 
     @property
@@ -57,6 +66,9 @@ class DB_Server(BaseModel):
 
     class Meta:
         db_table = 'servers'
+        indexes = (
+            (('host', 'port'), True),
+        )
 
 
 
@@ -69,6 +81,56 @@ class DB_Record(BaseModel):
 
 
 
+class DB_InternedText(BaseModel):
+    """
+        Deduplicated text of compact records (see `storage`) - every distinct text is saved once.
+
+        - `hash` - Hash of the text (see `storage.text_hash`)
+        - `text` - The text
+    """
+
+    hash = CharField(unique=True)
+    text = TextField()
+
+
+
+class DB_Description(DB_InternedText):
+    class Meta:
+        db_table = 'descriptions'
+
+
+
+class DB_Version(DB_InternedText):
+    class Meta:
+        db_table = 'versions'
+
+
+
+class DB_ServerState(BaseModel):
+    """
+        Static fields of a server shared by its consecutive compact records - a new state is only saved when one of them changes.
+
+        - `server` - Server of the state
+        - `since` - Timestamp of the first record with this state
+        - `description` - Server MOTD/description
+        - `version` - Server version
+        - `max_players` - Max players online
+        - `is_modded` - Is the server modded?
+    """
+
+    server = ForeignKeyField(DB_Server, backref='states', null=True)
+    since = DateTimeField(default=datetime.now)
+    description = ForeignKeyField(DB_Description, null=True)
+    version = ForeignKeyField(DB_Version, null=True)
+    max_players = IntegerField()
+    is_modded = BooleanField(default=False)
+
+
+    class Meta:
+        db_table = 'server_states'
+
+
+
 class DB_ServerRecord(DB_Record):
     """
         - `source` - From what webpage was this server scrapped
@@ -79,6 +141,10 @@ class DB_ServerRecord(DB_Record):
         - `max_players` - Max players online
         - `online_players_number` - Players online (number)
         - `server` - Server that this record belongs to
+        - `state` - Static fields of a compact record (see `storage`), its own `version`, `is_modded`, `description`
+        and `max_players` are left empty - `select_full` reads records of both kinds with all of their fields
+
+        Records are append-only - every successful ping adds a new one, so the whole history of a server is kept.
 
         ### Backrefs:
         - `online_players` - Players online (list)
@@ -91,18 +157,117 @@ class DB_ServerRecord(DB_Record):
     description = TextField(null=True)
     max_players = IntegerField()
     online_players_number = IntegerField(default=0)
-    server = ForeignKeyField(DB_Server, backref='records', null=True, unique=True)
+    server = ForeignKeyField(DB_Server, backref='records', null=True, index=False)
+    state = ForeignKeyField(DB_ServerState, null=True, index=False)
     rs_players: t.Iterable['DB_PlayerRecordsRelationship']
 
 
+    @classmethod
+    def full_columns(cls) -> t.Dict[str, ColumnBase]:
+        """
+            Static fields of records with compact ones rebuilt from their state (needs `join_states`).
+        """
+
+        return {
+            'version': fn.COALESCE(DB_Version.text, cls.version),
+            'is_modded': fn.COALESCE(DB_ServerState.is_modded, cls.is_modded).python_value(bool),
+            'description': fn.COALESCE(DB_Description.text, cls.description),
+            'max_players': fn.COALESCE(DB_ServerState.max_players, cls.max_players)
+        }
+
+
+    @classmethod
+    def join_states(cls, query: ModelSelect) -> ModelSelect:
+        """
+            Joins records in `query` with their states and interned texts (if they have any).
+        """
+
+        return (query
+            .join_from(cls, DB_ServerState, JOIN.LEFT_OUTER, on=(cls.state == DB_ServerState.id))
+            .join_from(DB_ServerState, DB_Description, JOIN.LEFT_OUTER, on=(DB_ServerState.description == DB_Description.id))
+            .join_from(DB_ServerState, DB_Version, JOIN.LEFT_OUTER, on=(DB_ServerState.version == DB_Version.id)))
+
+
+    @classmethod
+    def select_full(cls, *fields) -> ModelSelect:
+        """
+            Selects records with all of their fields, whether they're saved as full or compact ones (see `storage`).
+            Other `fields` can be selected too.
+        """
+
+        columns = [column.alias(name) for name, column in cls.full_columns().items()]
+
+        return cls.join_states(cls.select(
+            cls.id, cls.timestamp, cls.source, cls.latency, cls.online_players_number, cls.server, cls.state, *columns, *fields
+        ))
+
+
     def get_players(self) -> t.Iterator['DB_Player']:
+        """
+            Players of this record (one query per record - use `players_of` for many records).
+        """
+
         query = (DB_Player.select().join(DB_PlayerRecordsRelationship, on=DB_PlayerRecordsRelationship.player).where(DB_PlayerRecordsRelationship.record == self.id))
 
         return query
 
 
+    @staticmethod
+    def players_of(records: t.Iterable[t.Union[int, 'DB_ServerRecord']]) -> t.Dict[int, t.List['DB_Player']]:
+        """
+            Players of many records at once (by record ID), in one query per `_IN_CHUNK_SIZE` records.
+        """
+
+        players: t.Dict[int, t.List[DB_Player]] = {}
+
+        for chunk in _id_chunks(records):
+            query = (DB_Player
+                .select(DB_Player, DB_PlayerRecordsRelationship.record.alias('record_id'))
+                .join(DB_PlayerRecordsRelationship, on=(DB_PlayerRecordsRelationship.player == DB_Player.id))
+                .where(DB_PlayerRecordsRelationship.record.in_(chunk))
+                .objects())
+
+            for player in query:
+                players.setdefault(player.record_id, []).append(player)
+
+        return players
+
+
+    @staticmethod
+    def online_players(
+        servers: t.Iterable[t.Union[int, DB_Server]],
+        since: t.Optional[datetime]=None,
+        until: t.Optional[datetime]=None
+    ) -> t.List[t.Tuple[int, datetime, int]]:
+        """
+            Who was online at `servers` over time - `(server ID, record timestamp, player ID)` of all records from the time range,
+            ordered by server and time, in one query per `_IN_CHUNK_SIZE` servers.
+        """
+
+        sightings: t.List[t.Tuple[int, datetime, int]] = []
+
+        for chunk in _id_chunks(servers):
+            conditions = [DB_ServerRecord.server.in_(chunk)]
+            if since is not None:
+                conditions.append(DB_ServerRecord.timestamp >= since)
+            if until is not None:
+                conditions.append(DB_ServerRecord.timestamp < until)
+
+            sightings.extend(DB_ServerRecord
+                .select(DB_ServerRecord.server, DB_ServerRecord.timestamp, DB_PlayerRecordsRelationship.player)
+                .join(DB_PlayerRecordsRelationship, on=(DB_PlayerRecordsRelationship.record == DB_ServerRecord.id))
+                .where(*conditions)
+                .order_by(DB_ServerRecord.server, DB_ServerRecord.timestamp)
+                .tuples())
+
+        return sightings
+
+
     class Meta:
         db_table = 'server_records'
+        indexes = (
+            (('server', 'timestamp'), False),
+        )
 
 
 
@@ -120,35 +285,524 @@ class DB_Player(BaseModel):
 
 
     def seen_at(self, server: DB_Server) -> t.Optional[int]:
-        return DB_PlayerRecordsRelationship.select().where(DB_PlayerRecordsRelationship.player == self).join(DB_ServerRecord, on=DB_PlayerRecordsRelationship.record).where(DB_ServerRecord.server == server).count()
+        """
+            How many times was the player seen at `server` (looked up in `DB_PlayerPresence`).
+        """
+
+        presence = DB_PlayerPresence.get_or_none((DB_PlayerPresence.player == self) & (DB_PlayerPresence.server == server))
+
+        return presence.sightings if presence else 0
 
 
 
     class Meta:
         db_table = 'players'
+        indexes = (
+            (('uuid', 'username'), True),
+        )
 
 
 
 class DB_PlayerRecordsRelationship(BaseModel):
-    player = ForeignKeyField(DB_Player, backref='rs_server_records')
+    player = ForeignKeyField(DB_Player, backref='rs_server_records', index=False)
     record = ForeignKeyField(DB_ServerRecord, backref='rs_players')
 
     
     class Meta:
         db_table = 'rs_player_server_records'
+        indexes = (
+            (('player', 'record'), True),
+        )
+
+
+
+
+class DB_ServerSource(BaseModel):
+    """
+        - `server` - Listed server
+        - `source` - Server list (webpage) that listed the server
+        - `first_seen` - When was the server first scrapped from this source
+        - `last_seen` - When was the server last scrapped from this source
+
+        Servers listed by more sources are pinged only once per sweep, but every source is recorded here.
+    """
+
+    server = ForeignKeyField(DB_Server, backref='sources', index=False)
+    source = CharField()
+    first_seen = DateTimeField(default=datetime.now)
+    last_seen = DateTimeField(default=datetime.now)
+
+
+    class Meta:
+        db_table = 'server_sources'
+        indexes = (
+            (('server', 'source'), True),
+            (('source', 'server'), False),
+        )
+
+
+
+
+class DB_ServerSchedule(BaseModel):
+    """
+        Re-ping schedule of a server, updated after every ping (see `scheduling.next_schedule`).
+        Servers without a schedule were never pinged and are always due.
+
+        - `server` - Scheduled server
+        - `next_due` - When should the server be pinged again
+        - `score` - Priority of the server (higher is more interesting)
+        - `uptime` - Moving average of ping successes (0-1)
+        - `volatility` - Moving average of relative player count changes (0-1)
+        - `consecutive_failures` - Failed pings since the last successful one
+        - `last_players` - Online player count from the last successful ping
+        - `last_ping` - When was the server last pinged
+    """
+
+    server = ForeignKeyField(DB_Server, backref='schedule', unique=True)
+    next_due = DateTimeField(index=True)
+    score = FloatField(default=0)
+    uptime = FloatField(default=1)
+    volatility = FloatField(default=0)
+    consecutive_failures = IntegerField(default=0)
+    last_players = IntegerField(null=True)
+    last_ping = DateTimeField(default=datetime.now)
+
+
+    class Meta:
+        db_table = 'server_schedules'
+
+
+# Due servers are pinged by priority (see `queries.yield_due_servers`):
+DB_ServerSchedule.add_index(DB_ServerSchedule.index(
+    DB_ServerSchedule.score.desc(), DB_ServerSchedule.next_due, DB_ServerSchedule.server, name='server_schedules_priority'
+))
+
+
+
+class DB_PlayerPresence(BaseModel):
+    """
+        Where and when was a player seen - one row per player and server, updated by every save (so lookups don't count records).
+
+        - `player` - Seen player
+        - `server` - Server the player was online at
+        - `first_seen` - When was the player first seen at the server
+        - `last_seen` - When was the player last seen at the server
+        - `sightings` - Number of records of the server with the player online
+    """
+
+    player = ForeignKeyField(DB_Player, backref='presence', index=False)
+    server = ForeignKeyField(DB_Server, backref='player_presence', index=False)
+    first_seen = DateTimeField(default=datetime.now)
+    last_seen = DateTimeField(default=datetime.now)
+    sightings = IntegerField(default=0)
+
+
+    @staticmethod
+    def of_players(players: t.Iterable[t.Union[int, DB_Player]]) -> t.Dict[int, t.List['DB_PlayerPresence']]:
+        """
+            Where have the players been - presence rows by player ID, in one query per `_IN_CHUNK_SIZE` players.
+        """
+
+        presence: t.Dict[int, t.List[DB_PlayerPresence]] = {}
+
+        for chunk in _id_chunks(players):
+            for row in DB_PlayerPresence.select().where(DB_PlayerPresence.player.in_(chunk)).order_by(DB_PlayerPresence.last_seen.desc()):
+                presence.setdefault(row.player_id, []).append(row)
+
+        return presence
+
+
+    @staticmethod
+    def at_servers(
+        servers: t.Iterable[t.Union[int, DB_Server]],
+        since: t.Optional[datetime]=None
+    ) -> t.Dict[int, t.List['DB_PlayerPresence']]:
+        """
+            Who has been online at the servers (last seen `since`, if given) - presence rows by server ID, in one query per
+            `_IN_CHUNK_SIZE` servers.
+        """
+
+        presence: t.Dict[int, t.List[DB_PlayerPresence]] = {}
+
+        for chunk in _id_chunks(servers):
+            conditions = [DB_PlayerPresence.server.in_(chunk)]
+            if since is not None:
+                conditions.append(DB_PlayerPresence.last_seen >= since)
+
+            for row in DB_PlayerPresence.select().where(*conditions).order_by(DB_PlayerPresence.last_seen.desc()):
+                presence.setdefault(row.server_id, []).append(row)
+
+        return presence
+
+
+    class Meta:
+        db_table = 'player_presence'
+        indexes = (
+            (('player', 'server'), True),
+            (('server', 'last_seen'), False),
+        )
+
+
+
+
+class DB_SweepJournal(BaseModel):
+    """
+        Checkpoints of long runs (see `journal`) - saved in the same transaction as the results they cover, so an interrupted
+        run can be resumed without pinging anything twice.
+
+        - `sweep` - Name of the run (`ping`, `scrap_and_ping`)
+        - `stream` - What the position is about - a server list (its source) or `servers` (the servers table)
+        - `position` - Everything up to this position is saved - the last page of a server list or the last server ID
+        - `done` - Ranges after `position` that are saved too, such as `41-60,81-100` (pages or server IDs finished
+        while an earlier one was still being pinged)
+    """
+
+    sweep = CharField()
+    stream = CharField()
+    position = IntegerField()
+    done = TextField(default='')
+    updated_at = DateTimeField(default=datetime.now)
+
+
+    class Meta:
+        db_table = 'sweep_journal'
+        indexes = (
+            (('sweep', 'stream'), True),
+        )
+
+
+
+class DB_DatabaseSetting(BaseModel):
+    """
+        Settings that belong to a database rather than to a run, such as how its records are stored (see `storage`).
+    """
+
+    name = CharField(unique=True)
+    value = TextField()
+
+
+    class Meta:
+        db_table = 'database_settings'
+
+
+
+_IN_CHUNK_SIZE = 500
+"""Max. IDs in the `IN (...)` list of one bulk query (SQLite limits the number of bound variables)."""
+
+
+
+def _id_chunks(items: t.Iterable[t.Union[int, Model]]) -> t.Iterator[t.List[int]]:
+    ids = list(dict.fromkeys(item if isinstance(item, int) else item.id for item in items))
 
+    return (ids[start:start + _IN_CHUNK_SIZE] for start in range(0, len(ids), _IN_CHUNK_SIZE))
 
 
 
-ALL_MODELS: t.List[t.Type[Model]] = [DB_Server, DB_ServerRecord, DB_Player, DB_PlayerRecordsRelationship]
 
+ALL_MODELS: t.List[t.Type[Model]] = [
+    DB_Server, DB_Description, DB_Version, DB_ServerState, DB_ServerRecord, DB_Player, DB_PlayerRecordsRelationship, DB_ServerSource, DB_ServerSchedule,
+    DB_PlayerPresence, DB_SweepJournal, DB_DatabaseSetting
+]
 
-def initialize_database(database_name: Path=Path(f"database.db"), directory_path: Path=DATABASE_PATH, *args, **kwargs) -> SqliteDatabase:
-    database = SqliteDatabase(Path(directory_path, database_name), *args, **kwargs)
+
+SCHEMA_VERSION = 8
+"""Version of the database schema, stored in SQLite's `user_version` pragma."""
+
+
+
+def _merge_duplicates(database: Database, table: str, columns: t.Tuple[str, ...], references: t.List[t.Tuple[str, str]]) -> None:
+    """
+        Merges rows of `table` with the same `columns` into the oldest one and points all `references` (`(table, column)` pairs) to it.
+    """
+
+    key = ", ".join(columns)
+    database.execute_sql(f"CREATE TEMPORARY TABLE _duplicates AS SELECT id, MIN(id) OVER (PARTITION BY {key}) AS keep_id FROM {table}")
+    database.execute_sql("DELETE FROM _duplicates WHERE id = keep_id")
+    database.execute_sql("CREATE INDEX _duplicates_id ON _duplicates (id)")
+
+    for reference_table, reference_column in references:
+        database.execute_sql(f"""
+            UPDATE {reference_table} SET {reference_column} = (SELECT keep_id FROM _duplicates WHERE id = {reference_table}.{reference_column})
+            WHERE {reference_column} IN (SELECT id FROM _duplicates)
+        """)
+
+    database.execute_sql(f"DELETE FROM {table} WHERE id IN (SELECT id FROM _duplicates)")
+    database.execute_sql("DROP TABLE _duplicates")
+
+
+
+def _migrate_to_1(database: Database) -> None:
+    """
+        Append-only records: drops the unique index on `server_records.server_id`, merges duplicate servers and players
+        (`replace()` used to insert a new row every time) and removes duplicate and orphaned player-record relationships,
+        so the new unique indexes can be created.
+    """
+
+    for table, columns in (('server_records', ['server_id']), ('rs_player_server_records', ['player_id'])):
+        for index in database.get_indexes(table):
+            if index.columns == columns:
+                database.execute_sql(f'DROP INDEX "{index.name}"')
+
+    _merge_duplicates(database, 'servers', ('host', 'port'), [('server_records', 'server_id')])
+    _merge_duplicates(database, 'players', ('uuid', 'username'), [('rs_player_server_records', 'player_id')])
+
+    database.execute_sql("""
+        DELETE FROM rs_player_server_records WHERE id NOT IN (SELECT MIN(id) FROM rs_player_server_records GROUP BY player_id, record_id)
+    """)
+    # `replace()` of a record left the relationships of the replaced one behind:
+    database.execute_sql("DELETE FROM rs_player_server_records WHERE record_id NOT IN (SELECT id FROM server_records)")
+
+
+
+def _migrate_to_2(database: Database) -> None:
+    """
+        Server sources: fills the new `server_sources` table from sources of existing records.
+    """
+
+    database.create_tables([DB_ServerSource])
+    database.execute_sql("""
+        INSERT OR IGNORE INTO server_sources (server_id, source, first_seen, last_seen)
+        SELECT server_id, source, MIN(timestamp), MAX(timestamp) FROM server_records
+        WHERE server_id IS NOT NULL AND source IS NOT NULL GROUP BY server_id, source
+    """)
+
+
+
+def _migrate_to_3(database: Database) -> None:
+    """
+        Re-ping schedules: creates the (empty) `server_schedules` table - servers without a schedule are due right away.
+    """
+
+    database.create_tables([DB_ServerSchedule])
+
+
+
+def _migrate_to_4(database: Database) -> None:
+    """
+        Player presence: fills the new `player_presence` table from existing player-record relationships.
+    """
+
+    database.create_tables([DB_PlayerPresence])
+    database.execute_sql("""
+        INSERT OR IGNORE INTO player_presence (player_id, server_id, first_seen, last_seen, sightings)
+        SELECT rs.player_id, r.server_id, MIN(r.timestamp), MAX(r.timestamp), COUNT(*)
+        FROM rs_player_server_records AS rs JOIN server_records AS r ON r.id = rs.record_id
+        WHERE r.server_id IS NOT NULL GROUP BY rs.player_id, r.server_id
+    """)
+
+
+
+def _migrate_to_5(database: Database) -> None:
+    """
+        Resumable sweeps: creates the (empty) `sweep_journal` table.
+    """
+
+    database.create_tables([DB_SweepJournal])
+
+
+
+def _migrate_to_6(database: Database) -> None:
+    """
+        Compact records: creates the (empty) `descriptions`, `versions` and `server_states` tables and adds `server_records.state_id`.
+        Existing records stay full ones until they're compacted (see `storage.compact_records`).
+    """
+
+    database.create_tables([DB_Description, DB_Version, DB_ServerState])
+
+    if 'state_id' not in {column.name for column in database.get_columns('server_records')}:
+        database.execute_sql('ALTER TABLE server_records ADD COLUMN state_id INTEGER REFERENCES server_states (id)')
+
+
+
+def _migrate_to_7(database: Database) -> None:
+    """
+        Prioritized re-pings: indexes schedules by score, so due servers can be pinged by priority.
+    """
+
+    DB_ServerSchedule._schema.create_indexes(safe=True)
+
+
+
+def _migrate_to_8(database: Database) -> None:
+    """
+        Database settings: creates the `database_settings` table. Databases with compact records keep saving compact ones.
+    """
+
+    database.create_tables([DB_DatabaseSetting])
+    database.execute_sql("""
+        INSERT OR IGNORE INTO database_settings (name, value)
+        SELECT 'record_storage', 'compact' WHERE EXISTS (SELECT 1 FROM server_records WHERE state_id IS NOT NULL)
+    """)
+
+
+
+MIGRATIONS: t.Dict[int, t.Callable[[Database], None]] = {
+    1: _migrate_to_1,
+    2: _migrate_to_2,
+    3: _migrate_to_3,
+    4: _migrate_to_4,
+    5: _migrate_to_5,
+    6: _migrate_to_6,
+    7: _migrate_to_7,
+    8: _migrate_to_8
+}
+"""Migrations of existing databases, by the schema version they migrate to."""
+
+
+
+def migrate_database(database: Database) -> None:
+    """
+        Brings an existing database up to `SCHEMA_VERSION`, one migration (and one transaction) at a time.
+    """
+
+    version = database.pragma('user_version')
+
+    for target_version in range(version + 1, SCHEMA_VERSION + 1):
+        with database.atomic():
+            MIGRATIONS[target_version](database)
+            database.pragma('user_version', target_version)
+
+
+
+@dataclass
+class DatabaseProfile:
+    """
+        - `pragmas` - SQLite pragmas set on every connection
+        - `checkpoint` - `wal_checkpoint` mode used by `maintain_database` (`PASSIVE` never blocks readers, `TRUNCATE` also shrinks the WAL file)
+    """
+
+    pragmas: t.Dict[str, t.Any]
+    checkpoint: str = 'PASSIVE'
+
+
+
+DATABASE_PROFILES: t.Dict[str, DatabaseProfile] = {
+    'default': DatabaseProfile(pragmas={}),
+    'bulk-ingest': DatabaseProfile(
+        pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal', # In WAL mode, only the last commits can be lost on a power loss (never corrupted)
+            'cache_size': -256 * 1024, # 256 MiB
+            'mmap_size': 1024 * 1024 * 1024, # 1 GiB
+            'temp_store': 'memory',
+            'wal_autocheckpoint': 10000 # Pages - checkpoint rarely while writing, `maintain_database` truncates the WAL
+        },
+        checkpoint='TRUNCATE'
+    ),
+    'concurrent-read': DatabaseProfile(
+        pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -64 * 1024, # 64 MiB
+            'mmap_size': 256 * 1024 * 1024, # 256 MiB
+            'temp_store': 'memory',
+            'wal_autocheckpoint': 1000
+        },
+        checkpoint='PASSIVE'
+    )
+}
+"""Named SQLite tuning profiles (see `settings.DATABASE_PROFILE`)."""
+
+
+
+def _get_profile(profile: str) -> DatabaseProfile:
+    try:
+        return DATABASE_PROFILES[profile]
+
+    except KeyError:
+        raise ValueError(f"Unknown database profile: {profile!r} (expected one of: {', '.join(DATABASE_PROFILES)})") from None
+
+
+
+def configure_database(database: SqliteDatabase, profile: str=DATABASE_PROFILE) -> SqliteDatabase:
+    """
+        Switches an existing database to another tuning profile (its connection is reopened with the profile's pragmas).
+    """
+
+    database.profile = _get_profile(profile)
+    database.init(database.database, pragmas=database.profile.pragmas)
+
+    return database
+
+
+
+def maintain_database(database: SqliteDatabase) -> None:
+    """
+        Periodic maintenance for long runs - checkpoints the WAL (with the mode of the database's profile), so the `-wal` file
+        doesn't grow without limit, and lets SQLite refresh its query planner statistics with `PRAGMA optimize`.
+    """
+
+    profile = getattr(database, 'profile', DATABASE_PROFILES['default'])
+
+    if database.pragma('journal_mode') == 'wal':
+        database.execute_sql(f"PRAGMA wal_checkpoint({profile.checkpoint})")
+
+    database.execute_sql("PRAGMA optimize")
+
+
+
+def prepare_database(database: Database) -> None:
+    """
+        Creates the schema of a new database or migrates an existing one. A database that is already at `SCHEMA_VERSION`
+        is left alone (one `PRAGMA user_version` read), so short runs don't pay for `CREATE TABLE IF NOT EXISTS` of every model.
+    """
+
+    if database.pragma('user_version') == SCHEMA_VERSION:
+        return
+
+    # `create_tables` creates the tables in the database the models are bound to:
+    with database.bind_ctx(ALL_MODELS, bind_refs=False, bind_backrefs=False):
+        if database.table_exists(DB_Server._meta.table_name):
+            migrate_database(database)
+
+        with database.atomic():
+            database.create_tables(ALL_MODELS)
+            database.pragma('user_version', SCHEMA_VERSION)
+
+
+
+class LazyDatabase(SqliteDatabase):
+    """
+        SQLite database that isn't touched until it's used - the file is opened on the first query and `prepare_database`
+        runs on the first connection (once per process, not once per thread), so importing `mst` has no side effects.
+
+        - `profile` - Name of the tuning profile (see `DATABASE_PROFILES`)
+    """
+
+    def __init__(self, database: t.Union[str, Path], *args, profile: str=DATABASE_PROFILE, **kwargs) -> None:
+        self.profile = _get_profile(profile)
+        self._prepared = False
+        self._prepare_lock = threading.Lock()
+
+        super().__init__(database, *args, pragmas=self.profile.pragmas, **kwargs)
+
+
+    def connect(self, reuse_if_open: bool=False) -> bool:
+        opened = super().connect(reuse_if_open)
+
+        if not self._prepared:
+            with self._prepare_lock:
+                if not self._prepared:
+                    prepare_database(self)
+                    self._prepared = True
+
+        return opened
+
+
+
+def initialize_database(database_name: Path=Path(f"database.db"), directory_path: Path=DATABASE_PATH, *args, profile: str=DATABASE_PROFILE, **kwargs) -> SqliteDatabase:
+    """
+        Opens a database (binding all models to it) and prepares its schema right away.
+    """
+
+    database = LazyDatabase(Path(directory_path, database_name), *args, profile=profile, **kwargs)
     database.bind(ALL_MODELS)
-    database.create_tables(ALL_MODELS)
+    database.connect(reuse_if_open=True)
 
     return database
 
 
-DATABASE = initialize_database()
+
+DATABASE = LazyDatabase(Path(DATABASE_PATH, 'database.db'))
+"""Default database - opened (and prepared) when it's first used."""
+DATABASE.bind(ALL_MODELS)
@@ -9,6 +9,9 @@
 import typing as t
 
 import asyncio
+import json
+import random
+import time
 
 from mst.orm import DATABASE
 try:
@@ -17,14 +20,29 @@ except ImportError:
     uvloop = None
 
 from dataclasses import dataclass
-from mcstatus import MinecraftServer
 from peewee import Database
 
-from mst.settings import PLAYER_USERNAME_REGEX
-from mst.scrappers import Server, scrap_from_all_scrappers
+from mst.journal import SERVERS_STREAM
+from mst.metrics import PINGS_STARTED, PINGS_FINISHED, PING_DURATION
+from mst.orm import Server
+from mst.profiling import span
+from mst.queries import yield_due_servers, yield_servers_from_database
+from mst.settings import PLAYER_USERNAME_REGEX, PING_CLIENT, PING_CONCURRENCY, PING_CONNECT_TIMEOUT, PING_TIMEOUT, PING_RATE_LIMIT
+from mst.utils import RateLimiter, aiterate, flatten, intern, slotted
 
+# mcstatus, dnspython (`resolver`) and the scrappers are imported where they're used, so the native client starts fast:
+if t.TYPE_CHECKING:
+    from mcstatus.pinger import PingResponse
+    from mst.journal import Progress
+    from mst.resolver import Address, Resolver
 
 
+PingMode = t.Literal['batch', 'window']
+PingClient = t.Literal['native', 'mcstatus']
+
+
+
+@slotted
 @dataclass
 class PingedPlayer:
     uuid: str
@@ -32,6 +50,7 @@ class PingedPlayer:
 
 
 
+@slotted
 @dataclass
 class PingedPlayerList:
     max: int
@@ -40,6 +59,7 @@ class PingedPlayerList:
 
 
 
+@slotted
 @dataclass
 class PingedServerStatus:
     description: str
@@ -50,6 +70,7 @@ class PingedServerStatus:
 
 
 
+@slotted
 @dataclass
 class PingedServer:
     source: str
@@ -60,28 +81,367 @@ class PingedServer:
 
 
 
-async def get_status(scrapped_server: Server):
+async def _async_status(host: str, port: int, address: t.Optional['Address']=None, timeout: t.Optional[float]=None) -> 'PingResponse':
+    from mcstatus import MinecraftServer
+    from mcstatus.address import Address as MinecraftAddress
+    from mcstatus.pinger import AsyncServerPinger
+    from mcstatus.protocol.connection import TCPAsyncSocketConnection
+
+    if address is None:
+        return await MinecraftServer(host=host, port=port, timeout=timeout or 3).async_status()
+
+    # Connect to the resolved address, but send the original hostname in the handshake (servers behind proxies route by it):
+    connection = TCPAsyncSocketConnection()
+
+    try:
+        await connection.connect(MinecraftAddress(*address), timeout or 3)
+
+        server_pinger = AsyncServerPinger(connection, address=MinecraftAddress(host, port))
+        server_pinger.handshake()
+        status = await server_pinger.read_status()
+        status.latency = await server_pinger.test_ping()
+
+        return status
+
+    finally:
+        connection.close()
+
+
+
+# Native Server List Ping client (https://wiki.vg/Server_List_Ping) - packets are `<length> <packet ID> <data>` (lengths are VarInts):
+
+class ProtocolError(IOError):
+    """
+        The server sent something that isn't a valid (modern or legacy) status response.
+    """
+
+
+
+def _varint(number: int) -> bytes:
+    number &= 0xFFFFFFFF
+    encoded = bytearray()
+
+    while True:
+        byte = number & 0x7F
+        number >>= 7
+        encoded.append(byte | (0x80 if number else 0))
+
+        if not number:
+            return bytes(encoded)
+
+
+def _decode_varint(data: bytes, offset: int=0) -> t.Tuple[int, int]:
+    """
+        Decodes a VarInt from `data` at `offset` and returns it with the offset after it.
+    """
+
+    number = 0
+
+    for shift in range(0, 35, 7):
+        if offset >= len(data):
+            raise ProtocolError("Truncated VarInt")
+
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+
+        if not byte & 0x80:
+            return number, offset
+
+    raise ProtocolError("VarInt is too big")
+
+
+async def _read_varint(reader: asyncio.StreamReader) -> int:
+    number = 0
+
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        number |= (byte & 0x7F) << shift
+
+        if not byte & 0x80:
+            return number
+
+    raise ProtocolError("VarInt is too big")
+
+
+_HANDSHAKE_HEADER = b'\x00' + _varint(47) # Handshake packet ID, protocol version (1.8, the status format didn't change since)
+_STATUS_REQUEST = b'\x01\x00'
+_PING_HEADER = b'\x09\x01' # Length and packet ID of a ping with an 8 bytes long token
+_LEGACY_PING = b'\xfe\x01'
+_MAX_RESPONSE_SIZE = 1 << 21
+"""Status responses are at most 32 767 characters of JSON (including a favicon), anything much bigger is garbage."""
+
+
+
+def _status_request(host: str, port: int) -> bytes:
+    """
+        Handshake (with the next state set to status) and status request packets, sent with one write.
+    """
+
+    encoded_host = host.encode()
+    body = bytearray(_HANDSHAKE_HEADER)
+    body += _varint(len(encoded_host))
+    body += encoded_host
+    body += port.to_bytes(2, 'big')
+    body += b'\x01'
+
+    return _varint(len(body)) + body + _STATUS_REQUEST
+
+
+
+_STYLE_CODES: t.Dict[str, t.Union[str, t.Dict[str, str]]] = {
+    'color': {
+        'dark_red': '4', 'red': 'c', 'gold': '6', 'yellow': 'e', 'dark_green': '2', 'green': 'a', 'aqua': 'b', 'dark_aqua': '3',
+        'dark_blue': '1', 'blue': '9', 'light_purple': 'd', 'dark_purple': '5', 'white': 'f', 'gray': '7', 'dark_gray': '8', 'black': '0'
+    },
+    'bold': 'l',
+    'strikethrough': 'm',
+    'italic': 'o',
+    'underlined': 'n',
+    'obfuscated': 'k',
+    'reset': 'r'
+}
+"""Formatting codes (`§<code>`) of chat component styles, the same as mcstatus' `STYLE_MAP`."""
+
+
+
+def _flatten_description(description: t.Union[str, t.Dict[str, t.Any], t.List[t.Dict[str, t.Any]]]) -> str:
+    """
+        Flattens a chat component into a string with formatting codes, the same way as mcstatus' `PingResponse._parse_description`
+        (other colors, such as hex ones, are dropped).
+    """
+
+    if isinstance(description, str):
+        return description
+
+    if isinstance(description, dict):
+        entries, end = description.get('extra', []), description['text']
+    else:
+        entries, end = description, ''
+
+    flattened = ''
+
+    for entry in entries:
+        for style, code in _STYLE_CODES.items():
+            value = entry.get(style)
+
+            if value:
+                if isinstance(code, dict):
+                    code = code.get(value)
+                if code is not None:
+                    flattened += f'§{code}'
+
+        flattened += entry.get('text', '')
+
+    return flattened + end
+
+
+
+def _parse_status(raw: t.Dict[str, t.Any], latency: float) -> PingedServerStatus:
+    """
+        Builds our status right from the decoded JSON (the description is flattened the same way as by mcstatus).
+    """
+
+    players = raw['players']
+
+    return PingedServerStatus(
+        description=_flatten_description(raw['description']),
+        version=intern(raw['version']['name']),
+        latency=latency,
+        players=PingedPlayerList(
+            max=players['max'],
+            online=players['online'],
+            list=[
+                PingedPlayer(uuid=player['id'], username=player['name']) for player in players.get('sample') or ()
+                if isinstance(player, dict) and isinstance(player.get('name'), str) and 'id' in player and PLAYER_USERNAME_REGEX.match(player['name'])
+            ]
+        ),
+        is_modded='modinfo' in raw
+    )
+
+
+
+async def _modern_status(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int) -> PingedServerStatus:
+    writer.write(_status_request(host, port))
+
+    length = await _read_varint(reader)
+    if length > _MAX_RESPONSE_SIZE:
+        raise ProtocolError(f"Status response is too big ({length} bytes)")
+
+    response = await reader.readexactly(length)
+    packet_id, offset = _decode_varint(response)
+    if packet_id != 0:
+        raise ProtocolError(f"Unexpected packet {packet_id} instead of a status response")
+
+    size, offset = _decode_varint(response, offset)
+
     try:
-        status = await MinecraftServer(host=scrapped_server.host, port=scrapped_server.port).async_status()
-
-        pinged_server_status = PingedServerStatus(
-            description=status.description,
-            version=status.version.name,
-            latency=status.latency,
-            players=PingedPlayerList(
-                max=status.players.max,
-                online=status.players.online,
-                list=[PingedPlayer(uuid=player.id, username=player.name) for player in status.players.sample if PLAYER_USERNAME_REGEX.match(player.name)] if status.players.sample else []
-            ),
-            is_modded='modinfo' in status.raw
+        with span('decode'):
+            raw = json.loads(response[offset:offset + size])
+
+    except ValueError:
+        raise ProtocolError("Status response isn't valid JSON") from None
+
+    token = random.getrandbits(63).to_bytes(8, 'big')
+    sent = time.perf_counter()
+    writer.write(_PING_HEADER + token)
+
+    pong = await reader.readexactly(await _read_varint(reader))
+    latency = (time.perf_counter() - sent) * 1000
+    if pong[:1] != b'\x01' or pong[1:] != token:
+        raise ProtocolError("Invalid pong")
+
+    try:
+        with span('decode'):
+            return _parse_status(raw, latency)
+
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ProtocolError(f"Invalid status response: {error!r}") from None
+
+
+
+async def _legacy_status(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> PingedServerStatus:
+    """
+        Legacy (1.4 - 1.6, and older) Server List Ping - `0xFE 0x01`, answered with a kick packet (`0xFF`) with a UTF-16 string.
+    """
+
+    sent = time.perf_counter()
+    writer.write(_LEGACY_PING)
+
+    header = await reader.readexactly(3)
+    latency = (time.perf_counter() - sent) * 1000
+    if header[0] != 0xFF:
+        raise ProtocolError("Invalid legacy status response")
+
+    text = (await reader.readexactly(int.from_bytes(header[1:], 'big') * 2)).decode('utf-16-be', errors='replace')
+
+    try:
+        if text.startswith('\u00a71\x00'):
+            # §1, protocol version, version, MOTD, online players, max players (1.4+):
+            _, _, version, description, online, max_players = text.split('\x00')
+        else:
+            # MOTD§online players§max players (older):
+            description, online, max_players = text.rsplit('\u00a7', 2)
+            version = None
+
+        return PingedServerStatus(
+            description=description,
+            version=intern(version),
+            latency=latency,
+            players=PingedPlayerList(max=int(max_players), online=int(online), list=[]),
+            is_modded=False
         )
 
+    except ValueError:
+        raise ProtocolError("Invalid legacy status response") from None
+
+
+
+async def native_status(
+    host: str,
+    port: int,
+    address: t.Optional['Address']=None,
+    timeout: float=PING_TIMEOUT,
+    connect_timeout: t.Optional[float]=PING_CONNECT_TIMEOUT,
+    legacy_fallback: bool=True
+) -> PingedServerStatus:
+    """
+        Server List Ping over a plain asyncio connection (IPv4 or IPv6) - writes the handshake and status request at once,
+        decodes the JSON response once, straight into `PingedServerStatus`, and measures the latency with a ping packet.
+
+        Servers that don't speak the modern protocol (close the connection or answer with garbage) are pinged again with
+        the legacy ping (`legacy_fallback`).
+
+        - `address` - Already resolved `(IP address, port)` to connect to, the original `host` and `port` go to the handshake
+        - `timeout` - Deadline for the whole status request (including the legacy fallback), raises `asyncio.TimeoutError`
+        - `connect_timeout` - Deadline for every connection (capped by `timeout`)
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    connect_host, connect_port = address or (host, port)
+
+
+    async def exchange(status: t.Callable[[asyncio.StreamReader, asyncio.StreamWriter], t.Awaitable[PingedServerStatus]]) -> PingedServerStatus:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+
+        with span('connect'):
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(connect_host, connect_port), min(connect_timeout or remaining, remaining))
+
+        try:
+            with span('status'):
+                return await asyncio.wait_for(status(reader, writer), max(deadline - loop.time(), 0))
+
+        finally:
+            writer.close()
+
+
+    try:
+        return await exchange(lambda reader, writer: _modern_status(reader, writer, host, port))
+
+    except (ProtocolError, asyncio.IncompleteReadError, ConnectionResetError):
+        if not legacy_fallback:
+            raise
+
+    return await exchange(_legacy_status)
+
+
+
+def _convert_status(status: 'PingResponse') -> PingedServerStatus:
+    return PingedServerStatus(
+        description=status.description,
+        version=intern(status.version.name),
+        latency=status.latency,
+        players=PingedPlayerList(
+            max=status.players.max,
+            online=status.players.online,
+            list=[PingedPlayer(uuid=player.id, username=player.name) for player in status.players.sample if PLAYER_USERNAME_REGEX.match(player.name)] if status.players.sample else []
+        ),
+        is_modded='modinfo' in status.raw
+    )
+
+
+
+async def get_status(scrapped_server: Server, timeout: t.Optional[float]=None, address: t.Optional['Address']=None, client: PingClient=PING_CLIENT):
+    """
+        Pings a server and returns its status as a `PingedServer`.
+
+        - `timeout` - Deadline (in seconds) for the whole status request
+        - `address` - Already resolved `(IP address, port)` to connect to (see `resolver.Resolver`), so no name resolution happens here
+        - `client` - `native` (`native_status`) or `mcstatus`
+    """
+
+    PINGS_STARTED.inc()
+    started = time.perf_counter()
+    result = 'online'
+
+    try:
+        with span('ping'):
+            if client == 'native':
+                pinged_server_status = await native_status(scrapped_server.host, scrapped_server.port, address=address, timeout=timeout or 3)
+
+            else:
+                with span('mcstatus'):
+                    response = await asyncio.wait_for(_async_status(scrapped_server.host, scrapped_server.port, address=address, timeout=timeout), timeout=timeout)
+
+                with span('decode'):
+                    pinged_server_status = _convert_status(response)
+
+    except asyncio.TimeoutError:
+        pinged_server_status = None
+        result = 'timeout'
+
     except Exception:
         pinged_server_status = None
+        result = 'error'
 
+    PINGS_FINISHED.inc(result=result)
+    PING_DURATION.observe(time.perf_counter() - started)
 
     return PingedServer(
-        source=scrapped_server.source,
+        source=intern(getattr(scrapped_server, 'source', None)),
         host=scrapped_server.host,
         port=scrapped_server.port,
         online=pinged_server_status is not None,
@@ -90,27 +450,236 @@ async def get_status(scrapped_server: Server):
 
 
 
-# Circular:
-import mst.data as data
+async def ping_window(
+    servers: t.Union[t.Iterable[Server], t.AsyncIterable[Server]],
+    concurrency: int=PING_CONCURRENCY,
+    timeout: t.Optional[float]=PING_TIMEOUT,
+    rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+    resolver: t.Optional['Resolver']=None,
+    client: PingClient=PING_CLIENT
+) -> t.AsyncGenerator[t.List[PingedServer], None]:
+    """
+        Pings servers through a sliding window - up to `concurrency` pings are kept in flight at all times and a new one starts
+        as soon as any of them finishes, so a slow or timing-out host never holds back the rest (unlike the `at_once` batching).
+
+        Yields lists of pinged servers that finished since the last yield (usually just one).
+
+        - `servers` - Normal or asynchronous iterable of servers to ping
+        - `concurrency` - Max. number of pings in flight
+        - `timeout` - Per-host deadline (in seconds)
+        - `rate_limit` - Max. number of pings started per second (`None` for no limit)
+        - `resolver` - Resolve server addresses with this (cached) resolver before they take a ping slot. Servers that don't
+        resolve are reported offline right away, without being pinged.
+        - `client` - Server List Ping client (see `get_status`)
+    """
+
+    limiter = RateLimiter(rate_limit)
+    slots = asyncio.Semaphore(concurrency)
+    resolving = asyncio.Semaphore(resolver.concurrency if resolver else 1)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    pings: t.Set[asyncio.Task] = set()
+    done = object()
+
+
+    async def ping(server: Server, address: t.Optional['Address']=None) -> None:
+        try:
+            await limiter.wait()
+            await results.put(await get_status(server, timeout=timeout, address=address, client=client))
+        finally:
+            slots.release()
+
+
+    async def resolve_and_ping(server: Server) -> None:
+        # Resolving servers (and the ones waiting for a ping slot) are limited separately, so dead domains don't take ping slots:
+        try:
+            try:
+                address = await resolver.resolve(server.host, server.port)
+
+            # Malformed hosts (`UnicodeError`, `ValueError`, ...) can't be pinged either, they're offline like dead domains:
+            except Exception:
+                address = None
+
+            if address is not None:
+                await slots.acquire()
+        finally:
+            resolving.release()
+
+        if address is None:
+            await results.put(PingedServer(source=getattr(server, 'source', None), host=server.host, port=server.port))
+        else:
+            await ping(server, address)
+
+
+    async def feed() -> None:
+        try:
+            async for server in aiterate(servers):
+                if not server or not server.host:
+                    continue
+
+                if resolver:
+                    await resolving.acquire()
+                    task = asyncio.ensure_future(resolve_and_ping(server))
+                else:
+                    await slots.acquire()
+                    task = asyncio.ensure_future(ping(server))
+
+                pings.add(task)
+                task.add_done_callback(pings.discard)
+
+            if pings:
+                await asyncio.wait(set(pings))
+
+        except Exception as exception:
+            await results.put(exception)
 
-async def ping_all(from_database: Database=DATABASE, at_once: int=25):
-    for scrapped_servers in data.yield_servers_from_database(database=from_database, at_once=at_once):
+        finally:
+            await results.put(done)
+
+
+    feeder = asyncio.ensure_future(feed())
+
+    try:
+        while True:
+            finished = [await results.get()]
+            while not results.empty():
+                finished.append(results.get_nowait())
+
+            statuses = [status for status in finished if isinstance(status, PingedServer)]
+            if statuses:
+                yield statuses
+
+            for status in finished:
+                if isinstance(status, Exception):
+                    raise status
+
+            if done in finished:
+                break
+
+    finally:
+        feeder.cancel()
+        for task in list(pings):
+            task.cancel()
+
+
+
+async def ping_all(
+    from_database: Database=DATABASE,
+    at_once: int=25,
+    mode: PingMode='batch',
+    concurrency: int=PING_CONCURRENCY,
+    timeout: t.Optional[float]=PING_TIMEOUT,
+    rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+    resolver: t.Optional['Resolver']=None,
+    client: PingClient=PING_CLIENT,
+    scheduled: bool=False,
+    budget: t.Optional[int]=None,
+    progress: t.Optional['Progress']=None,
+    **filters
+):
+    """
+        Pings all servers from the database.
+
+        - `mode` - `batch` pings `at_once` servers and waits for all of them before moving on to the next batch,
+        `window` pings them through `ping_window` (`concurrency`, `timeout`, `rate_limit` and `resolver` are passed to it)
+        - `client` - Server List Ping client (see `get_status`)
+        - `scheduled` - Only ping servers that are due (`queries.yield_due_servers`), at most `budget` of them
+        - `progress` - Follows which servers are pinged (by ID, see `journal.Progress`), continues after its finished position
+        and skips servers finished after it.
+        Scheduled pings don't need it - pinged servers aren't due anymore, so an interrupted scheduled run resumes by itself.
+        - `filters` - Passed to `queries.yield_servers_from_database` (`stale_after`, `online_only`, `source`)
+    """
+
+    _check_mode(mode)
+
+    used_filters = [name for name, value in filters.items() if value not in (None, False)]
+    if scheduled and used_filters:
+        raise ValueError(f"Filters can't be combined with scheduled pings: {', '.join(used_filters)}")
+
+    if scheduled:
+        pages = yield_due_servers(database=from_database, at_once=at_once, limit=budget)
+        progress = None
+    elif progress is not None:
+        pages = progress.track_rows(yield_servers_from_database(database=from_database, at_once=at_once, after_id=progress.positions.get(SERVERS_STREAM, 0), **filters))
+    else:
+        pages = yield_servers_from_database(database=from_database, at_once=at_once, **filters)
+
+    if mode == 'window':
+        servers = (server for servers in pages for server in servers)
+
+        async for statuses in ping_window(servers, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolver=resolver, client=client):
+            if progress is not None:
+                progress.finish(statuses)
+            yield statuses
+
+        return
+
+    for scrapped_servers in pages:
         statuses = await asyncio.gather(*[
-            get_status(scrapped_server) for scrapped_server in scrapped_servers if scrapped_server and scrapped_server.host
+            get_status(scrapped_server, client=client) for scrapped_server in scrapped_servers if scrapped_server and scrapped_server.host
         ])
-    
+
+        if progress is not None:
+            progress.finish(statuses)
         yield statuses
 
 
 
-async def scrap_and_ping_all(*args, **kwargs):
-    for scrapped_servers in scrap_from_all_scrappers(*args, **kwargs):
+async def scrap_and_ping_all(
+    *args,
+    mode: PingMode='batch',
+    async_scrap: bool=False,
+    concurrency: int=PING_CONCURRENCY,
+    timeout: t.Optional[float]=PING_TIMEOUT,
+    rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+    resolver: t.Optional['Resolver']=None,
+    client: PingClient=PING_CLIENT,
+    progress: t.Optional['Progress']=None,
+    **kwargs
+):
+    """
+        Scraps servers from all scrappers and pings them (see `ping_all` for `mode` and `client`).
+
+        - `async_scrap` - Scrap all server lists concurrently with `scrappers.async_scrap_from_all_scrappers` (`args` and `kwargs` are passed
+        to it instead of `scrappers.scrap_from_all_scrappers`), so servers from every page are pinged as soon as the page is ready
+        - `progress` - Follows which pages of every server list are pinged (see `journal.Progress`), server lists continue after
+        their finished position and skip pages finished after it
+    """
+
+    from mst.scrappers import scrap_from_all_scrappers, async_scrap_from_all_scrappers
+
+    _check_mode(mode)
+
+    if progress is not None:
+        kwargs['first_pages'] = progress.first_pages()
+        kwargs['skip_pages'] = progress.skipped_pages()
+
+    pages = (async_scrap_from_all_scrappers if async_scrap else scrap_from_all_scrappers)(*args, **kwargs)
+    if progress is not None:
+        pages = progress.track_pages(pages)
+
+    if mode == 'window':
+        async for statuses in ping_window(flatten(pages), concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolver=resolver, client=client):
+            if progress is not None:
+                progress.finish(statuses)
+            yield statuses
+
+        return
+
+    async for scrapped_servers in aiterate(pages):
         statuses = await asyncio.gather(*[
-            get_status(scrapped_server) for scrapped_server in scrapped_servers if scrapped_server and scrapped_server.host
+            get_status(scrapped_server, client=client) for scrapped_server in scrapped_servers if scrapped_server and scrapped_server.host
         ])
-    
+
+        if progress is not None:
+            progress.finish(statuses)
         yield statuses
 
+
+
+def _check_mode(mode: str) -> None:
+    if mode not in t.get_args(PingMode):
+        raise ValueError(f"Unknown ping mode: {mode!r} (expected one of: {', '.join(t.get_args(PingMode))})")
+
             
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+"""
+    Profiling of long runs (`--profile`) - where the time of a slow run goes:
+
+        - a sampling profiler takes the stack of the event loop thread every `PROFILE_SAMPLE_INTERVAL` seconds (from a background
+          thread, so the profiled code runs as usual) and writes the samples as folded stacks (`profile.folded`), which
+          flamegraph.pl, inferno or speedscope turn into a flame graph
+        - `span` (and `spanned`) measure the wall time of stages - DNS lookups, connecting, status requests, decoding statuses,
+          downloading and parsing pages and database writes - written as a per-stage breakdown (`stages.json`)
+        - asyncio's debug mode reports callbacks that block the event loop for longer than `PROFILE_SLOW_CALLBACK_DURATION`
+          (`slow-callbacks.log`)
+
+    Spans cost next to nothing without a running profiler. Spans of concurrent tasks overlap, so the total time of a stage can be
+    longer than the run itself. Stages of `sweep` worker processes (and of pages parsed in a process pool) stay in their processes.
+"""
+
+import typing as t
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from types import CodeType
+
+from mst.settings import PROFILE_SAMPLE_INTERVAL, PROFILE_SLOW_CALLBACK_DURATION
+
+
+_F = t.TypeVar('_F', bound=t.Callable[..., t.Any])
+
+_PROFILER: t.Optional['Profiler'] = None
+"""The running profiler (spans are only measured while there's one)."""
+
+_NO_SPAN = nullcontext()
+
+
+
+class _Span():
+    __slots__ = ('profiler', 'stage', 'started')
+
+
+    def __init__(self, profiler: 'Profiler', stage: str) -> None:
+        self.profiler = profiler
+        self.stage = stage
+
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+
+    def __exit__(self, *_) -> None:
+        self.profiler.record(self.stage, time.perf_counter() - self.started)
+
+
+
+def span(stage: str) -> t.ContextManager[None]:
+    """
+        Measures the wall time of a stage (in sync or async code) while a profiler is running.
+    """
+
+    profiler = _PROFILER
+
+    return _Span(profiler, stage) if profiler is not None else _NO_SPAN
+
+
+def spanned(stage: str) -> t.Callable[[_F], _F]:
+    """
+        Decorator version of `span` (for functions and coroutine functions).
+    """
+
+    def decorator(function: _F) -> _F:
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with span(stage):
+                    return await function(*args, **kwargs)
+
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with span(stage):
+                    return function(*args, **kwargs)
+
+        return t.cast(_F, wrapper)
+
+    return decorator
+
+
+
+def watch_event_loop(loop: t.Optional[asyncio.AbstractEventLoop]=None) -> None:
+    """
+        Lets the running profiler (if any) sample the thread of `loop` (the running one by default) and report its slow callbacks.
+    """
+
+    if _PROFILER is not None:
+        _PROFILER.watch(loop or asyncio.get_running_loop())
+
+
+
+@functools.lru_cache(maxsize=None)
+def _short_path(path: str) -> str:
+    for directory in sorted(sys.path, key=len, reverse=True):
+        if directory and path.startswith(directory + os.sep):
+            return path[len(directory) + 1:]
+
+    return path
+
+
+def _frame_name(code: CodeType) -> str:
+    name = getattr(code, 'co_qualname', code.co_name)
+
+    return f'{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+
+class _SlowCallbacks(logging.Handler):
+    def __init__(self, messages: t.List[str]) -> None:
+        super().__init__(logging.WARNING)
+        self.messages = messages
+
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(record.getMessage())
+
+
+
+class Profiler(threading.Thread):
+    """
+        Samples the stack of the event loop thread (the thread that started the profiler, until `watch` is called) every
+        `interval` seconds and collects spans and slow callbacks until `stop` writes them into the `path` directory.
+
+        - `slow_callback_duration` - Threshold of slow callbacks (`None` to leave asyncio's debug mode off)
+    """
+
+    def __init__(self, path: t.Union[str, Path], interval: float=PROFILE_SAMPLE_INTERVAL, slow_callback_duration: t.Optional[float]=PROFILE_SLOW_CALLBACK_DURATION) -> None:
+        super().__init__(name='mst-profiler', daemon=True)
+
+        self.path = Path(path)
+        self.interval = interval
+        self.slow_callback_duration = slow_callback_duration
+        self.thread_id = threading.get_ident()
+        self.samples: t.Dict[t.Tuple[CodeType, ...], int] = {} # Stack (root first): number of samples
+        self.stages: t.Dict[str, t.List[float]] = {} # Stage: [spans, total time, longest span]
+        self.slow_callbacks: t.List[str] = []
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._started_at = 0.0
+        self._wall_time = 0.0
+        self._slow_callbacks_handler = _SlowCallbacks(self.slow_callbacks)
+
+
+    def start(self) -> None:
+        global _PROFILER
+
+        _PROFILER = self
+        self._started_at = time.perf_counter()
+        super().start()
+
+
+    def watch(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.thread_id = threading.get_ident()
+
+        if self.slow_callback_duration is not None:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.slow_callback_duration
+            logging.getLogger('asyncio').addHandler(self._slow_callbacks_handler)
+
+
+    def record(self, stage: str, duration: float) -> None:
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = [0, 0.0, 0.0]
+
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+
+
+    def run(self) -> None:
+        current_frames = sys._current_frames
+
+        while not self._stopped.wait(self.interval):
+            frame = current_frames().get(self.thread_id)
+            stack = []
+
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+
+            key = tuple(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+
+    def stop(self) -> str:
+        """
+            Stops profiling, writes the profile and returns a summary of it.
+        """
+
+        global _PROFILER
+
+        self._stopped.set()
+        self.join()
+        self._wall_time = time.perf_counter() - self._started_at
+        logging.getLogger('asyncio').removeHandler(self._slow_callbacks_handler)
+
+        if _PROFILER is self:
+            _PROFILER = None
+
+        self.write()
+
+        return self.summary()
+
+
+    def breakdown(self) -> t.Dict[str, t.Any]:
+        with self._lock:
+            stages = {stage: list(stats) for stage, stats in self.stages.items()}
+
+        return {
+            'wall_time': self._wall_time,
+            'samples': sum(self.samples.values()),
+            'slow_callbacks': len(self.slow_callbacks),
+            'stages': {
+                stage: {'spans': spans, 'total': total, 'mean': total / spans, 'max': longest}
+                for stage, (spans, total, longest) in sorted(stages.items(), key=lambda item: -item[1][1])
+            }
+        }
+
+
+    def write(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        with open(Path(self.path, 'profile.folded'), 'w', encoding='utf-8') as file:
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1]):
+                file.write(f"{';'.join(_frame_name(code) for code in stack)} {count}\n")
+
+        Path(self.path, 'stages.json').write_text(json.dumps(self.breakdown(), indent=4), encoding='utf-8')
+        Path(self.path, 'slow-callbacks.log').write_text(''.join(f'{message}\n' for message in self.slow_callbacks), encoding='utf-8')
+
+
+    def summary(self) -> str:
+        breakdown = self.breakdown()
+        lines = [
+            f"Profile of {breakdown['wall_time']:.1f} s ({breakdown['samples']} samples, {breakdown['slow_callbacks']} slow callbacks) written into {self.path}",
+            f"{'stage':<12} {'spans':>10} {'total s':>10} {'mean ms':>10} {'max ms':>10}"
+        ]
+
+        for stage, stats in breakdown['stages'].items():
+            lines.append(f"{stage:<12} {stats['spans']:>10} {stats['total']:>10.2f} {stats['mean'] * 1000:>10.2f} {stats['max'] * 1000:>10.1f}")
+
+        return '\n'.join(lines)
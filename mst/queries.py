@@ -0,0 +1,189 @@
+"""
+    Read-only queries - streaming servers to ping out of the database and summarizing what's in it.
+
+    Only needs the models, so commands that just read (such as `ping` or `stats`) don't import the scrappers or the writer.
+"""
+
+import typing as t
+
+from datetime import datetime, timedelta
+
+from peewee import JOIN, Database, fn
+
+from mst.orm import DATABASE, DB_Player, DB_PlayerPresence, DB_Server, DB_ServerRecord, DB_ServerSchedule, DB_ServerSource
+
+
+
+class ServerRow(t.NamedTuple):
+    """
+        Lightweight, read-only server row yielded by `yield_servers_from_database`.
+
+        - `source` - Source of the latest record of this server (if any)
+    """
+
+    id: int
+    host: str
+    port: int
+    source: t.Optional[str] = None
+
+
+
+def yield_servers_from_database(
+    database: Database=DATABASE,
+    at_once: int=25,
+    stale_after: t.Optional[timedelta]=None,
+    online_only: bool=False,
+    source: t.Optional[str]=None,
+    id_range: t.Optional[t.Tuple[int, int]]=None,
+    after_id: int=0
+) -> t.Generator[t.List[ServerRow], None, None]:
+    """
+        Streams all servers from the database in lists of (up to) `at_once` rows, in the order of their IDs.
+
+        Pages through the `servers` table by primary key (`WHERE id > <last ID> LIMIT <at_once>`), so it uses constant memory,
+        starts right away even on huge tables and doesn't keep a cursor open between pages (which would block `DatabaseWriterThread`).
+
+        - `stale_after` - Only servers without a record newer than this
+        - `online_only` - Only servers that answered a ping at least once (have a record)
+        - `source` - Only servers that were listed by this source
+        - `id_range` - Only servers with IDs from this (inclusive) range, such as a shard from `sweep.shard_ranges`
+        - `after_id` - Only servers with greater IDs, such as to resume an interrupted run (see `journal`)
+    """
+
+    latest_source = (DB_ServerRecord.select(DB_ServerRecord.source).where(DB_ServerRecord.server == DB_Server.id).order_by(DB_ServerRecord.timestamp.desc()).limit(1))
+    records = DB_ServerRecord.select(DB_ServerRecord.id).where(DB_ServerRecord.server == DB_Server.id)
+    sources = DB_ServerSource.select(DB_ServerSource.id).where(DB_ServerSource.server == DB_Server.id)
+
+    conditions = []
+    if stale_after is not None:
+        conditions.append(~fn.EXISTS(records.where(DB_ServerRecord.timestamp > datetime.now() - stale_after)))
+    if online_only:
+        conditions.append(fn.EXISTS(records))
+    if source is not None:
+        conditions.append(fn.EXISTS(sources.where(DB_ServerSource.source == source)))
+
+    last_id = after_id
+    if id_range is not None:
+        last_id = max(last_id, id_range[0] - 1)
+        conditions.append(DB_Server.id <= id_range[1])
+
+    while True:
+        query = (DB_Server
+            .select(DB_Server.id, DB_Server.host, DB_Server.port, latest_source.alias('source'))
+            .where(DB_Server.id > last_id, *conditions)
+            .order_by(DB_Server.id)
+            .limit(at_once)
+            .tuples()
+            .bind(database))
+
+        servers = [ServerRow._make(row) for row in query]
+        if not servers:
+            break
+
+        last_id = servers[-1].id
+        yield servers
+
+
+
+def load_known_servers(source: str, database: Database=DATABASE) -> t.Set[t.Tuple[str, int]]:
+    """
+        Servers (`(host, port)`) that were already scrapped from `source`, for the incremental mode of server lists
+        (see `scrappers.scrap_from_all_scrappers`).
+    """
+
+    return set(DB_Server
+        .select(DB_Server.host, DB_Server.port)
+        .join(DB_ServerSource, on=(DB_ServerSource.server == DB_Server.id))
+        .where(DB_ServerSource.source == source)
+        .tuples()
+        .bind(database))
+
+
+
+def yield_due_servers(database: Database=DATABASE, at_once: int=25, limit: t.Optional[int]=None) -> t.Generator[t.List[ServerRow], None, None]:
+    """
+        Streams servers that are due for a ping (see `scheduling`) in lists of (up to) `at_once` rows - first the servers
+        that were never pinged (in the order of their IDs), then the scheduled ones by their score (highest first, see
+        `scheduling.next_schedule`) and the most overdue first among servers with the same score, so a ping budget goes
+        to the most interesting servers.
+
+        Like `yield_servers_from_database`, it pages with indexed keyset queries (`server_schedules` are indexed by score and `next_due`).
+        Servers pinged during the sweep get a `next_due` in the future, so they are never yielded twice.
+
+        - `limit` - Ping budget, yield at most this many servers
+    """
+
+    now = datetime.now()
+    remaining = limit if limit is not None else float('inf')
+    latest_source = (DB_ServerRecord.select(DB_ServerRecord.source).where(DB_ServerRecord.server == DB_Server.id).order_by(DB_ServerRecord.timestamp.desc()).limit(1))
+    columns = (DB_Server.id, DB_Server.host, DB_Server.port, latest_source.alias('source'))
+
+    schedules = DB_ServerSchedule.select(DB_ServerSchedule.id).where(DB_ServerSchedule.server == DB_Server.id)
+    last_id = 0
+
+    while remaining > 0:
+        query = (DB_Server
+            .select(*columns)
+            .where(DB_Server.id > last_id, ~fn.EXISTS(schedules))
+            .order_by(DB_Server.id)
+            .limit(min(at_once, remaining))
+            .tuples()
+            .bind(database))
+
+        servers = [ServerRow._make(row) for row in query]
+        if not servers:
+            break
+
+        last_id = servers[-1].id
+        remaining -= len(servers)
+        yield servers
+
+    last_score, last_due, last_id = float('inf'), datetime.min, 0
+
+    while remaining > 0:
+        query = (DB_ServerSchedule
+            .select(*columns, DB_ServerSchedule.score, DB_ServerSchedule.next_due)
+            .join(DB_Server)
+            .where(
+                DB_ServerSchedule.next_due <= now,
+                (DB_ServerSchedule.score < last_score) | ((DB_ServerSchedule.score == last_score) & (
+                    (DB_ServerSchedule.next_due > last_due) | ((DB_ServerSchedule.next_due == last_due) & (DB_ServerSchedule.server > last_id))
+                ))
+            )
+            .order_by(DB_ServerSchedule.score.desc(), DB_ServerSchedule.next_due, DB_ServerSchedule.server)
+            .limit(min(at_once, remaining))
+            .tuples()
+            .bind(database))
+
+        rows = list(query)
+        if not rows:
+            break
+
+        *_, (last_id, *_, last_score, last_due) = rows
+        remaining -= len(rows)
+        yield [ServerRow._make(row[:-2]) for row in rows]
+
+
+
+def database_stats(database: Database=DATABASE, since: timedelta=timedelta(hours=24)) -> t.Dict[str, t.Any]:
+    """
+        Row counts of the main tables, how many servers are due for a ping and what was seen in the last `since`
+        (servers with a record and players seen on any server).
+    """
+
+    now = datetime.now()
+    due = (DB_Server
+        .select(fn.COUNT(DB_Server.id))
+        .join(DB_ServerSchedule, JOIN.LEFT_OUTER, on=(DB_ServerSchedule.server == DB_Server.id))
+        .where(DB_ServerSchedule.id.is_null() | (DB_ServerSchedule.next_due <= now)))
+
+    return {
+        'servers': DB_Server.select().bind(database).count(),
+        'records': DB_ServerRecord.select().bind(database).count(),
+        'players': DB_Player.select().bind(database).count(),
+        'sources': DB_ServerSource.select(DB_ServerSource.source).distinct().bind(database).count(),
+        'due_servers': due.bind(database).scalar(),
+        'servers_seen': DB_ServerRecord.select(DB_ServerRecord.server).where(DB_ServerRecord.timestamp >= now - since).distinct().bind(database).count(),
+        'players_seen': DB_PlayerPresence.select(DB_PlayerPresence.player).where(DB_PlayerPresence.last_seen >= now - since).distinct().bind(database).count(),
+        'last_record': DB_ServerRecord.select(fn.MAX(DB_ServerRecord.timestamp)).bind(database).scalar()
+    }
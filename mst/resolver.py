@@ -0,0 +1,180 @@
+"""
+    DNS resolution shared by all pings. Many listed hostnames are subdomains of the same network pointing to the same IPs,
+    so `Resolver` caches A/AAAA and `_minecraft._tcp` SRV answers (for as long as their TTL says) and remembers dead domains too,
+    so re-ping sweeps skip repeated DNS work and dead domains fail fast without taking a ping slot.
+"""
+
+import typing as t
+
+import asyncio
+import time
+from collections import OrderedDict
+from ipaddress import ip_address
+
+import dns.asyncresolver
+import dns.resolver
+
+from mst.profiling import spanned
+from mst.settings import DNS_CONCURRENCY, DNS_TIMEOUT, DNS_NEGATIVE_TTL, DNS_MAX_TTL, DNS_CACHE_SIZE
+
+
+Address = t.Tuple[str, int]
+
+_NEGATIVE_ERRORS = (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)
+"""Answers saying that a record doesn't exist (those are cached for `negative_ttl`, other errors aren't cached at all)."""
+
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ip_address(host)
+        return True
+
+    except ValueError:
+        return False
+
+
+
+class Resolver():
+    """
+        Caching asynchronous resolver. `resolve()` mimics what the Minecraft client does with the server address field -
+        looks up the `_minecraft._tcp` SRV record (for the default port) and then A (or AAAA) records of the target.
+
+        Lookups of the same name running at the same time are merged into one and at most `concurrency` of them run at once.
+
+        - `hits` - Lookups answered from the cache
+        - `misses` - Lookups that had to ask a DNS server
+    """
+
+    def __init__(
+        self,
+        concurrency: int=DNS_CONCURRENCY,
+        timeout: float=DNS_TIMEOUT,
+        negative_ttl: float=DNS_NEGATIVE_TTL,
+        max_ttl: float=DNS_MAX_TTL,
+        cache_size: int=DNS_CACHE_SIZE
+    ) -> None:
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.cache_size = cache_size
+
+        self.resolver = dns.asyncresolver.Resolver()
+        self.cache: t.OrderedDict[t.Tuple[str, str], t.Tuple[float, t.Any]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._slots: t.Optional[asyncio.Semaphore] = None
+        self._lookups: t.Dict[t.Tuple[str, str], asyncio.Future] = {}
+
+
+    def _get_cached(self, key: t.Tuple[str, str]) -> t.Tuple[bool, t.Any]:
+        cached = self.cache.get(key)
+
+        if cached is None:
+            return False, None
+
+        expires_at, value = cached
+        if expires_at < time.monotonic():
+            del self.cache[key]
+            return False, None
+
+        self.cache.move_to_end(key)
+        return True, value
+
+
+    def _set_cached(self, key: t.Tuple[str, str], value: t.Any, ttl: float) -> None:
+        self.cache[key] = (time.monotonic() + min(ttl, self.max_ttl), value)
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+    async def _query(self, name: str, record_type: str) -> t.Any:
+        """
+            Returns the answer to a DNS query (`None` if the record doesn't exist), from the cache if possible.
+            Raises `dns.exception.DNSException` on other errors (timeouts, no reachable name servers, ...).
+        """
+
+        key = (name, record_type)
+        is_cached, value = self._get_cached(key)
+
+        if is_cached:
+            self.hits += 1
+            return value
+
+        # Somebody else is already asking for the same record:
+        if key in self._lookups:
+            self.hits += 1
+            return await asyncio.shield(self._lookups[key])
+
+        self.misses += 1
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+        lookup = asyncio.get_running_loop().create_future()
+        self._lookups[key] = lookup
+
+        try:
+            async with self._slots:
+                try:
+                    answer = await self.resolver.resolve(name, record_type, lifetime=self.timeout, search=False)
+                    value, ttl = list(answer), answer.rrset.ttl
+
+                except _NEGATIVE_ERRORS:
+                    value, ttl = None, self.negative_ttl
+
+            self._set_cached(key, value, ttl)
+            lookup.set_result(value)
+            return value
+
+        except BaseException as exception:
+            lookup.set_exception(exception)
+            lookup.exception() # Mark as retrieved, nobody has to be waiting for it
+            raise
+
+        finally:
+            del self._lookups[key]
+
+
+    async def resolve_ip(self, host: str) -> t.Optional[str]:
+        """
+            Resolves a hostname to an IP address (IPv4 preferred). Returns `None` if there is no such address.
+        """
+
+        if is_ip_address(host):
+            return host
+
+        for record_type in ('A', 'AAAA'):
+            answer = await self._query(host, record_type)
+            if answer:
+                return answer[0].address
+
+        return None
+
+
+    @spanned('dns')
+    async def resolve(self, host: str, port: int=25565) -> t.Optional[Address]:
+        """
+            Resolves a server address to the `(IP address, port)` to connect to. Returns `None` if the server doesn't exist
+            (or if DNS doesn't answer, or the scrapped host isn't a valid domain name - the server would be unreachable anyway).
+        """
+
+        try:
+            if port == 25565 and not is_ip_address(host):
+                srv = await self._query(f"_minecraft._tcp.{host}", 'SRV')
+
+                if srv:
+                    record = min(srv, key=lambda record: (record.priority, -record.weight))
+                    host, port = str(record.target).rstrip('.'), record.port
+
+            ip = await self.resolve_ip(host)
+
+        # Besides DNS errors, malformed hosts fail while building the query (`struct.error`, `UnicodeError`, `ValueError`, ...):
+        except Exception:
+            return None
+
+        return (ip, port) if ip else None
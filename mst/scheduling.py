@@ -0,0 +1,77 @@
+"""
+    Adaptive re-ping scheduling. Every ping updates a per-server schedule (`orm.DB_ServerSchedule`) - dead servers back off
+    exponentially and busy, fast-changing servers are re-pinged more often, so a fixed ping budget goes where the data actually changes.
+"""
+
+import typing as t
+
+import math
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from mst.settings import SCHEDULE_BASE_INTERVAL, SCHEDULE_MIN_INTERVAL, SCHEDULE_MAX_INTERVAL, SCHEDULE_SMOOTHING
+
+
+
+@dataclass
+class Schedule:
+    """
+        - `uptime` - Moving average of ping successes (0-1)
+        - `volatility` - Moving average of relative player count changes between two pings (0-1)
+        - `consecutive_failures` - Failed pings since the last successful one
+        - `last_players` - Online player count from the last successful ping
+        - `score` - Priority of the server (higher is more interesting)
+        - `next_due` - When should the server be pinged again
+    """
+
+    uptime: float = 1.0
+    volatility: float = 0.0
+    consecutive_failures: int = 0
+    last_players: t.Optional[int] = None
+    score: float = 0.0
+    next_due: t.Optional[datetime] = None
+
+
+
+def next_schedule(previous: t.Optional[Schedule], online: bool, players: t.Optional[int]=None, now: t.Optional[datetime]=None) -> Schedule:
+    """
+        Computes the schedule of a server after a ping (`previous` is `None` for a server pinged for the first time).
+    """
+
+    now = now or datetime.now()
+    previous = previous or Schedule(uptime=float(online))
+    smoothing = SCHEDULE_SMOOTHING
+
+    uptime = (1 - smoothing) * previous.uptime + smoothing * float(online)
+
+    if not online:
+        failures = previous.consecutive_failures + 1
+        interval = min(SCHEDULE_BASE_INTERVAL * 2 ** min(failures - 1, 32), SCHEDULE_MAX_INTERVAL)
+
+        return Schedule(
+            uptime=uptime,
+            volatility=previous.volatility,
+            consecutive_failures=failures,
+            last_players=previous.last_players,
+            score=uptime / (1 + failures),
+            next_due=now + timedelta(seconds=interval)
+        )
+
+    players = players or 0
+    volatility = previous.volatility
+    if previous.last_players is not None:
+        change = abs(players - previous.last_players) / max(1, players, previous.last_players)
+        volatility = (1 - smoothing) * volatility + smoothing * change
+
+    # Busy servers (log-scaled player count) and fast-changing ones are more interesting:
+    activity = 4 * volatility + math.log10(1 + players)
+    interval = max(SCHEDULE_MIN_INTERVAL, SCHEDULE_BASE_INTERVAL / (1 + activity))
+
+    return Schedule(
+        uptime=uptime,
+        volatility=volatility,
+        consecutive_failures=0,
+        last_players=players,
+        score=uptime * (1 + activity),
+        next_due=now + timedelta(seconds=interval)
+    )
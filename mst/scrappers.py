@@ -1,23 +1,63 @@
 import typing as t
 
+import asyncio
+from concurrent.futures import Executor
+
 from requests import Session
 from bs4 import BeautifulSoup
 
+from mst.cache import CachedPage, PageCache, content_hash
+from mst.extract import Address, AddressPath, has_class
+from mst.metrics import PAGES_SCRAPED, PAGES_UNCHANGED, SERVERS_SCRAPED
 from mst.orm import Server
+from mst.profiling import span, spanned
+from mst.settings import SCRAP_CONCURRENCY, SCRAP_DELAY
+from mst.utils import RateLimiter, iterate_producers
+
+
+
+class ServerPage(t.List[Server]):
+    """
+        Servers scrapped from one page of a server list - a list that also knows where it comes from (see `journal.Progress`).
+    """
+
+    def __init__(self, servers: t.Iterable[Server]=(), source: t.Optional[str]=None, number: int=1) -> None:
+        super().__init__(servers)
+
+        self.source = source
+        self.number = number
 
 
 
 class ServerListScrapper():
-    def __init__(self, url_template: str, source: t.Optional[str]=None) -> None:
+    addresses: t.Optional[AddressPath] = None
+    """Where server addresses are on the pages - scrapped straight from the lxml tree (overwrite `scrap_soup` if it's `None`)."""
+    incremental: bool = False
+    """Whether the list is sorted by recency (recently added/updated servers first), so paging can stop at `known_servers`."""
+
+
+    def __init__(self, url_template: str, source: t.Optional[str]=None, cache: t.Optional[PageCache]=None) -> None:
+        """
+            - `cache` - Page cache - pages that didn't change since they were scrapped the last time aren't parsed nor returned again
+        """
+
         self.session = Session()
 
         self.url_template = url_template
         self.source = source
+        self.cache = cache
+
+        self.known_servers: t.Optional[t.Set[t.Tuple[str, int]]] = None
+        """Servers (`(host, port)`) known from previous runs - `incremental` lists stop paging at a page with only known servers."""
 
         self.page = 1
-        self.max_pages = self._get_max_pages()
+        self.markup: t.Optional[str] = None
+        self._soup: t.Optional[BeautifulSoup] = None
+        self.page_state: t.Optional[CachedPage] = None
+        self.unchanged = False
 
-        self.soup = self.update_soup()
+        # Downloads the first page only if needed, `scrap` reuses it:
+        self.max_pages = self._get_max_pages()
 
 
     @property
@@ -25,8 +65,74 @@ class ServerListScrapper():
         return self.url_template.format(page=self.page)
 
 
-    def update_soup(self, *get_args, **get_kwargs) -> None:
-        self.soup = BeautifulSoup(markup=self.session.get(self.current_url, *get_args, **get_kwargs).text, features='lxml')
+    def fetch(self, page_number: int, *get_args, **get_kwargs) -> str:
+        """
+            Downloads the markup of a page (without touching `self.page` or `self.soup`).
+        """
+
+        return self.session.get(self.url_template.format(page=page_number), *get_args, **get_kwargs).text
+
+
+    def download(self, page_number: int, *get_args, conditional: bool=True, **get_kwargs) -> t.Tuple[t.Optional[str], t.Optional[CachedPage], bool]:
+        """
+            Downloads a page through the page cache (without touching `self.page` or `self.soup`). Returns:
+            - the markup (`None` if the page is `conditional`ly downloaded and didn't change - `304 Not Modified` or the same content hash)
+            - its page cache entry (`None` without a page cache), which has to be saved with `_remember` once the page is scrapped
+            - whether the page is unchanged since it was scrapped the last time
+        """
+
+        url = self.url_template.format(page=page_number)
+        previous = self.cache.get(url) if self.cache else None
+
+        if conditional and previous:
+            get_kwargs['headers'] = {**previous.validators, **get_kwargs.get('headers', {})}
+
+        with span('download'):
+            response = self.session.get(url, *get_args, **get_kwargs)
+
+        if previous and response.status_code == 304:
+            return None, previous, True
+
+        if self.cache is None:
+            return response.text, None, False
+
+        page = CachedPage(
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            content_hash=content_hash(response.text),
+            servers=previous.servers if previous else None
+        )
+        unchanged = previous is not None and previous.content_hash == page.content_hash
+
+        return (None if conditional and unchanged else response.text), page, unchanged
+
+
+    @staticmethod
+    def parse(markup: str) -> BeautifulSoup:
+        return BeautifulSoup(markup=markup, features='lxml')
+
+
+    @property
+    def soup(self) -> t.Optional[BeautifulSoup]:
+        """
+            The current page parsed by BeautifulSoup - only parsed when needed (such as by `_get_max_pages`).
+        """
+
+        if self._soup is None and self.markup is not None:
+            self._soup = self.parse(self.markup)
+
+        return self._soup
+
+
+    @soup.setter
+    def soup(self, soup: t.Optional[BeautifulSoup]) -> None:
+        # Scrappers that parse pages themselves (`self.soup = ...`) keep working:
+        self._soup = soup
+
+
+    def update_soup(self, *get_args, conditional: bool=False, **get_kwargs) -> None:
+        self.markup, self.page_state, self.unchanged = self.download(self.page, *get_args, conditional=conditional, **get_kwargs)
+        self._soup = None
 
 
     def move_to_page(self, page_number: int, *args, **kwargs):
@@ -44,195 +150,288 @@ class ServerListScrapper():
         return None
 
 
-    def scrap_page(self) -> t.List[Server]:
+    def to_servers(self, addresses: t.Iterable[Address], page_number: int) -> t.List[Server]:
+        return [Server(source=self.source, host=host, port=port) for host, port in addresses]
+
+
+    def scrap_soup(self, soup: BeautifulSoup, page_number: int) -> t.List[Server]:
+        """
+            Scraps all servers from an already parsed page of the server list and returns them as a list of `Server` objects.
+
+            Without `addresses`, overwrite this function (rather than `scrap_page`), so pages can be fetched and parsed concurrently
+            by `async_scrap`.
+        """
+
+        if self.addresses is None:
+            raise NotImplementedError()
+
+        return self.to_servers(self.addresses.from_soup(soup), page_number)
+
+
+    def _parses_pages(self) -> bool:
+        return self.addresses is not None or type(self).scrap_soup is not ServerListScrapper.scrap_soup
+
+
+    def _is_loaded(self, page_number: int) -> bool:
+        return page_number == self.page and (self.markup is not None or self.unchanged)
+
+
+    def scrap_page(self, page_number: int, *args, **kwargs) -> t.Optional[t.List[Server]]:
         """
             Scraps all servers from a specific page of the server list and returns them as a list of `Server` objects.
+
+            With a page cache, pages that didn't change since they were scrapped the last time aren't parsed - returns `None` for them
+            (or an empty list, if the page had no servers, so it's still the end of the list).
+        """
+
+        if not self._is_loaded(page_number):
+            self.move_to_page(page_number, *args, conditional=True, **kwargs)
+
+        return self._remember(page_number, self.page_state, None if self.unchanged else self.scrap_markup(self.markup, page_number))
+
+
+    @spanned('parse')
+    def scrap_markup(self, markup: str, page_number: int) -> t.List[Server]:
+        if self.addresses is None:
+            return self.scrap_soup(self.parse(markup), page_number)
+
+        return self.to_servers(self.addresses.from_markup(markup), page_number)
+
+
+    def _remember(self, page_number: int, page: t.Optional[CachedPage], servers: t.Optional[t.List[Server]]) -> t.Optional[t.List[Server]]:
         """
+            Saves a scrapped page into the page cache (`servers` is `None` for unchanged pages) and returns what `scrap_page` should.
+        """
+
+        if page is None:
+            return servers
+
+        if servers is not None:
+            page.servers = len(servers)
+
+        self.cache.put(self.url_template.format(page=page_number), page)
+
+        if servers is None:
+            PAGES_UNCHANGED.inc(source=self.source)
+            return [] if not page.servers else None
 
-        raise NotImplementedError()
+        return servers
 
 
-    def scrap(self, *args, **kwargs) -> t.Generator[t.List[Server], None, None]:
+    def _is_known(self, servers: t.Optional[t.List[Server]]) -> bool:
         """
-            Scraps all pages until there are no servers left.
+            Whether an `incremental` list can stop paging at this page - it's unchanged or has only `known_servers`.
+        """
+
+        if not self.incremental or self.known_servers is None:
+            return False
+
+        return servers is None or all((server.host, server.port) in self.known_servers for server in servers)
+
+
+    def scrap(
+        self,
+        *args,
+        first_page: t.Optional[int]=None,
+        skip_pages: t.Collection[int]=(),
+        **kwargs
+    ) -> t.Generator[ServerPage, None, None]:
+        """
+            Scraps all pages (from `first_page`, the current page by default) until there are no servers left.
+            Pages that didn't change since they were scrapped the last time are yielded empty.
+
+            - `skip_pages` - Pages that aren't downloaded at all (such as the ones an interrupted run has finished, see `journal`)
         """
     
-        current_page = self.page
+        current_page = first_page or self.page
 
         while True:
+            if current_page in skip_pages:
+                current_page += 1
+                continue
+
             servers = self.scrap_page(current_page, *args, **kwargs)
+            self._count(servers)
 
             # If there are no servers, stop:
-            if not servers or len(servers) <= 0:
+            if servers is not None and len(servers) <= 0:
                 break
 
             current_page += 1
-            yield servers
+            yield ServerPage(servers or (), self.source, current_page - 1)
 
-            # Stop, if we know max_pages:
+            # Stop at servers known from the last run, or if we know max_pages:
             _max = getattr(self, 'max_pages', None)
-            if _max is not None and current_page >= _max:
+            if self._is_known(servers) or (_max is not None and current_page >= _max):
                 break
 
 
+    async def async_scrap(
+        self,
+        concurrency: int=SCRAP_CONCURRENCY,
+        delay: float=SCRAP_DELAY,
+        executor: t.Optional[Executor]=None,
+        first_page: t.Optional[int]=None,
+        skip_pages: t.Collection[int]=()
+    ) -> t.AsyncGenerator[ServerPage, None]:
+        """
+            Asynchronous version of `scrap`. Downloads up to `concurrency` pages at once (starting a new request at most every `delay`
+            seconds), parses them in `executor` (the default thread pool if `None`) and yields servers of each page as soon as it's ready,
+            so pages can come out of order.
 
-class MinecraftMPScrapper(ServerListScrapper):
-    def __init__(self) -> None:
-        super().__init__(url_template="https://minecraft-mp.com/servers/updated/{page:d}/", source='minecraft-mp.com')
-
+            Scrappers that only overwrite `scrap_page` (without `addresses` or `scrap_soup`) still work, but scrap one page at a time.
+        """
 
-    def scrap_page(self, page_number: int) -> t.List[Server]:
-        self.move_to_page(page_number)
+        if not self._parses_pages():
+            concurrency = 1
 
-        all_servers: t.List[Server] = []
-        all_ips = self.soup.select(r'.container > table > tbody > tr > td:nth-child(2) > strong')
+        loop = asyncio.get_running_loop()
+        limiter = RateLimiter(1 / delay if delay else None)
+        pages: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+        next_page = first_page or self.page
+        last_page: t.Optional[int] = None
 
-        for ip in all_ips:
-            server_ip, _, server_port = ip.get_text(strip=True).lower().partition(':')
 
-            all_servers.append(Server(
-                source=self.source,
-                host=server_ip.lower() if server_ip != 'private server' else None,
-                port=(int(server_port) if server_port.isdigit() else 25565)
-            ))
-    
-        return all_servers
+        def is_over(page_number: int) -> bool:
+            _max = getattr(self, 'max_pages', None)
+            return (last_page is not None and page_number > last_page) or (_max is not None and page_number > self.page and page_number >= _max)
 
 
+        async def scrap_pages() -> None:
+            nonlocal next_page, last_page
 
-class MinecraftServerListScrapper(ServerListScrapper):
-    def __init__(self) -> None:
-        super().__init__(url_template="https://minecraft-server-list.com/sort/PopularAllTime/page/{page:d}", source='minecraft-server-list.com')
+            while not is_over(next_page):
+                page_number = next_page
+                next_page += 1
 
+                if page_number in skip_pages:
+                    continue
 
-    def _get_max_pages(self) -> t.Optional[int]:
-        self.move_to_page(1)
-        _raw = self.soup.select_one(r'.paginate > ul > li:nth-last-child(1) > a')
+                await limiter.wait()
 
-        if _raw:
-            return int(_raw['href'].removeprefix('/sort/PopularAllTime/page/').removesuffix('/'))
+                # The first page may be downloaded already (by `_get_max_pages`):
+                if not self._parses_pages() or self._is_loaded(page_number):
+                    servers = await asyncio.to_thread(self.scrap_page, page_number)
+                else:
+                    markup, page, _ = await asyncio.to_thread(self.download, page_number)
+                    scrapped = await loop.run_in_executor(executor, self.scrap_markup, markup, page_number) if markup is not None else None
+                    servers = await asyncio.to_thread(self._remember, page_number, page, scrapped)
 
+                self._count(servers)
 
-    def scrap_page(self, page_number: int) -> t.List[Server]:
-        self.move_to_page(page_number)
+                # If there are no servers, stop (pages after this one may still be on their way, but they're thrown away):
+                if servers is not None and not servers:
+                    last_page = page_number - 1 if last_page is None else min(last_page, page_number - 1)
+                    continue
 
-        all_servers: t.List[Server] = []
-        all_ips = self.soup.select(r'.serverdatadiv1 > table > tbody > tr > .n2')
+                # Stop at servers known from the last run:
+                if self._is_known(servers):
+                    last_page = page_number if last_page is None else min(last_page, page_number)
 
+                if not is_over(page_number):
+                    await pages.put(ServerPage(servers or (), self.source, page_number))
 
-        for ip in all_ips:
-            server_ip, _, server_port = ip['id'].strip().lower().partition(':')
 
-            all_servers.append(Server(
-                source=self.source,
-                host=server_ip.lower(),
-                port=(int(server_port) if server_port.isdigit() else 25565)
-            ))
+        async for servers in iterate_producers(pages, *[scrap_pages() for _ in range(concurrency)]):
+            yield servers
 
 
-        return all_servers
+    def _count(self, servers: t.Optional[t.List[Server]]) -> None:
+        PAGES_SCRAPED.inc(source=self.source)
+        SERVERS_SCRAPED.inc(len(servers or ()), source=self.source)
 
 
+    def __getstate__(self) -> t.Dict[str, t.Any]:
+        # Only parsing needs to work in other processes (see `async_scrap`), the session, current page, cache and known servers aren't needed there
+        return {key: value for key, value in self.__dict__.items() if key not in ('session', 'markup', '_soup', 'cache', 'known_servers')}
 
-class MinecraftServersScrapper(ServerListScrapper):
-    def __init__(self) -> None:
-        super().__init__(url_template="https://minecraftservers.org/index/{page:d}", source='minecraftservers.org')
 
 
-    def scrap_page(self, page_number: int) -> t.List[Server]:
-        self.move_to_page(page_number)
-
-        if self.max_pages and self.page >= self.max_pages:
-            return []
+class MinecraftMPScrapper(ServerListScrapper):
+    addresses = AddressPath(
+        css=r'.container > table > tbody > tr > td:nth-child(2) > strong',
+        xpath=f"//*[{has_class('container')}]/table/tbody/tr/*[2][self::td]/strong"
+    )
+    incremental = True
 
 
-        all_servers: t.List[Server] = []
-        all_ips = self.soup.select(r'.server-ip > button')
+    def __init__(self, **kwargs) -> None:
+        super().__init__(url_template="https://minecraft-mp.com/servers/updated/{page:d}/", source='minecraft-mp.com', **kwargs)
 
-        for ip in all_ips:
-            server_ip, _, server_port = ip['data-clipboard-text'].strip().lower().partition(':')
 
-            all_servers.append(Server(
-                source=self.source,
-                host=server_ip.lower(),
-                port=(int(server_port) if server_port.isdigit() else 25565)
-            ))
+    def to_servers(self, addresses: t.Iterable[Address], page_number: int) -> t.List[Server]:
+        return [Server(source=self.source, host=host if host != 'private server' else None, port=port) for host, port in addresses]
 
 
-        return all_servers
 
+class MinecraftServerListScrapper(ServerListScrapper):
+    addresses = AddressPath(
+        css=r'.serverdatadiv1 > table > tbody > tr > .n2',
+        xpath=f"//*[{has_class('serverdatadiv1')}]/table/tbody/tr/*[{has_class('n2')}]",
+        attribute='id'
+    )
 
 
-class ServersMinecraftScrapper(ServerListScrapper):
-    def __init__(self) -> None:
-        super().__init__(url_template="https://servers-minecraft.com/page/{page:d}", source='servers-minecraft.com')
+    def __init__(self, **kwargs) -> None:
+        super().__init__(url_template="https://minecraft-server-list.com/sort/PopularAllTime/page/{page:d}", source='minecraft-server-list.com', **kwargs)
 
 
     def _get_max_pages(self) -> t.Optional[int]:
         self.move_to_page(1)
-        _raw = self.soup.select_one(r'ul.pagination > li:nth-last-child(1) > a')
+        _raw = self.soup.select_one(r'.paginate > ul > li:nth-last-child(1) > a')
 
         if _raw:
-            return int(_raw['href'].removeprefix('/page/'))
-
-
-    def scrap_page(self, page_number: int) -> t.List[Server]:
-        self.move_to_page(page_number)
-
-        all_servers: t.List[Server] = []
-        all_ips = self.soup.select(r'.banner-ip button.copy')
+            return int(_raw['href'].removeprefix('/sort/PopularAllTime/page/').removesuffix('/'))
 
-        for ip in all_ips:
-            server_ip, _, server_port = ip['data-clipboard-text'].strip().partition(':')
 
-            all_servers.append(Server(
-                source=self.source,
-                host=server_ip.lower(),
-                port=(int(server_port) if server_port.isdigit() else 25565)
-            ))
 
+class MinecraftServersScrapper(ServerListScrapper):
+    addresses = AddressPath(css=r'.server-ip > button', xpath=f"//*[{has_class('server-ip')}]/button", attribute='data-clipboard-text')
 
-        return all_servers
 
+    def __init__(self, **kwargs) -> None:
+        super().__init__(url_template="https://minecraftservers.org/index/{page:d}", source='minecraftservers.org', **kwargs)
 
 
-class MinecraftListScrapper(ServerListScrapper):
-    def __init__(self) -> None:
-        super().__init__(url_template="https://minecraftlist.org/servers?order_by=server_id&page={page:d}", source='minecraftlist.org')
+    def to_servers(self, addresses: t.Iterable[Address], page_number: int) -> t.List[Server]:
+        if self.max_pages and page_number >= self.max_pages:
+            return []
 
+        return super().to_servers(addresses, page_number)
 
-    def _get_max_pages(self) -> t.Optional[int]:
-        self.move_to_page(1)
-        _raw = self.soup.select_one(r'ul.pagination > li:nth-last-child(2) > a')
 
-        if _raw:
-            return int(_raw.get_text(strip=True))
 
+class ServersMinecraftScrapper(ServerListScrapper):
+    addresses = AddressPath(
+        css=r'.banner-ip button.copy',
+        xpath=f"//*[{has_class('banner-ip')}]//button[{has_class('copy')}]",
+        attribute='data-clipboard-text'
+    )
 
-    def scrap_page(self, page_number: int) -> t.List[Server]:
-        self.move_to_page(page_number)
 
-        all_servers: t.List[Server] = []
-        all_ips = self.soup.select(r'.mcp-banner input.server-address')
+    def __init__(self, **kwargs) -> None:
+        super().__init__(url_template="https://servers-minecraft.com/page/{page:d}", source='servers-minecraft.com', **kwargs)
 
 
-        for ip in all_ips:
-            server_ip, _, server_port = ip['value'].strip().partition(':')
+    def _get_max_pages(self) -> t.Optional[int]:
+        self.move_to_page(1)
+        _raw = self.soup.select_one(r'ul.pagination > li:nth-last-child(1) > a')
 
-            all_servers.append(Server(
-                source=self.source,
-                host=server_ip.lower(),
-                port=(int(server_port) if server_port.isdigit() else 25565)
-            ))
+        if _raw:
+            return int(_raw['href'].removeprefix('/page/'))
 
 
-        return all_servers
 
+class MinecraftListScrapper(ServerListScrapper):
+    addresses = AddressPath(
+        css=r'.mcp-banner input.server-address',
+        xpath=f"//*[{has_class('mcp-banner')}]//input[{has_class('server-address')}]",
+        attribute='value'
+    )
 
 
-class MinecraftServersListScrapper(ServerListScrapper):
-    def __init__(self) -> None:
-        super().__init__(url_template="https://www.minecraft-servers-list.org/rank/{page:d}", source='minecraft-servers-list.org')
+    def __init__(self, **kwargs) -> None:
+        super().__init__(url_template="https://minecraftlist.org/servers?order_by=server_id&page={page:d}", source='minecraftlist.org', **kwargs)
 
 
     def _get_max_pages(self) -> t.Optional[int]:
@@ -243,24 +442,25 @@ class MinecraftServersListScrapper(ServerListScrapper):
             return int(_raw.get_text(strip=True))
 
 
-    def scrap_page(self, page_number: int) -> t.List[Server]:
-        self.move_to_page(page_number)
 
-        all_servers: t.List[Server] = []
-        all_ips = self.soup.select(r'.container > table:nth-last-child(2) .copy-ip-trigger')
+class MinecraftServersListScrapper(ServerListScrapper):
+    addresses = AddressPath(
+        css=r'.container > table:nth-last-child(2) .copy-ip-trigger',
+        xpath=f"//*[{has_class('container')}]/table[count(following-sibling::*) = 1]//*[{has_class('copy-ip-trigger')}]",
+        attribute='data-clipboard-text'
+    )
 
 
-        for ip in all_ips:
-            server_ip, _, server_port = ip['data-clipboard-text'].strip().partition(':')
+    def __init__(self, **kwargs) -> None:
+        super().__init__(url_template="https://www.minecraft-servers-list.org/rank/{page:d}", source='minecraft-servers-list.org', **kwargs)
 
-            all_servers.append(Server(
-                source=self.source,
-                host=server_ip.lower(),
-                port=(int(server_port) if server_port.isdigit() else 25565)
-            ))
 
+    def _get_max_pages(self) -> t.Optional[int]:
+        self.move_to_page(1)
+        _raw = self.soup.select_one(r'ul.pagination > li:nth-last-child(2) > a')
 
-        return all_servers
+        if _raw:
+            return int(_raw.get_text(strip=True))
 
 
 
@@ -273,14 +473,46 @@ ALL_SCRAPPERS: t.List[t.Type[ServerListScrapper]] = [
     MinecraftServersListScrapper
 ]
 
-def scrap_from_all_scrappers(scrappers: t.List[t.Type[ServerListScrapper]]=ALL_SCRAPPERS, *args, **kwargs):
+KnownServers = t.Callable[[str], t.Set[t.Tuple[str, int]]]
+"""Returns servers (`(host, port)`) known from previous runs for a source (see `queries.load_known_servers`)."""
+
+
+
+def _create_scrapper(scrapper: t.Type[ServerListScrapper], cache: t.Optional[PageCache], known_servers: t.Optional[KnownServers]) -> ServerListScrapper:
+    instance = scrapper(cache=cache)
+
+    if known_servers is not None and instance.incremental:
+        instance.known_servers = known_servers(instance.source)
+
+    return instance
+
+
+
+def scrap_from_all_scrappers(
+    scrappers: t.List[t.Type[ServerListScrapper]]=ALL_SCRAPPERS,
+    *args,
+    cache: t.Optional[PageCache]=None,
+    known_servers: t.Optional[KnownServers]=None,
+    first_pages: t.Optional[t.Dict[str, int]]=None,
+    skip_pages: t.Optional[t.Dict[str, t.Collection[int]]]=None,
+    **kwargs
+):
     """
         Reference: https://stackoverflow.com/a/69748260/12422061
+
+        - `cache` - Page cache, unchanged pages are skipped (see `ServerListScrapper`)
+        - `known_servers` - Incremental mode - `incremental` server lists stop paging at servers known from previous runs
+        - `first_pages` - Pages to start at, by source (such as to resume an interrupted run, see `journal`)
+        - `skip_pages` - Pages that aren't scrapped, by source
     """
 
     i = 0
     n = len(scrappers)
-    generators = [generator().scrap(*args, **kwargs) for generator in scrappers]
+    instances = [_create_scrapper(scrapper, cache, known_servers) for scrapper in scrappers]
+    generators = [
+        instance.scrap(*args, first_page=(first_pages or {}).get(instance.source), skip_pages=(skip_pages or {}).get(instance.source, ()), **kwargs)
+        for instance in instances
+    ]
 
     while generators:
         try:
@@ -293,6 +525,40 @@ def scrap_from_all_scrappers(scrappers: t.List[t.Type[ServerListScrapper]]=ALL_S
 
 
 
+async def async_scrap_from_all_scrappers(
+    scrappers: t.List[t.Type[ServerListScrapper]]=ALL_SCRAPPERS,
+    concurrency: int=SCRAP_CONCURRENCY,
+    delay: float=SCRAP_DELAY,
+    executor: t.Optional[Executor]=None,
+    cache: t.Optional[PageCache]=None,
+    known_servers: t.Optional[KnownServers]=None,
+    first_pages: t.Optional[t.Dict[str, int]]=None,
+    skip_pages: t.Optional[t.Dict[str, t.Collection[int]]]=None
+) -> t.AsyncGenerator[ServerPage, None]:
+    """
+        Asynchronous version of `scrap_from_all_scrappers`. Scraps all server lists at once (each one through `ServerListScrapper.async_scrap`
+        with its own `concurrency` and `delay` limits) and yields servers of every page as soon as it's ready.
+    """
+
+    pages: asyncio.Queue = asyncio.Queue(maxsize=len(scrappers) * concurrency)
+
+
+    async def scrap(scrapper: t.Type[ServerListScrapper]) -> None:
+        # Scrappers may download their first page in the constructor (and known servers come from the database):
+        instance = await asyncio.to_thread(_create_scrapper, scrapper, cache, known_servers)
+
+        first_page = (first_pages or {}).get(instance.source)
+        skipped = (skip_pages or {}).get(instance.source, ())
+
+        async for servers in instance.async_scrap(concurrency=concurrency, delay=delay, executor=executor, first_page=first_page, skip_pages=skipped):
+            await pages.put(servers)
+
+
+    async for servers in iterate_producers(pages, *[scrap(scrapper) for scrapper in scrappers]):
+        yield servers
+
+
+
 if __name__ == "__main__":
     import asyncio
     try:
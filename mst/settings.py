@@ -15,3 +15,126 @@ PLAYER_USERNAME_REGEX = compile(r'^[a-zA-Z_0-9]{2,16}$')
     Some plugins allow you to show text when hovering on the player list. They actually just create fake players with names in the player list.
     This RegEx checks whether each player name is valid when obtaining player list, so we don't save crap.
 """
+
+PING_CONCURRENCY = 256
+"""How many pings can be in flight at once when pinging in the `window` mode."""
+PING_TIMEOUT = 5.0
+"""Per-host deadline (in seconds) for a whole status request, including retries."""
+PING_RATE_LIMIT = None
+"""Max. number of pings started per second in the `window` mode (`None` for no limit)."""
+PING_CLIENT = 'native'
+"""Server List Ping client: `native` (`pinger.native_status`, raw sockets) or `mcstatus`."""
+PING_CONNECT_TIMEOUT = 2.0
+"""Max. time (in seconds) the `native` client waits for a connection (capped by the whole deadline of the ping)."""
+
+DATABASE_FLUSH_SIZE = 500
+"""How many servers are buffered before they are written into the database in a single transaction."""
+DATABASE_FLUSH_INTERVAL = 5.0
+"""Max. number of seconds buffered servers can wait before they are written into the database."""
+DATABASE_QUEUE_SIZE = 5000
+"""How many servers can wait for the database writer thread before the pingers are slowed down."""
+
+SCRAP_CONCURRENCY = 2
+"""How many pages of a single server list can be downloaded at once when scrapping asynchronously."""
+SCRAP_DELAY = 0.5
+"""Min. number of seconds between two requests to the same server list when scrapping asynchronously (politeness delay)."""
+PAGE_CACHE_PATH = Path(DATA_PATH, 'cache', 'pages.db')
+"""SQLite database of `cache.PageCache` - validators (ETag, Last-Modified, content hash) of scrapped server list pages."""
+
+PIPELINE_QUEUE_SIZE = 1000
+"""Max. number of items waiting between two stages of `data.Pipeline`."""
+PIPELINE_REPORT_INTERVAL = 30.0
+"""How often (in seconds) `data.Pipeline` reports its stage statistics (`None` to disable)."""
+
+DATABASE_PROFILE = 'default'
+"""
+    SQLite tuning profile of the database (see `orm.DATABASE_PROFILES`) - `default` (SQLite's defaults), `bulk-ingest` (write-heavy sweeps)
+    or `concurrent-read` (sweeps with read queries running at the same time).
+"""
+DATABASE_MAINTENANCE_INTERVAL = 600.0
+"""How often (in seconds) the database writer checkpoints the WAL and optimizes the database during long runs (`None` to disable)."""
+RECORD_STORAGE = 'full'
+"""
+    How server records are saved (see `storage`) - `full` (every record has all of its fields) or `compact` (descriptions and versions
+    are deduplicated and static fields are only saved when they change).
+"""
+COMPACTION_CHUNK_SIZE = 20000
+"""Records converted in one transaction by `storage.compact_records`."""
+
+DEDUPE_BLOOM_CAPACITY = None
+"""
+    Expected number of unique servers for deduplicating them with a Bloom filter instead of an exact set (`None`). Useful for very
+    large runs - it uses a fraction of the memory, but a few new servers can be mistaken for already seen ones (see `DEDUPE_BLOOM_ERROR_RATE`).
+"""
+DEDUPE_BLOOM_ERROR_RATE = 0.001
+"""False positive rate of the deduplication Bloom filter."""
+
+DNS_CONCURRENCY = 64
+"""Max. number of DNS lookups running at once."""
+DNS_TIMEOUT = 3.0
+"""Deadline (in seconds) of a single DNS lookup."""
+DNS_NEGATIVE_TTL = 3600.0
+"""How long (in seconds) non-existent domains (NXDOMAIN) and missing records are remembered."""
+DNS_MAX_TTL = 86400.0
+"""Upper bound (in seconds) on how long a resolved address is cached, no matter what its TTL says."""
+DNS_CACHE_SIZE = 200000
+"""Max. number of cached DNS answers (the least recently used ones are dropped)."""
+
+SCHEDULE_BASE_INTERVAL = 3600.0
+"""How often (in seconds) a steadily online server with no player activity is re-pinged by scheduled sweeps."""
+SCHEDULE_MIN_INTERVAL = 600.0
+"""Shortest re-ping interval (in seconds) of the busiest, fastest-changing servers."""
+SCHEDULE_MAX_INTERVAL = 7 * 86400.0
+"""Longest re-ping interval (in seconds) dead servers can back off to."""
+SCHEDULE_SMOOTHING = 0.3
+"""Weight of the latest ping in the moving averages of uptime and player count volatility (0-1)."""
+
+SWEEP_SHARDS = None
+"""Number of worker processes of a sharded sweep (`None` for one per CPU core)."""
+SWEEP_BATCH_SIZE = 500
+"""Pinged servers sent from a sweep worker to the writer at once."""
+SWEEP_BATCH_INTERVAL = 1.0
+"""Max. time (in seconds) a sweep worker holds pinged servers before sending them to the writer."""
+
+COORDINATOR_HOST = '127.0.0.1'
+"""Address the sweep coordinator listens on (`0.0.0.0` to let workers on other machines in - the protocol has no authentication)."""
+COORDINATOR_PORT = 8765
+"""Port of the sweep coordinator."""
+COORDINATOR_UNIT_SIZE = 1000
+"""Servers in one work unit leased to a worker."""
+COORDINATOR_LEASE_TIMEOUT = 120.0
+"""How long (in seconds) a worker can go without reporting results before its work unit is given to another worker."""
+COORDINATOR_POLL_INTERVAL = 1.0
+"""How long (in seconds) an idle worker waits before asking the coordinator for work again."""
+COORDINATOR_RETRY_TIMEOUT = 60.0
+"""How long (in seconds) a worker keeps retrying when the coordinator can't be reached."""
+
+BENCHMARK_RESULTS_PATH = Path(DATA_PATH, 'benchmarks', 'results.jsonl')
+"""JSON lines file where results of `benchmark.run_benchmarks` are appended (one line per scenario of a run)."""
+
+PRINT_SAVED_ROWS = False
+"""Print every server, record and player saved by `data.save_into_database` (slows long runs down, use `metrics` instead)."""
+METRICS_PORT = None
+"""Port of the local HTTP endpoint serving metrics in the Prometheus text format (`None` to disable it)."""
+METRICS_HOST = '127.0.0.1'
+"""Interface the metrics endpoint listens on."""
+METRICS_LOG_INTERVAL = None
+"""How often (in seconds) to log a snapshot of all metrics as a JSON line (`None` to disable it)."""
+EVENT_LOOP_LAG_INTERVAL = 0.5
+"""How often (in seconds) to measure the event loop lag (`None` to disable it)."""
+PROFILE_SAMPLE_INTERVAL = 0.01
+"""How often (in seconds) `--profile` samples the stack of the event loop thread."""
+PROFILE_SLOW_CALLBACK_DURATION = 0.05
+"""
+    Event loop callbacks running longer than this (in seconds) are reported by `--profile` (through asyncio's debug mode,
+    `None` to leave the debug mode off - it costs a bit of time on every callback).
+"""
+
+EXPORT_PATH = Path(DATA_PATH, 'exports')
+"""Directory of columnar exports (`export.export_database`) - one subdirectory per table, partitioned by date."""
+EXPORT_CHUNK_SIZE = 50000
+"""Rows read from the database (and written into one file) at once by an export."""
+EXPORT_FORMAT = 'parquet'
+"""File format of exports: `parquet` or `arrow` (Arrow IPC)."""
+EXPORT_COMPRESSION = 'zstd'
+"""Compression codec of exported files."""
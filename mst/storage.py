@@ -0,0 +1,245 @@
+"""
+    Storage of server records. Most pings return the same description, version, max. players and `is_modded` as the previous
+    one, so besides `full` records (every record has all of its fields), records can be saved as `compact` ones:
+
+        - descriptions and versions are interned into the `descriptions` and `versions` tables (keyed by the hash of the text)
+        - static fields are saved into `server_states` only when they change, records only point to the current state
+        - records keep the volatile fields (latency, online players and the players themselves)
+
+    The storage mode of new records is saved in the database (`set_record_storage`, `RECORD_STORAGE` for databases without
+    one) and both kinds of records can live in one database. `orm.DB_ServerRecord.select_full` reads them with all of their
+    fields, and `compact_records` converts full records of an existing database into compact ones (and switches it to them).
+"""
+
+import typing as t
+
+import hashlib
+from datetime import datetime
+
+from peewee import Database, chunked, fn
+
+from mst.orm import DATABASE, DB_DatabaseSetting, DB_Description, DB_InternedText, DB_ServerRecord, DB_ServerState, DB_Version
+from mst.settings import COMPACTION_CHUNK_SIZE, RECORD_STORAGE
+
+
+RecordStorage = t.Literal['full', 'compact']
+
+StateKey = t.Tuple[t.Optional[int], t.Optional[int], int, bool]
+"""Description ID, version ID, max. players and `is_modded` of a state."""
+
+StatusRow = t.Tuple[t.Optional[int], datetime, t.Optional[str], t.Optional[str], int, bool]
+"""Server ID, timestamp, description, version, max. players and `is_modded` of a record."""
+
+_CHUNK_SIZE = 100
+"""Rows per statement in bulk queries (keeps us under SQLite's limit of bound variables per query)."""
+
+_STATE_FIELDS = (
+    DB_ServerState.server, DB_ServerState.since, DB_ServerState.description, DB_ServerState.version, DB_ServerState.max_players, DB_ServerState.is_modded
+)
+
+
+
+_STORAGE_SETTING = 'record_storage'
+
+
+
+def get_record_storage(database: Database) -> str:
+    """
+        How new records are saved into `database` (read from the database once, then remembered).
+    """
+
+    storage = getattr(database, 'record_storage', None)
+
+    if storage is None:
+        storage = (DB_DatabaseSetting
+            .select(DB_DatabaseSetting.value)
+            .where(DB_DatabaseSetting.name == _STORAGE_SETTING)
+            .bind(database)
+            .scalar()) or RECORD_STORAGE
+        database.record_storage = storage
+
+    return storage
+
+
+def set_record_storage(database: Database, storage: str) -> Database:
+    """
+        Sets how new records are saved into `database` - `full` or `compact` (saved in the database, so later runs keep it).
+    """
+
+    if storage not in t.get_args(RecordStorage):
+        raise ValueError(f"Unknown record storage: {storage!r} (expected one of: {', '.join(t.get_args(RecordStorage))})")
+
+    (DB_DatabaseSetting
+        .insert(name=_STORAGE_SETTING, value=storage)
+        .on_conflict(conflict_target=(DB_DatabaseSetting.name,), update={DB_DatabaseSetting.value: storage})
+        .execute(database))
+    database.record_storage = storage
+
+    return database
+
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+
+
+def intern_texts(model: t.Type[DB_InternedText], texts: t.Iterable[t.Optional[str]], database: Database=DATABASE) -> t.Dict[str, int]:
+    """
+        Maps texts to IDs of their rows in `model` (`DB_Description` or `DB_Version`), inserting the ones that aren't saved yet.
+    """
+
+    hashes = {text_hash(text): text for text in set(texts) if text is not None}
+    ids: t.Dict[str, int] = {}
+
+
+    def select(chunk: t.List[str]) -> None:
+        for _id, hash in model.select(model.id, model.hash).where(model.hash.in_(chunk)).tuples().bind(database):
+            ids[hashes[hash]] = _id
+
+
+    for chunk in chunked(list(hashes), _CHUNK_SIZE):
+        select(chunk)
+
+        missing = [hash for hash in chunk if hashes[hash] not in ids]
+        if missing:
+            model.insert_many([(hash, hashes[hash]) for hash in missing], fields=(model.hash, model.text)).on_conflict_ignore().execute(database)
+            select(missing)
+
+    return ids
+
+
+
+def _latest_states(server_ids: t.Iterable[int], database: Database) -> t.Dict[t.Optional[int], t.Tuple[int, StateKey]]:
+    """
+        Current states of servers - the ones with the latest `since` (compacted historical records get states with higher IDs
+        than the current ones, so IDs don't say which state is the latest).
+    """
+
+    latest: t.Dict[t.Optional[int], t.Tuple[int, StateKey]] = {}
+
+    for chunk in chunked(list(set(server_ids)), _CHUNK_SIZE * 5):
+        ranked = (DB_ServerState
+            .select(
+                DB_ServerState.id, DB_ServerState.server, DB_ServerState.description, DB_ServerState.version, DB_ServerState.max_players, DB_ServerState.is_modded,
+                fn.ROW_NUMBER().over(partition_by=[DB_ServerState.server], order_by=[DB_ServerState.since.desc(), DB_ServerState.id.desc()]).alias('rank')
+            )
+            .where(DB_ServerState.server.in_(chunk)))
+        query = (ranked
+            .select_from(ranked.c.id, ranked.c.server_id, ranked.c.description_id, ranked.c.version_id, ranked.c.max_players, ranked.c.is_modded)
+            .where(ranked.c.rank == 1)
+            .tuples()
+            .bind(database))
+
+        for state_id, server_id, description_id, version_id, max_players, is_modded in query:
+            latest[server_id] = (state_id, (description_id, version_id, max_players, bool(is_modded)))
+
+    return latest
+
+
+
+def save_states(
+    statuses: t.Sequence[StatusRow],
+    database: Database=DATABASE,
+    latest: t.Optional[t.Dict[t.Optional[int], t.Tuple[int, StateKey]]]=None
+) -> t.List[int]:
+    """
+        Returns the state ID of every record (in the order of `statuses`). A record gets the latest state of its server
+        if its static fields didn't change, otherwise a new state is saved. Call it inside a transaction.
+
+        - `latest` - Latest states by server ID (`(state ID, key)`) - updated with the new states. If not given,
+        they're read from the database.
+    """
+
+    descriptions = intern_texts(DB_Description, (status[2] for status in statuses), database)
+    versions = intern_texts(DB_Version, (status[3] for status in statuses), database)
+
+    if latest is None:
+        latest = _latest_states((status[0] for status in statuses if status[0] is not None), database)
+
+    new_states: t.List[tuple] = []
+    references: t.List[int] = [] # State IDs, or `-(index + 1)` of a new state
+
+    for server_id, timestamp, description, version, max_players, is_modded in statuses:
+        key = (descriptions.get(description), versions.get(version), max_players, bool(is_modded))
+        current = latest.get(server_id)
+
+        if current is None or current[1] != key:
+            new_states.append((server_id, timestamp, *key))
+            current = latest[server_id] = (-len(new_states), key)
+
+        references.append(current[0])
+
+    if not new_states:
+        return references
+
+    # We're the only writer inside this transaction, so the new states are the ones after `last_state_id`, in the order of insertion:
+    last_state_id = DB_ServerState.select(fn.MAX(DB_ServerState.id)).bind(database).scalar() or 0
+
+    for chunk in chunked(new_states, _CHUNK_SIZE):
+        DB_ServerState.insert_many(chunk, fields=_STATE_FIELDS).execute(database)
+
+    state_ids = [state_id for state_id, in DB_ServerState.select(DB_ServerState.id).where(DB_ServerState.id > last_state_id).order_by(DB_ServerState.id).tuples().bind(database)]
+
+    for server_id, *_ in new_states:
+        reference, key = latest[server_id]
+        if reference < 0:
+            latest[server_id] = (state_ids[-reference - 1], key)
+
+    return [state_ids[-reference - 1] if reference < 0 else reference for reference in references]
+
+
+
+def _database_size(database: Database) -> int:
+    return database.pragma('page_count') * database.pragma('page_size')
+
+
+
+def compact_records(database: Database=DATABASE, chunk_size: int=COMPACTION_CHUNK_SIZE, vacuum: bool=True) -> t.Dict[str, int]:
+    """
+        Switches a database to compact records and converts its full records into compact ones (see the module's docs),
+        `chunk_size` records per transaction, so the database writer of a running sweep isn't blocked for long and an interrupted
+        compaction just continues next time. With `vacuum`, the freed space is given back to the file system at the end (`VACUUM`
+        rewrites the whole database and needs as much free disk space).
+
+        Returns the number of compacted records and states saved for them, and the size of the database before and after.
+    """
+
+    latest: t.Dict[t.Optional[int], t.Tuple[int, StateKey]] = {} # States of this compaction only, records are converted in order
+    size_before = _database_size(database)
+    set_record_storage(database, 'compact')
+
+    compacted = 0
+    state_ids: t.Set[int] = set()
+    last_id = 0
+
+    while True:
+        with database.atomic():
+            rows = list(DB_ServerRecord
+                .select(
+                    DB_ServerRecord.id, DB_ServerRecord.server, DB_ServerRecord.timestamp, DB_ServerRecord.description, DB_ServerRecord.version,
+                    DB_ServerRecord.max_players, DB_ServerRecord.is_modded
+                )
+                .where(DB_ServerRecord.id > last_id, DB_ServerRecord.state.is_null())
+                .order_by(DB_ServerRecord.id)
+                .limit(chunk_size)
+                .tuples()
+                .bind(database))
+
+            if not rows:
+                break
+
+            states = save_states([row[1:] for row in rows], database, latest)
+            database.cursor().executemany(
+                "UPDATE server_records SET state_id = ?, description = NULL, version = NULL, max_players = 0, is_modded = 0 WHERE id = ?",
+                [(state_id, row[0]) for state_id, row in zip(states, rows)]
+            )
+
+        compacted += len(rows)
+        state_ids.update(states)
+        last_id = rows[-1][0]
+
+    if vacuum:
+        database.execute_sql('VACUUM')
+
+    return {'records': compacted, 'states': len(state_ids), 'size_before': size_before, 'size_after': _database_size(database)}
@@ -0,0 +1,201 @@
+"""
+    Sharded sweeps - pinging the whole database with one event loop per CPU core.
+
+    The `servers` table is split into ID ranges (`shard_ranges`) and every range is pinged by its own worker process
+    (with its own database connection, event loop and `pinger.ping_window`). Workers send the pinged servers in batches
+    through a `multiprocessing` queue to the parent process, which saves them with the single `data.DatabaseWriterThread`.
+"""
+
+import typing as t
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+from peewee import Database, SqliteDatabase, fn
+
+from mst.data import DatabaseWriterThread
+from mst.orm import DATABASE, DATABASE_PROFILES, DatabaseProfile, DB_Server
+from mst.pinger import PingClient, PingedServer, ping_window
+from mst.queries import yield_servers_from_database
+from mst.settings import PING_CLIENT, PING_CONCURRENCY, PING_TIMEOUT, PING_RATE_LIMIT, SWEEP_SHARDS, SWEEP_BATCH_SIZE, SWEEP_BATCH_INTERVAL
+
+
+IdRange = t.Tuple[int, int]
+
+
+
+class SweepError(Exception):
+    """
+        A sweep worker failed (the message contains its traceback) or died without finishing its shard.
+    """
+
+
+
+def shard_ranges(database: Database=DATABASE, shards: int=1) -> t.List[IdRange]:
+    """
+        Splits the `servers` table into (up to) `shards` inclusive ID ranges with about the same number of servers in each
+        (IDs aren't contiguous after deletions and merges, so the boundaries are looked up on the primary key index).
+    """
+
+    count = DB_Server.select(fn.COUNT(DB_Server.id)).bind(database).scalar() or 0
+    if not count:
+        return []
+
+    shards = max(1, min(shards, count))
+    starts = [
+        DB_Server.select(DB_Server.id).order_by(DB_Server.id).offset(count * shard // shards).limit(1).bind(database).scalar()
+        for shard in range(shards)
+    ]
+    last_id = DB_Server.select(fn.MAX(DB_Server.id)).bind(database).scalar()
+
+    return [(start, end - 1) for start, end in zip(starts, starts[1:])] + [(starts[-1], last_id)]
+
+
+
+def _run_shard(
+    index: int,
+    id_range: IdRange,
+    database_path: str,
+    profile: DatabaseProfile,
+    results: multiprocessing.Queue,
+    options: t.Dict[str, t.Any]
+) -> None:
+    """
+        Entry point of a worker process. Sends `('results', index, [PingedServer, ...])` messages while pinging
+        and a final `('done', index, <traceback or None>)` one.
+    """
+
+    error = None
+
+    try:
+        asyncio.run(_sweep_shard(index, id_range, SqliteDatabase(database_path, pragmas=profile.pragmas), results, **options))
+
+    except KeyboardInterrupt:
+        return
+
+    except Exception:
+        error = traceback.format_exc()
+
+    results.put(('done', index, error))
+
+
+
+async def _sweep_shard(
+    index: int,
+    id_range: IdRange,
+    database: Database,
+    results: multiprocessing.Queue,
+    at_once: int=100,
+    concurrency: int=PING_CONCURRENCY,
+    timeout: t.Optional[float]=PING_TIMEOUT,
+    rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+    resolve_dns: bool=False,
+    client: PingClient=PING_CLIENT,
+    batch_size: int=SWEEP_BATCH_SIZE,
+    batch_interval: float=SWEEP_BATCH_INTERVAL,
+    **filters
+) -> None:
+    loop = asyncio.get_running_loop()
+    servers = (server for servers in yield_servers_from_database(database=database, at_once=at_once, id_range=id_range, **filters) for server in servers)
+    resolver = None
+
+    if resolve_dns:
+        from mst.resolver import Resolver # dnspython is only imported when it's used
+        resolver = Resolver()
+
+    batch: t.List[PingedServer] = []
+    last_sent = time.monotonic()
+
+
+    async def send() -> None:
+        nonlocal batch, last_sent
+
+        # `put` blocks when the parent falls behind, don't block the pings in flight:
+        if batch:
+            await loop.run_in_executor(None, results.put, ('results', index, batch))
+        batch, last_sent = [], time.monotonic()
+
+
+    async for statuses in ping_window(servers, concurrency=concurrency, timeout=timeout, rate_limit=rate_limit, resolver=resolver, client=client):
+        batch.extend(statuses)
+
+        if len(batch) >= batch_size or time.monotonic() - last_sent >= batch_interval:
+            await send()
+
+    await send()
+    database.close()
+
+
+
+async def sweep(
+    database: Database=DATABASE,
+    shards: t.Optional[int]=SWEEP_SHARDS,
+    concurrency: int=PING_CONCURRENCY,
+    rate_limit: t.Optional[float]=PING_RATE_LIMIT,
+    **options
+) -> int:
+    """
+        Pings all servers from the database with `shards` worker processes (one per CPU core by default) and saves the results.
+        Returns the number of pinged servers.
+
+        - `concurrency` - Max. pings in flight per worker
+        - `rate_limit` - Max. pings started per second by all workers together
+        - `options` - Passed to the workers: `at_once`, `timeout`, `resolve_dns`, `client` and `queries.yield_servers_from_database` filters
+    """
+
+    ranges = shard_ranges(database, shards or os.cpu_count() or 1)
+    if not ranges:
+        return 0
+
+    options.update(concurrency=concurrency, rate_limit=rate_limit / len(ranges) if rate_limit else rate_limit)
+    profile = getattr(database, 'profile', DATABASE_PROFILES['default'])
+
+    # `spawn` - forked children would share the parent's SQLite connection and event loop:
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue(maxsize=len(ranges) * 4)
+    workers = [
+        context.Process(target=_run_shard, args=(index, id_range, str(database.database), profile, results, options), name=f'mst-sweep-{index}', daemon=True)
+        for index, id_range in enumerate(ranges)
+    ]
+
+    loop = asyncio.get_running_loop()
+    running = set(range(len(workers)))
+    pinged = 0
+
+    for worker in workers:
+        worker.start()
+
+    try:
+        async with DatabaseWriterThread(database=database) as writer:
+            while running:
+                try:
+                    kind, index, payload = await loop.run_in_executor(None, results.get, True, 1.0)
+
+                except queue.Empty:
+                    dead = [index for index in running if not workers[index].is_alive()]
+                    if dead:
+                        raise SweepError(f"Sweep worker {dead[0]} (servers {ranges[dead[0]][0]}-{ranges[dead[0]][1]}) died with exit code {workers[dead[0]].exitcode}")
+
+                    continue
+
+                if kind == 'results':
+                    await writer.put_many(payload)
+                    pinged += len(payload)
+                    continue
+
+                running.discard(index)
+                if payload:
+                    raise SweepError(f"Sweep worker {index} (servers {ranges[index][0]}-{ranges[index][1]}) failed:\n{payload}")
+
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+            worker.join()
+
+    return pinged
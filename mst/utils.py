@@ -0,0 +1,143 @@
+"""
+    Small helpers shared by the scrapping, pinging and database code.
+"""
+
+import typing as t
+
+import asyncio
+import dataclasses
+import sys
+
+
+_T = t.TypeVar('_T')
+_C = t.TypeVar('_C', bound=type)
+
+
+
+def slotted(cls: _C) -> _C:
+    """
+        Recreates a dataclass with `__slots__` (such as `@dataclass(slots=True)`, which needs Python 3.10), so its instances
+        don't carry a `__dict__` - they take less memory and are faster to create. Use it above `@dataclass`.
+    """
+
+    names = tuple(field.name for field in dataclasses.fields(cls))
+
+    # Defaults are already in the generated `__init__`, as class attributes they would clash with the slots:
+    namespace = {key: value for key, value in cls.__dict__.items() if key not in (*names, '__dict__', '__weakref__')}
+    namespace['__slots__'] = names
+
+    slotted_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+    slotted_cls.__qualname__ = cls.__qualname__
+
+    return t.cast(_C, slotted_cls)
+
+
+
+def intern(string: t.Optional[str]) -> t.Optional[str]:
+    """
+        `sys.intern`, which lets `None` through - for strings repeated over many results (sources, versions), so they're stored once.
+    """
+
+    return sys.intern(string) if string is not None else None
+
+
+
+class RateLimiter():
+    """
+        Spaces out calls to `wait()` so that at most `rate` of them go through per second.
+        A `rate` of `None` (or `0`) disables the limit.
+    """
+
+    def __init__(self, rate: t.Optional[float]=None) -> None:
+        self.interval = (1 / rate) if rate else 0.0
+        self._next_slot = 0.0
+
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+
+async def aiterate(iterable: t.Union[t.Iterable[_T], t.AsyncIterable[_T]]) -> t.AsyncGenerator[_T, None]:
+    """
+        Iterates over both normal and asynchronous iterables.
+    """
+
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable: # type: ignore
+            yield item
+
+    else:
+        for item in iterable: # type: ignore
+            yield item
+
+
+
+class _Failure():
+    def __init__(self, exception: Exception) -> None:
+        self.exception = exception
+
+
+
+async def iterate_producers(queue: asyncio.Queue, *producers: t.Awaitable[None]) -> t.AsyncGenerator[t.Any, None]:
+    """
+        Runs `producers` (coroutines putting items into `queue`) concurrently and yields the items as they come.
+
+        If any producer fails, the rest of them is cancelled and the error is raised here. Closing the generator cancels all producers.
+    """
+
+    done = object()
+    tasks = [asyncio.ensure_future(producer) for producer in producers]
+
+
+    async def run() -> None:
+        try:
+            await asyncio.gather(*tasks)
+
+        except Exception as exception:
+            for task in tasks:
+                task.cancel()
+
+            await queue.put(_Failure(exception))
+
+        finally:
+            await queue.put(done)
+
+
+    runner = asyncio.ensure_future(run())
+
+    try:
+        while True:
+            item = await queue.get()
+
+            if item is done:
+                break
+
+            if isinstance(item, _Failure):
+                raise item.exception
+
+            yield item
+
+    finally:
+        runner.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+
+async def flatten(iterables: t.Union[t.Iterable[t.Iterable[_T]], t.AsyncIterable[t.Iterable[_T]]]) -> t.AsyncGenerator[_T, None]:
+    """
+        Yields items of all iterables from a (normal or asynchronous) iterable of iterables, such as pages of servers.
+    """
+
+    async for iterable in aiterate(iterables):
+        for item in iterable:
+            yield item